@@ -1,649 +1,2095 @@
 import pjsua2 as pj
 
 
-from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 
 
 from fastapi.middleware.cors import CORSMiddleware
 
 
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+
 from pydantic import BaseModel
 
 
-from typing import Dict, Set, Optional, List
+from typing import Dict, Set, Optional, List
+
+
+from datetime import datetime
+
+
+import asyncio
+
+
+import json
+
+
+import os
+
+
+import socket
+
+
+import time
+
+
+import uuid
+
+
+from dataclasses import dataclass, asdict
+
+
+import threading
+
+
+import uvicorn
+
+
+import logging
+
+
+from structuredLog import call_logger, get_levels, set_level, setup_logging
+
+
+from eventBridge import bridge
+
+
+from mediaStream import ENCODINGS, attach_taps, detach_taps, hub, media_load
+
+
+from sharedAudio import rings
+
+
+from recorder import RECORDING_STORE, recording_location, wav_sink
+
+
+from vad import COMPACT_RECORDINGS, StreamingVad, process_file
+
+
+from compressTier import tier as compression
+
+
+from audioFetch import AudioSlice, RangeNotSatisfiable, build_source, find_recordings
+
+
+from rtpQuality import QUALITY_INTERVAL, from_stream_stat
+
+
+from dtmf import InbandSink, MuteController, MutingSink, digit_event
+
+
+from sipHeaders import CALL_DATA_FIELDS, CallIndex, header_table
+
+
+from chunkStore import STORE_DIR, default_store
+
+
+from admission import MAX_CALLS, AdmissionController, CallCounter
+
+
+from pjRecorder import RECORDER_MODE, RecorderMute, attach_recorders, configure_audio, configure_codecs, configure_endpoint, detach_recorders
+
+
+from pjRecorder import recorder_load, settings as media_settings
+
+
+from pjOwner import PjsuaOwner
+
+
+from loopWatchdog import collapsed, watchdog
+
+
+from handoff import DRAIN_TIMEOUT, RESTORE_GRACE, RESTORE_WINDOW, REUSE_PORT, listen_socket, mark_draining, predecessor_draining, take_snapshot, write_snapshot
+
+
+# FastAPI setup
+
+
+app = FastAPI(title="SIPREC Service")
+
+
+app.add_middleware(
+
+
+    CORSMiddleware,
+
+
+    allow_origins=["*"],
+
+
+    allow_credentials=True,
+
+
+    allow_methods=["*"],
+
+
+    allow_headers=["*"],
+
+
+)
+
+
+# Data Models
+
+
+class CallData(BaseModel):
+
+
+    call_id: str
+
+
+    seq_id: str
+
+
+    agent_dnis: str
+
+
+    start_time: datetime
+
+
+    audio_ports: Dict[str, int]
+
+
+    codec_info: Dict[str, str]
+
+
+    status: str = "active"
+
+
+    recordings: Dict[str, str] = {}
+
+
+    speech_segments: Dict[str, List[List[int]]] = {}
+
+
+    speech_ratio: Dict[str, float] = {}
+
+
+    quality: Dict[str, Dict[str, float]] = {}
+
+
+    recording_paused: bool = False
+
+
+    dtmf_digits: int = 0
+
+
+    acme_call_id: Optional[str] = None
+
+
+    ucid: Optional[str] = None
+
+
+    sip_headers: Dict[str, str] = {}
+
+
+# Global state
+
+
+active_calls: Dict[str, CallData] = {}
+
+
+active_connections: Dict[str, Set[WebSocket]] = {}
+
+
+CALL_HISTORY_SECONDS = 300  # finished calls stay in active_calls this long
+
+
+# "interrupted": handed over by a predecessor while still up; no call here carries it on
+
+
+FINISHED_STATUSES = ("completed", "interrupted")
+
+
+# Counted where calls are registered and finished rather than walked per INVITE
+
+
+calls_in_progress = CallCounter()
+
+
+def finish_call(call_data: CallData, status: str = "completed"):
+
+
+    if call_data.status not in FINISHED_STATUSES:
+
+
+        calls_in_progress.release()
+
+
+    call_data.status = status
+
+
+admission = AdmissionController(
+
+
+    active_calls=calls_in_progress,
+
+
+    bridge_depth=lambda: bridge.depth,
+
+
+    # No LegTaps to time in pjsua mode; recorder slots in use stand in
+
+
+    media_load=recorder_load if RECORDER_MODE == "pjsua" else media_load,
+
+
+    loop_lag=watchdog.lag_ms,
+
+
+)
+
+
+ep = None  # PJSUA2 Endpoint
+
+
+pjsua = PjsuaOwner()  # thread that creates and owns ep
+
+
+sip_account = None
+
+
+live_calls: Dict[str, "RecordingCall"] = {}  # calls with media taps attached
+
+
+# Every pjsua2 Call from INVITE to DISCONNECTED; pjsua2 only keeps a borrowed
+
+
+# pointer, so without this the proxy can be collected (and the call hung up)
+
+
+# before onCallMediaState ever runs
+
+
+pj_calls: Dict[str, "RecordingCall"] = {}
+
+
+call_index = CallIndex()  # UCID / X-Acme-Call-ID -> call ids in active_calls
+
+
+quality_task = None
+
+
+admission_task = None
+
+
+restore_task = None
+
+
+drain_task = None
+
+
+sip_transport_id = None
+
+
+call_log = logging.getLogger("cca.call")
+
+
+ws_log = logging.getLogger("cca.ws")
+
+
+def encode_event(event: str, data) -> str:
+
+
+    """Serialize a WebSocket event once; datetimes go out as ISO strings"""
+
+
+    return json.dumps({"event": event, "data": data}, default=str)
+
+
+async def send_to_agent(agent_dnis: str, message: str) -> int:
+
+
+    """Fan one encoded text frame out to every socket of an agent"""
+
+
+    sockets = list(active_connections.get(agent_dnis, ()))
+
+
+    for ws in sockets:
+
+
+        try:
+
+
+            subscriber = hub.subscriber_for(ws)
+
+
+            if subscriber:
+
+
+                subscriber.offer_control(message)
+
+
+            else:
+
+
+                await ws.send_text(message)
+
+
+        except Exception as e:
+
+
+            ws_log.warning("WebSocket send failed: %s", e, extra={"agent_dnis": agent_dnis})
+
+
+    return len(sockets)
+
+
+async def notify_websockets(call_data: CallData):
+
+
+    if call_data.agent_dnis in active_connections:
+
+
+        # Encode once and fan the same text frame out to every socket
+
+
+        sent = await send_to_agent(call_data.agent_dnis, encode_event("call_update", call_data.dict()))
+
+
+        ws_log.debug("Sent update to %d sockets", sent, extra={"call_id": call_data.call_id, "agent_dnis": call_data.agent_dnis})
+
+
+def extract_call_headers(message) -> Dict[str, str]:
+
+
+    """CallData fields from the configured INVITE headers and the rs-metadata UCID, in one pass over the whole message"""
+
+
+    found, ucid = header_table.extract_message(message)
+
+
+    fields = {field: found.pop(field) for field in CALL_DATA_FIELDS if field in found}
+
+
+    fields["ucid"] = ucid
+
+
+    fields["sip_headers"] = found
+
+
+    return fields
+
+
+def invite_message(prm) -> str:
+
+
+    """The INVITE as received (pjsua2's OnIncomingCallParam has no header accessor, only rdata)"""
+
+
+    rdata = getattr(prm, "rdata", None)
+
+
+    return getattr(rdata, "wholeMsg", "") or ""
+
+
+def invite_source(prm) -> str:
+
+
+    """Sending host of the INVITE (rdata.srcAddress is "ip:port")"""
+
+
+    rdata = getattr(prm, "rdata", None)
+
+
+    address = getattr(rdata, "srcAddress", "") or ""
+
+
+    host, sep, _ = address.rpartition(":")
+
+
+    return (host if sep else address).strip("[]")
+
+
+def reject_call(call, decision):
+
+
+    """Final 503 with Retry-After so the SBC fails over instead of waiting on us"""
+
+
+    call_prm = pj.CallOpParam()
+
+
+    call_prm.statusCode = decision.status
+
+
+    call_prm.reason = "Service Unavailable"
+
+
+    retry = pj.SipHeader()
+
+
+    retry.hName = "Retry-After"
+
+
+    retry.hValue = str(decision.retry_after)
+
+
+    call_prm.txOption.headers.append(retry)
+
+
+    call.answer(call_prm)
+
+
+def register_call(call_data: CallData):
+
+
+    previous = active_calls.get(call_data.call_id)
+
+
+    if previous is not None and previous.status not in FINISHED_STATUSES:
+
+
+        calls_in_progress.release()
+
+
+    if call_data.status not in FINISHED_STATUSES:
+
+
+        calls_in_progress.admit()
+
+
+    active_calls[call_data.call_id] = call_data
+
+
+    call_index.add(call_data.call_id, {"ucid": call_data.ucid, "acme_call_id": call_data.acme_call_id})
+
+
+async def cleanup_call(call_id: str, delay: float):
+
+
+    """Forget a finished call once its history window has passed"""
+
+
+    await asyncio.sleep(delay)
+
+
+    rings.release(call_id)
+
+
+    if call_id in active_calls:
+
+
+        call_data = active_calls.pop(call_id)
+
+
+        if call_data.status not in FINISHED_STATUSES:
+
+
+            calls_in_progress.release()
+
+
+        call_index.remove(call_id, {"ucid": call_data.ucid, "acme_call_id": call_data.acme_call_id})
+
+
+        call_log.info("Cleaned up call", extra={"call_id": call_id})
+
+
+def add_speech_segment(call_id: str, leg: str, segment: List[int]):
+
+
+    if call_id in active_calls:
+
+
+        active_calls[call_id].speech_segments.setdefault(leg, []).append(segment)
+
+
+def vad_sink(call_id, agent_dnis, leg):
+
+
+    """Live VAD per leg; each closed segment is recorded on the loop"""
+
+
+    return StreamingVad(on_segment=lambda segment: bridge.submit(add_speech_segment, call_id, f"leg{leg}", segment))
+
+
+def set_recording_path(call_id: str, leg: str, path: str):
+
+
+    if call_id in active_calls:
+
+
+        active_calls[call_id].recordings[leg] = path
+
+
+def recording_compressed(call_id: str, leg: str, path: str):
+
+
+    bridge.submit(set_recording_path, call_id, leg, path)
+
+
+async def finalize_recording(call_id: str):
+
+
+    """Write VAD sidecars (and compact silences if enabled) once the legs are closed, then queue compression"""
+
+
+    call_data = active_calls.get(call_id)
+
+
+    if call_data is None:
+
+
+        return
+
+
+    for leg, path in call_data.recordings.items():
+
+
+        # No live VAD in pjsua mode, so the file is analysed from scratch
+
+
+        segments = call_data.speech_segments.get(leg, None if RECORDER_MODE == "pjsua" else [])
+
+
+        try:
+
+
+            meta = await asyncio.to_thread(process_file, path, COMPACT_RECORDINGS, segments)
+
+
+        except (FileNotFoundError, EOFError):
+
+
+            continue  # leg never carried audio, or it went to the chunk store
+
+
+        except Exception as e:
+
+
+            call_log.error("Post-call VAD failed for %s: %s", path, e, extra={"call_id": call_id})
+
+
+            continue
+
+
+        call_data.speech_ratio[leg] = meta["speech_ratio"]
+
+
+        compression.submit(path, call_id, leg, on_done=recording_compressed)
+
+
+    if call_data.ucid and RECORDING_STORE == "chunks":
+
+
+        await asyncio.to_thread(default_store().link_ucid, call_data.ucid, call_id)
+
+
+    await notify_websockets(call_data)
+
+
+def read_call_quality(call) -> Dict[str, dict]:
+
+
+    """pjmedia's per-stream RTCP receiver stats per leg; runs on a pjsip-registered thread and writes nothing"""
+
+
+    call_data = active_calls.get(call.call_id)
+
+
+    if call_data is None:
+
+
+        return {}
+
+
+    records = {}
+
+
+    for tap in list(call.taps):
+
+
+        try:
+
+
+            records[f"leg{tap.leg}"] = from_stream_stat(call.getStreamStat(tap.media_index), call_data.codec_info.get("name"))
+
+
+        except Exception:
+
+
+            continue  # stream already torn down
+
+
+    return records
+
+
+def apply_call_quality(call_id: str, records: Dict[str, dict]) -> bool:
+
+
+    """Copy quality records onto the call record; loop only, so call_data.quality has a single writer"""
+
+
+    call_data = active_calls.get(call_id)
+
+
+    if call_data is None:
+
+
+        return False
+
+
+    changed = False
+
+
+    for leg, record in records.items():
+
+
+        if call_data.quality.get(leg) != record:
+
+
+            call_data.quality[leg] = record
+
+
+            changed = True
+
+
+    return changed
+
+
+def sample_quality(calls) -> None:
+
+
+    """Read every live call's stats on the pjsua owner thread and hand them to the loop"""
+
+
+    samples = {call.call_id: read_call_quality(call) for call in calls}
+
+
+    bridge.submit(publish_quality, samples)
+
+
+async def publish_quality(samples: Dict[str, Dict[str, dict]]):
+
+
+    """Apply sampled quality and push one coalesced event per agent"""
+
+
+    updates: Dict[str, Dict[str, dict]] = {}
+
+
+    for call_id, records in samples.items():
+
+
+        if apply_call_quality(call_id, records):
+
+
+            call_data = active_calls[call_id]
+
+
+            updates.setdefault(call_data.agent_dnis, {})[call_id] = call_data.quality
+
+
+    for agent_dnis, calls in updates.items():
+
+
+        if agent_dnis in active_connections:
+
+
+            await send_to_agent(agent_dnis, encode_event("call_quality", calls))
+
+
+async def quality_monitor():
+
+
+    """Sample media quality every QUALITY_INTERVAL and push one coalesced event per agent"""
+
+
+    while True:
+
+
+        await asyncio.sleep(QUALITY_INTERVAL)
+
+
+        if not pjsua.is_ready or not live_calls:
+
+
+            continue
+
+
+        try:
+
+
+            # pjsua2 is only touched from its owner thread; results come back through the bridge
+
+
+            await pjsua.run(sample_quality, list(live_calls.values()))
+
+
+        except Exception as e:
+
+
+            call_log.error("Quality sampling failed: %s", e)
+
+
+async def dtmf_detected(call_id: str, leg: Optional[str], digit: str, source: str, at_ms: Optional[int]):
+
+
+    call_data = active_calls.get(call_id)
+
+
+    if call_data is None:
+
+
+        return
+
+
+    call_data.dtmf_digits += 1
+
+
+    await send_to_agent(call_data.agent_dnis, encode_event("dtmf", digit_event(call_id, leg, digit, source, at_ms)))
+
+
+async def recording_state_changed(call_id: str, event: str, at_ms: int):
+
+
+    call_data = active_calls.get(call_id)
+
+
+    if call_data is None:
+
+
+        return
+
+
+    call_data.recording_paused = event == "recording_paused"
+
+
+    call_log.info("Recording %s at %d ms", "paused" if call_data.recording_paused else "resumed", at_ms, extra={"call_id": call_id})
+
+
+    await send_to_agent(call_data.agent_dnis, encode_event(event, {"call_id": call_id, "at_ms": at_ms}))
+
+
+def handle_dtmf(call, leg: Optional[int], digit: str, source: str, at_ms: Optional[int] = None):
+
+
+    """Any detected digit mutes the stored recording around it; runs on pjsip/media threads"""
+
+
+    if call.mute is not None:
+
+
+        if at_ms is None:
+
+
+            call.mute.digit_now()
+
+
+        else:
+
+
+            call.mute.digit(at_ms)
+
+
+    bridge.submit(dtmf_detected, call.call_id, None if leg is None else f"leg{leg}", digit, source, at_ms)
+
+
+def start_media_taps(call):
+
+
+    """Tap each active audio leg once media is up; runs on a pjsip thread"""
+
+
+    if call.taps or call.call_id not in active_calls:
+
+
+        return
+
+
+    call_data = active_calls[call.call_id]
+
+
+    call_id = call.call_id
+
+
+    if RECORDER_MODE == "pjsua":
+
+
+        start_recorders(call, call_data)
+
+
+        return
+
+
+    call.mute = MuteController(on_change=lambda event, at_ms: bridge.submit(recording_state_changed, call_id, event, at_ms))
+
+
+    def recording_sink(call_id, agent_dnis, leg):
+
+
+        return MutingSink(wav_sink(call_id, agent_dnis, leg), call.mute)
+
+
+    def dtmf_sink(call_id, agent_dnis, leg):
+
+
+        return InbandSink((call_id, leg), lambda digit, at_ms: handle_dtmf(call, leg, digit, "inband", at_ms))
+
+
+    call.taps = attach_taps(call, call.call_id, call_data.agent_dnis, sink_factories=(rings.sink, recording_sink, vad_sink, dtmf_sink))
+
+
+    for tap in call.taps:
+
+
+        call_data.recordings[f"leg{tap.leg}"] = recording_location(call.call_id, tap.leg)
+
+
+    if call.taps:
+
+
+        live_calls[call.call_id] = call
+
+
+    call.log.debug("Attached %d media taps", len(call.taps))
+
+
+def start_recorders(call, call_data):
+
+
+    """Record each active audio leg with a pjsua2 recorder on the bridge; no Python on the media path"""
+
+
+    call_id = call.call_id
+
+
+    def register():
+
+
+        # The unmute timer runs on its own thread
+
+
+        if not ep.libIsThreadRegistered():
+
+
+            ep.libRegisterThread("recorder-mute")
+
+
+    call.taps = attach_recorders(call, call_id)
+
+
+    call.mute = RecorderMute(call.taps, on_change=lambda event, at_ms: bridge.submit(recording_state_changed, call_id, event, at_ms), register=register)
+
+
+    for recorder in call.taps:
+
+
+        call_data.recordings[f"leg{recorder.leg}"] = recorder.path
+
+
+    if call.taps:
+
+
+        live_calls[call_id] = call
+
+
+    call.log.debug("Attached %d pjsua recorders", len(call.taps))
+
+
+def stop_media_taps(call):
+
+
+    live_calls.pop(call.call_id, None)
+
+
+    # Final numbers, taken before the streams go away
+
+
+    bridge.submit(apply_call_quality, call.call_id, read_call_quality(call))
+
+
+    taps, call.taps = call.taps, []
+
+
+    if RECORDER_MODE == "pjsua":
+
+
+        if call.mute is not None:
+
+
+            call.mute.cancel()
+
+
+        detach_recorders(taps)
+
+
+    else:
+
+
+        detach_taps(call, taps)
+
+
+    if taps:
+
+
+        # Queued behind the final VAD segments flushed by detach_taps
+
+
+        bridge.submit(finalize_recording, call.call_id)
+
+
+class RecordingCall(pj.Call):
+
+
+    def __init__(self, acc, call_id=None):
+
+
+        pj.Call.__init__(self, acc)
+
+
+        self.call_id = call_id or str(uuid.uuid4())
+
+
+        self.log = call_logger(call_id=self.call_id)
+
+
+        self.taps = []
+
+
+        self.mute = None
+
+
+        self.log.info("New call created")
+
+
+    async def notify_websockets(self, call_data: CallData):
+
+
+        await notify_websockets(call_data)
+
+
+    @watchdog.timed("onStreamCreated")
+
+
+    def onStreamCreated(self, stream):
+
+
+        self.log.debug("Stream created")
+
+
+        if self.call_id in active_calls:
+
+
+            try:
+
+
+                mi = stream.getMediaInfo()
+
+
+                call_data = active_calls[self.call_id]
+
+
+                call_data.audio_ports[f"stream_{stream.getId()}"] = stream.getPort()
+
+
+                call_data.codec_info.update({
+
+
+                    "name": mi.codecInfo,
+
+
+                    "clock_rate": str(mi.clockRate),
+
+
+                    "channels": str(mi.channelCount)
+
+
+                })
+
+
+                bridge.submit(notify_websockets, call_data)
+
+
+                self.log.debug("Updated stream info: %s", call_data.codec_info)
+
+
+            except Exception as e:
+
+
+                self.log.error("Error in onStreamCreated: %s", e)
+
+
+    @watchdog.timed("onDtmfDigit")
+
+
+    def onDtmfDigit(self, prm):
+
+
+        source = "sip_info" if prm.method == getattr(pj, "PJSUA_DTMF_METHOD_SIP_INFO", -1) else "rfc4733"
+
+
+        handle_dtmf(self, None, prm.digit, source)
+
+
+    @watchdog.timed("onCallMediaState")
+
+
+    def onCallMediaState(self, prm):
+
+
+        try:
+
+
+            start_media_taps(self)
+
+
+        except Exception as e:
+
+
+            self.log.error("Error in onCallMediaState: %s", e)
+
+
+    @watchdog.timed("onCallState")
+
+
+    def onCallState(self, prm):
+
+
+        try:
+
+
+            ci = self.getInfo()
+
+
+            state = ci.state
+
+
+            self.log.debug("Call state: %s", state)
+
+
+            if state == pj.PJSIP_INV_STATE_DISCONNECTED:
+
+
+                pj_calls.pop(self.call_id, None)
+
+
+            if self.call_id in active_calls:
+
+
+                call_data = active_calls[self.call_id]
+
+
+                if state == pj.PJSIP_INV_STATE_DISCONNECTED:
+
+
+                    finish_call(call_data)
+
+
+                    stop_media_taps(self)
+
+
+                    bridge.submit(notify_websockets, call_data)
+
+
+                    # Keep call in memory for a while for history
+
+
+                    bridge.submit(cleanup_call, self.call_id, CALL_HISTORY_SECONDS)  # 5 minutes
+
+
+        except Exception as e:
+
+
+            self.log.error("Error in onCallState: %s", e)
+
+
+
+
+
+class SipAccount(pj.Account):
+
+
+    @watchdog.timed("onIncomingCall")
+
+
+    def onIncomingCall(self, prm):
+
+
+        call_log.debug("Incoming call received")
+
+
+        try:
+
+
+            call = RecordingCall(self)
+
+
+            pj_calls[call.call_id] = call
+
+
+            decision = admission.check(invite_source(prm))
+
+
+            if not decision.admitted:
+
+
+                call_log.info("Rejected call: %s", decision.reason, extra={"call_id": call.call_id})
+
+
+                reject_call(call, decision)
+
+
+                return
+
+
+            # Extract headers
+
+
+            headers = extract_call_headers(invite_message(prm))
+
+
+            # Create call data
+
+
+            call_data = CallData(
+
+
+                call_id=call.call_id,
+
+
+                start_time=datetime.now(),
+
+
+                audio_ports={},
+
+
+                codec_info={},
+
+
+                status="active",
+
+
+                **headers
+
+
+            )
+
+
+            register_call(call_data)
+
+
+            call.log.bind(agent_dnis=call_data.agent_dnis, seq_id=call_data.seq_id)
+
+
+            bridge.submit(notify_websockets, call_data)
+
+
+            call.log.info("Call stored")
+
+
+            # Auto-answer call
+
+
+            call_prm = pj.CallOpParam()
+
+
+            call_prm.statusCode = 200
+
+
+            call.answer(call_prm)
+
+
+        except Exception as e:
+
+
+            call_log.error("Error in onIncomingCall: %s", e)
+
+
+def reuse_port_option(config):
+
+
+    """Ask pjsip to set SO_REUSEPORT on the SIP listener so a replacement can bind next to us"""
+
+
+    if not REUSE_PORT or not hasattr(pj, "SockOpt"):
+
+
+        return
+
+
+    option = pj.SockOpt()
+
+
+    option.level = socket.SOL_SOCKET
+
+
+    option.optName = socket.SO_REUSEPORT
+
+
+    option.setOptValInt(1)
+
+
+    config.sockOptParams.sockOpts.append(option)
+
+
+def init_pjsua():
+
+
+    """Create the endpoint, SIP transport and account; runs on the pjsua owner thread"""
+
+
+    global ep, sip_transport_id, sip_account
+
+
+    try:
+
+
+        # Create endpoint
+
+
+        ep = pj.Endpoint()
+
+
+        ep.libCreate()
+
+
+        # Configure endpoint
+
+
+        ep_cfg = pj.EpConfig()
+
+
+        if RECORDER_MODE == "pjsua":
+
+
+            configure_endpoint(ep_cfg, MAX_CALLS)
+
+
+        else:
+
+
+            ep_cfg.uaConfig.maxCalls = MAX_CALLS
+
+
+        ep_cfg.medConfig.enableIce = False
+
+
+        ep_cfg.medConfig.enableRtcp = True
+
+
+        # Initialize endpoint
+
+
+        ep.libInit(ep_cfg)
+
+
+        # Create transport
+
+
+        sipTpConfig = pj.TransportConfig()
+
+
+        sipTpConfig.port = 5060
+
+
+        reuse_port_option(sipTpConfig)
+
+
+        sip_transport_id = ep.transportCreate(pj.PJSIP_TRANSPORT_TCP, sipTpConfig)
+
+
+        # Start PJSUA2
+
+
+        ep.libStart()
+
+
+        if RECORDER_MODE == "pjsua":
+
+
+            # Headless recorder: null sound device, configured codecs only
+
+
+            configure_audio(ep)
+
+
+            configure_codecs(ep)
+
+
+        # Account configuration
+
+
+        acc_cfg = pj.AccountConfig()
+
+
+        acc_cfg.idUri = "sip:recorder@localhost"
+
+
+        acc_cfg.regConfig.registrarUri = "sip:your_sbc_ip:5060"
+
+
+        # Create account (kept referenced so pjsua2 doesn't lose it)
+
+
+        sip_account = SipAccount()
+
+
+        sip_account.create(acc_cfg)
+
+
+        print("PJSUA2 initialized successfully")
+
+
+        return True
+
+
+    except Exception as e:
+
+
+        print(f"Error initializing PJSUA2: {e}")
+
+
+        return False
+
+
+# WebSocket endpoint
+
+
+@app.websocket("/ws/agent/{agent_dnis}")
+
+
+async def agent_stream(websocket: WebSocket, agent_dnis: str, audio: Optional[str] = None):
+
+
+    await websocket.accept()
+
+
+    audio_feed = None
+
+
+    ws_log.info("WebSocket connected", extra={"agent_dnis": agent_dnis})
+
+
+    if agent_dnis not in active_connections:
+
+
+        active_connections[agent_dnis] = set()
+
+
+    active_connections[agent_dnis].add(websocket)
+
+
+    try:
+
+
+        # Send initial state
+
+
+        agent_calls = {
+
+
+            call_id: call_data.dict()
+
+
+            for call_id, call_data in active_calls.items()
+
+
+            if call_data.agent_dnis == agent_dnis
+
+
+        }
+
+
+        await websocket.send_text(encode_event("initial_state", agent_calls))
+
+
+        # Binary audio is opt-in: ?audio=<encoding> or an audio_subscribe command
+
+
+        if audio:
+
+
+            audio_feed = await subscribe_audio(websocket, agent_dnis, audio)
+
+
+        # Keep connection alive
+
+
+        while True:
+
+
+            data = await websocket.receive_text()
+
+
+            if data == "ping":
+
+
+                await websocket.send_text("pong")
+
+
+            elif data.startswith("{"):
+
+
+                command = json.loads(data)
+
+
+                action = command.get("action")
+
+
+                if action == "audio_subscribe" and not audio_feed:
+
+
+                    audio_feed = await subscribe_audio(websocket, agent_dnis, command.get("encoding", "pcm16"))
+
+
+                elif action == "audio_unsubscribe" and audio_feed:
+
+
+                    hub.unsubscribe(agent_dnis, audio_feed)
+
+
+                    audio_feed = None
+
+
+                    await websocket.send_text(encode_event("audio_unsubscribed", {}))
+
+
+    except Exception as e:
+
+
+        ws_log.warning("WebSocket error: %s", e, extra={"agent_dnis": agent_dnis})
+
+
+    finally:
 
 
-from datetime import datetime
+        if audio_feed:
 
 
-import asyncio
+            hub.unsubscribe(agent_dnis, audio_feed)
 
 
-import json
+        active_connections[agent_dnis].remove(websocket)
 
 
-import uuid
+        if not active_connections[agent_dnis]:
 
 
-from dataclasses import dataclass, asdict
+            del active_connections[agent_dnis]
 
 
-import threading
+        ws_log.info("WebSocket disconnected", extra={"agent_dnis": agent_dnis})
 
 
-import uvicorn
+async def subscribe_audio(websocket: WebSocket, agent_dnis: str, encoding: str):
 
 
-# FastAPI setup
+    """Start the binary audio feed for this socket, or say why not"""
 
 
-app = FastAPI(title="SIPREC Service")
+    if encoding not in ENCODINGS:
 
 
-app.add_middleware(
+        await websocket.send_text(encode_event("audio_error", {"detail": f"Unknown encoding {encoding}", "encodings": list(ENCODINGS)}))
 
 
-    CORSMiddleware,
+        return None
 
 
-    allow_origins=["*"],
+    feed = hub.subscribe(agent_dnis, websocket, encoding)
 
 
-    allow_credentials=True,
+    feed.offer_control(encode_event("audio_subscribed", {"encoding": encoding}))
 
 
-    allow_methods=["*"],
+    return feed
 
 
-    allow_headers=["*"],
+# REST endpoints
 
 
-)
+@app.get("/calls")
 
 
-# Data Models
+async def get_calls():
 
 
-class CallData(BaseModel):
+    """Get all active calls"""
 
 
-    call_id: str
+    return {"calls": {k: v.dict() for k, v in active_calls.items()}}
 
 
-    seq_id: str
+@app.get("/calls/{call_id}")
 
 
-    agent_dnis: str
+async def get_call(call_id: str):
 
 
-    start_time: datetime
+    """Get specific call details"""
 
 
-    audio_ports: Dict[str, int]
+    if call_id not in active_calls:
 
 
-    codec_info: Dict[str, str]
+        raise HTTPException(status_code=404, detail="Call not found")
 
 
-    status: str = "active"
+    return active_calls[call_id]
 
 
-# Global state
+@app.get("/calls/{call_id}/audio")
 
 
-active_calls: Dict[str, CallData] = {}
+async def get_call_audio(call_id: str, request: Request, leg: Optional[str] = None, channel: Optional[int] = None,
 
 
-active_connections: Dict[str, Set[WebSocket]] = {}
+                         start_ms: Optional[int] = None, end_ms: Optional[int] = None):
 
 
-ep = None  # PJSUA2 Endpoint
+    """Stream a call's recording as WAV; supports Range, time slicing and per-leg/channel selection"""
 
 
-class RecordingCall(pj.Call):
+    if call_id in active_calls and active_calls[call_id].recordings:
 
 
-    def __init__(self, acc, call_id=None):
+        recordings = dict(active_calls[call_id].recordings)
 
 
-        pj.Call.__init__(self, acc)
+    else:
 
 
-        self.call_id = call_id or str(uuid.uuid4())
+        recordings = await asyncio.to_thread(find_recordings, call_id)
 
 
-        print(f"New call created with ID: {self.call_id}")
+    try:
 
 
-    async def notify_websockets(self, call_data: CallData):
+        source = await asyncio.to_thread(build_source, recordings, leg, channel)
 
 
-        if call_data.agent_dnis in active_connections:
+    except (FileNotFoundError, KeyError):
 
 
-            message = {
+        raise HTTPException(status_code=404, detail="Recording not found")
 
 
-                "event": "call_update",
+    except ValueError as e:
 
 
-                "data": call_data.dict()
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-            }
+    audio = AudioSlice(source, start_ms, end_ms)
 
 
-            for ws in active_connections[call_data.agent_dnis]:
+    try:
 
 
-                try:
+        byte_range = audio.parse_range(request.headers.get("range"))
 
 
-                    await ws.send_json(message)
+    except RangeNotSatisfiable:
 
 
-                    print(f"Sent update to agent {call_data.agent_dnis}")
+        audio.close()
 
 
-                except Exception as e:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{audio.size}"})
 
 
-                    print(f"WebSocket send failed: {e}")
+    start, end = byte_range or (0, audio.size - 1)
 
 
-    def onStreamCreated(self, stream):
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start + 1)}
 
 
-        print(f"Stream created for call {self.call_id}")
+    if byte_range:
 
 
-        if self.call_id in active_calls:
+        headers["Content-Range"] = f"bytes {start}-{end}/{audio.size}"
 
 
-            try:
+    def body():
 
 
-                mi = stream.getMediaInfo()
+        try:
 
 
-                call_data = active_calls[self.call_id]
+            yield from audio.iter_bytes(start, end)
 
 
-                call_data.audio_ports[f"stream_{stream.getId()}"] = stream.getPort()
+        finally:
 
 
-                call_data.codec_info.update({
+            audio.close()
 
 
-                    "name": mi.codecInfo,
+    return StreamingResponse(body(), status_code=206 if byte_range else 200, media_type="audio/wav", headers=headers)
 
 
-                    "clock_rate": str(mi.clockRate),
+@app.get("/calls/ucid/{ucid}")
 
 
-                    "channels": str(mi.channelCount)
+async def get_ucid_calls(ucid: str):
 
 
-                })
+    """Every recording for a UCID: active calls from the index, finished ones from the chunk store"""
 
 
-                asyncio.create_task(self.notify_websockets(call_data))
+    calls = {call_id: active_calls[call_id] for call_id in call_index.lookup("ucid", ucid) if call_id in active_calls}
 
 
-                print(f"Updated stream info: {call_data}")
+    archived = []
 
 
-            except Exception as e:
+    if os.path.isdir(STORE_DIR):
 
 
-                print(f"Error in onStreamCreated: {e}")
+        archived = [call_id for call_id in await asyncio.to_thread(default_store().calls_for_ucid, ucid) if call_id not in calls]
 
 
-    def onCallState(self, prm):
+    if not calls and not archived:
 
 
-        try:
+        raise HTTPException(status_code=404, detail="No calls for this UCID")
 
 
-            ci = self.getInfo()
+    return {"ucid": ucid, "calls": calls, "archived": archived}
 
 
-            state = ci.state
+@app.get("/calls/acme/{acme_call_id}")
 
 
-            print(f"Call {self.call_id} state: {state}")
+async def get_acme_calls(acme_call_id: str):
 
 
-            if self.call_id in active_calls:
+    """Active calls carrying this X-Acme-Call-ID"""
 
 
-                call_data = active_calls[self.call_id]
+    calls = {call_id: active_calls[call_id] for call_id in call_index.lookup("acme_call_id", acme_call_id) if call_id in active_calls}
 
 
-                if state == pj.PJSIP_INV_STATE_DISCONNECTED:
+    if not calls:
 
 
-                    call_data.status = "completed"
+        raise HTTPException(status_code=404, detail="Call not found")
 
 
-                    asyncio.create_task(self.notify_websockets(call_data))
+    return {"acme_call_id": acme_call_id, "calls": calls}
 
 
-                    # Keep call in memory for a while for history
+@app.get("/calls/agent/{agent_dnis}")
 
 
-                    asyncio.create_task(self.cleanup_call(delay=300))  # 5 minutes
+async def get_agent_calls(agent_dnis: str):
 
 
-        except Exception as e:
+    """Get all calls for specific agent"""
 
 
-            print(f"Error in onCallState: {e}")
+    agent_calls = {
 
 
-    async def cleanup_call(self, delay):
+        call_id: call_data 
 
 
-        await asyncio.sleep(delay)
+        for call_id, call_data in active_calls.items() 
 
 
-        if self.call_id in active_calls:
+        if call_data.agent_dnis == agent_dnis
 
 
-            del active_calls[self.call_id]
+    }
 
 
-            print(f"Cleaned up call {self.call_id}")
+    return {"agent_calls": agent_calls}
 
 
-class SipAccount(pj.Account):
+@app.get("/debug/log-level")
 
 
-    def onIncomingCall(self, prm):
+async def get_log_level():
 
 
-        print("Incoming call received")
+    """Current log levels and how many records the queue had to drop"""
 
 
-        try:
+    return get_levels()
 
 
-            call = RecordingCall(self)
+@app.put("/debug/log-level")
 
 
-            # Extract headers
+async def put_log_level(level: str, logger: str = "cca"):
 
 
-            headers = prm.getRxHeader()
+    """Change a logger's level at runtime, e.g. ?level=DEBUG&logger=cca.call"""
 
 
-            seq_id = "unknown"
+    try:
 
 
-            agent_dnis = "unknown"
+        set_level(level, logger)
 
 
-            for header in headers:
+    except ValueError:
 
 
-                if "X-Sequence-ID" in header:
+        raise HTTPException(status_code=400, detail=f"Unknown log level {level}")
 
 
-                    seq_id = header.split(":")[1].strip()
+    return get_levels()
 
 
-                elif "X-Agent-DNIS" in header:
+@app.post("/admin/drain")
 
 
-                    agent_dnis = header.split(":")[1].strip()
+async def start_drain(timeout: float = DRAIN_TIMEOUT):
 
 
-            # Create call data
+    """Stop taking calls (503) and let the ones in progress finish; shutdown waits for this"""
 
 
-            call_data = CallData(
+    global drain_task
 
 
-                call_id=call.call_id,
+    admission.draining = True
 
 
-                seq_id=seq_id,
+    if drain_task is None:
 
 
-                agent_dnis=agent_dnis,
+        drain_task = asyncio.create_task(drain(timeout))
 
 
-                start_time=datetime.now(),
+    return {"draining": True, "calls_in_progress": calls_in_progress()}
 
 
-                audio_ports={},
+async def drain(timeout: float):
 
 
-                codec_info={},
+    """Reject new INVITEs, close the SIP listener, wait up to timeout for calls to end, then hang up the rest"""
 
 
-                status="active"
+    admission.draining = True
 
 
-            )
+    await asyncio.to_thread(mark_draining)
 
 
-            active_calls[call.call_id] = call_data
+    call_log.info("Draining: %d calls in progress", calls_in_progress())
 
 
-            asyncio.create_task(call.notify_websockets(call_data))
+    if pjsua.is_ready and sip_transport_id is not None:
 
 
-            print(f"Call stored: {call_data}")
+        try:
 
 
-            # Auto-answer call
+            # New connections go to the replacement; dialogs on open connections carry on
 
 
-            call_prm = pj.CallOpParam()
+            await pjsua.run(ep.transportClose, sip_transport_id)
 
 
-            call_prm.statusCode = 200
+        except Exception as e:
 
 
-            call.answer(call_prm)
+            call_log.warning("Could not close the SIP listener: %s", e)
 
 
-        except Exception as e:
+    deadline = time.monotonic() + timeout
 
 
-            print(f"Error in onIncomingCall: {e}")
+    while calls_in_progress() and time.monotonic() < deadline:
 
 
-def init_pjsua():
+        await asyncio.sleep(1)
 
 
-    global ep
+    if calls_in_progress() and pjsua.is_ready:
 
 
-    try:
+        call_log.warning("Drain deadline reached, hanging up %d calls", calls_in_progress())
 
 
-        # Create endpoint
+        await pjsua.run(ep.hangupAllCalls)
 
 
-        ep = pj.Endpoint()
+        # Let the disconnect callbacks close the legs and queue finalize_recording
 
 
-        ep.libCreate()
+        for _ in range(50):
 
 
-        # Configure endpoint
+            await asyncio.sleep(0.1)
 
 
-        ep_cfg = pj.EpConfig()
+            if not live_calls and not bridge.depth:
 
 
-        ep_cfg.uaConfig.maxCalls = 32
+                break
 
 
-        ep_cfg.medConfig.enableIce = False
+async def restore_state():
 
 
-        ep_cfg.medConfig.enableRtcp = True
+    """Pick up the call state a draining predecessor hands over; only waits while one is draining"""
 
 
-        # Initialize endpoint
+    started = time.monotonic()
 
 
-        ep.libInit(ep_cfg)
+    while True:
 
 
-        # Create transport
+        snapshot = await asyncio.to_thread(take_snapshot)
 
 
-        sipTpConfig = pj.TransportConfig()
+        if snapshot:
 
 
-        sipTpConfig.port = 5060
+            age = time.time() - snapshot.get("written_at", time.time())
 
 
-        ep.transportCreate(pj.PJSIP_TRANSPORT_TCP, sipTpConfig)
+            restored = 0
 
 
-        # Start PJSUA2
+            for call_id, data in snapshot.get("calls", {}).items():
 
 
-        ep.libStart()
+                if call_id in active_calls:
 
 
-        # Account configuration
+                    continue
 
 
-        acc_cfg = pj.AccountConfig()
+                call_data = CallData(**data)
 
 
-        acc_cfg.idUri = "sip:recorder@localhost"
+                if call_data.status not in FINISHED_STATUSES:
 
 
-        acc_cfg.regConfig.registrarUri = "sip:your_sbc_ip:5060"
+                    # Its media and dialog stayed with the old process
 
 
-        # Create account
+                    call_data.status = "interrupted"
 
 
-        acc = SipAccount()
+                register_call(call_data)
 
 
-        acc.create(acc_cfg)
+                asyncio.create_task(cleanup_call(call_id, max(0.0, CALL_HISTORY_SECONDS - age)))
 
 
-        print("PJSUA2 initialized successfully")
+                restored += 1
 
 
-        return True
+            call_log.info("Restored %d calls from pid %s", restored, snapshot.get("pid"))
 
 
-    except Exception as e:
+            return
 
 
-        print(f"Error initializing PJSUA2: {e}")
+        waited = time.monotonic() - started
 
 
-        return False
+        if waited >= RESTORE_WINDOW or waited >= RESTORE_GRACE and not await asyncio.to_thread(predecessor_draining):
 
 
-# WebSocket endpoint
+            return
 
 
-@app.websocket("/ws/agent/{agent_dnis}")
+        await asyncio.sleep(2)
 
 
-async def agent_stream(websocket: WebSocket, agent_dnis: str):
+@app.get("/health")
 
 
-    await websocket.accept()
+async def health_check():
 
 
-    print(f"WebSocket connected for agent {agent_dnis}")
+    """Service health check: live once the API answers, ready once pjsua2 is up and calls are admitted"""
 
 
-    if agent_dnis not in active_connections:
+    ready = pjsua.is_ready and not admission.draining
 
 
-        active_connections[agent_dnis] = set()
+    if admission.draining:
 
 
-    active_connections[agent_dnis].add(websocket)
+        status = "draining"
 
 
-    try:
+    elif pjsua.state in ("starting", "failed"):
 
 
-        # Send initial state
+        status = pjsua.state
 
 
-        agent_calls = {
+    else:
 
 
-            call_id: call_data.dict()
+        status = "healthy" if ready else "unhealthy"
 
 
-            for call_id, call_data in active_calls.items()
+    return {"status": status, "live": True, "ready": ready, "pjsua": pjsua.stats(), "admission": admission.stats(),
 
 
-            if call_data.agent_dnis == agent_dnis
+            "loop_lag_ms": round(watchdog.lag_ms(), 1), "media": media_settings() if RECORDER_MODE == "pjsua" else {"recorder_mode": RECORDER_MODE}}
 
 
-        }
+@app.get("/debug/watchdog")
 
 
-        await websocket.send_json({
+async def get_watchdog():
 
 
-            "event": "initial_state",
+    """Loop lag, pjsip callback latency, and the stacks captured during recent stalls"""
 
 
-            "data": agent_calls
+    return dict(watchdog.stats(), recent_stalls=list(watchdog.stalls))
 
 
-        })
+@app.get("/debug/profile", response_class=PlainTextResponse)
 
 
-        # Keep connection alive
+async def get_profile(seconds: float = 5, interval_ms: float = 5):
 
 
-        while True:
+    """Sample every thread's stack for N seconds; collapsed stacks for flamegraph.pl / speedscope"""
 
 
-            data = await websocket.receive_text()
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 1000:
 
 
-            if data == "ping":
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 60], interval_ms in [1, 1000]")
 
 
-                await websocket.send_text("pong")
+    try:
 
 
-    except Exception as e:
+        samples, counts = await asyncio.to_thread(watchdog.profile, seconds, interval_ms / 1000)
 
 
-        print(f"WebSocket error: {e}")
+    except RuntimeError as e:
 
 
-    finally:
+        raise HTTPException(status_code=409, detail=str(e))
 
 
-        active_connections[agent_dnis].remove(websocket)
+    return PlainTextResponse(collapsed(counts), headers={"X-Samples": str(samples)})
 
 
-        if not active_connections[agent_dnis]:
+@app.get("/health/live")
 
 
-            del active_connections[agent_dnis]
+async def liveness():
 
 
-        print(f"WebSocket disconnected for agent {agent_dnis}")
+    """The process and its event loop are responsive"""
 
 
-# REST endpoints
+    return {"status": "alive"}
 
 
-@app.get("/calls")
+@app.get("/health/ready")
 
 
-async def get_calls():
+async def readiness():
 
 
-    """Get all active calls"""
+    """200 only while SIP calls can be taken; 503 while pjsua2 starts, after it failed, or while draining"""
 
 
-    return {"calls": {k: v.dict() for k, v in active_calls.items()}}
+    if pjsua.is_ready and not admission.draining:
 
 
-@app.get("/calls/{call_id}")
+        return {"status": "ready", "pjsua": pjsua.stats()}
 
 
-async def get_call(call_id: str):
+    raise HTTPException(status_code=503, detail={"status": "draining" if admission.draining else pjsua.state, "pjsua": pjsua.stats()})
 
 
-    """Get specific call details"""
+# Startup and shutdown events
 
 
-    if call_id not in active_calls:
+@app.on_event("startup")
 
 
-        raise HTTPException(status_code=404, detail="Call not found")
+async def startup_event():
 
 
-    return active_calls[call_id]
+    global quality_task, admission_task, restore_task
 
 
-@app.get("/calls/agent/{agent_dnis}")
+    setup_logging()
 
 
-async def get_agent_calls(agent_dnis: str):
+    bridge.attach()
 
 
-    """Get all calls for specific agent"""
+    watchdog.start()
 
 
-    agent_calls = {
+    compression.start()
 
 
-        call_id: call_data 
+    # Endpoint creation and port binds happen on the owner thread; the API is up meanwhile
 
 
-        for call_id, call_data in active_calls.items() 
+    pjsua.start(init_pjsua)
 
 
-        if call_data.agent_dnis == agent_dnis
+    quality_task = asyncio.create_task(quality_monitor())
 
 
-    }
+    admission_task = asyncio.create_task(admission.monitor())
 
 
-    return {"agent_calls": agent_calls}
+    restore_task = asyncio.create_task(restore_state())
 
 
-@app.get("/health")
+@app.on_event("shutdown")
 
 
-async def health_check():
+async def shutdown_event():
 
 
-    """Service health check"""
+    # Finish (or cut at the deadline) the calls in progress before pjsip goes away
 
 
-    if ep and ep.libIsThreadRegistered():
+    if drain_task is None:
 
 
-        return {"status": "healthy"}
+        await drain(DRAIN_TIMEOUT)
 
 
-    return {"status": "unhealthy"}
+    else:
 
 
-# Startup and shutdown events
+        await drain_task
 
 
-@app.on_event("startup")
+    write_snapshot({call_id: call_data.dict() for call_id, call_data in active_calls.items()})
 
 
-async def startup_event():
+    for task in (quality_task, admission_task, restore_task):
 
 
-    if not init_pjsua():
+        if task:
 
 
-        raise Exception("Failed to initialize PJSUA2")
+            task.cancel()
 
 
-@app.on_event("shutdown")
+    watchdog.stop()
 
 
-async def shutdown_event():
+    rings.release_all()
+
+
+    compression.shutdown()
 
 
     if ep:
 
 
-        ep.libDestroy()
+        await pjsua.stop(ep.libDestroy)
 
 
         print("PJSUA2 shutdown complete")
@@ -652,7 +2098,22 @@ async def shutdown_event():
 if __name__ == "__main__":
 
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    port = int(os.environ.get("CCA_HTTP_PORT", "8000"))
+
+
+    if REUSE_PORT:
+
+
+        # Pre-bound with SO_REUSEPORT: the next instance starts serving while this one drains
+
+
+        uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=port)).run(sockets=[listen_socket("0.0.0.0", port)])
+
+
+    else:
+
+
+        uvicorn.run(app, host="0.0.0.0", port=port)
  
 class RecordingCall(pj.Call):
 
@@ -666,10 +2127,52 @@ class RecordingCall(pj.Call):
         self.call_id = call_id or str(uuid.uuid4())
 
 
+        self.log = call_logger(call_id=self.call_id)
+
+
+        self.taps = []
+
+
+        self.mute = None
+
+
         self.recording_started = False
 
 
-        print(f"New call created with ID: {self.call_id}")
+        self.log.info("New call created")
+
+
+    @watchdog.timed("onDtmfDigit")
+
+
+    def onDtmfDigit(self, prm):
+
+
+        source = "sip_info" if prm.method == getattr(pj, "PJSUA_DTMF_METHOD_SIP_INFO", -1) else "rfc4733"
+
+
+        handle_dtmf(self, None, prm.digit, source)
+
+
+    @watchdog.timed("onCallMediaState")
+
+
+    def onCallMediaState(self, prm):
+
+
+        try:
+
+
+            start_media_taps(self)
+
+
+        except Exception as e:
+
+
+            self.log.error("Error in onCallMediaState: %s", e)
+
+
+    @watchdog.timed("onCallState")
 
 
     def onCallState(self, prm):
@@ -684,7 +2187,7 @@ class RecordingCall(pj.Call):
             state = ci.state
 
 
-            print(f"Call {self.call_id} state: {state}")
+            self.log.debug("Call state: %s", state)
 
 
             if state == pj.PJSIP_INV_STATE_INCOMING:
@@ -702,7 +2205,7 @@ class RecordingCall(pj.Call):
                 self.answer(call_prm)
 
 
-                print(f"Sent 100 Trying for call {self.call_id}")
+                self.log.debug("Sent 100 Trying")
 
 
             elif state == pj.PJSIP_INV_STATE_EARLY:
@@ -720,7 +2223,7 @@ class RecordingCall(pj.Call):
                 self.answer(call_prm)
 
 
-                print(f"Sent 180 Ringing for call {self.call_id}")
+                self.log.debug("Sent 180 Ringing")
 
 
             elif state == pj.PJSIP_INV_STATE_CONNECTING:
@@ -744,7 +2247,7 @@ class RecordingCall(pj.Call):
                     self.recording_started = True
 
 
-                    print(f"Sent 200 OK and started recording for call {self.call_id}")
+                    self.log.info("Sent 200 OK and started recording")
 
 
             elif state == pj.PJSIP_INV_STATE_DISCONNECTED:
@@ -753,34 +2256,43 @@ class RecordingCall(pj.Call):
                 # Call ended
 
 
+                pj_calls.pop(self.call_id, None)
+
+
                 if self.call_id in active_calls:
 
 
                     call_data = active_calls[self.call_id]
 
 
-                    call_data.status = "completed"
+                    finish_call(call_data)
 
 
-                    asyncio.create_task(self.notify_websockets(call_data))
+                    stop_media_taps(self)
 
 
-                    asyncio.create_task(self.cleanup_call(delay=300))
+                    bridge.submit(notify_websockets, call_data)
 
 
-                print(f"Call {self.call_id} disconnected")
+                    bridge.submit(cleanup_call, self.call_id, CALL_HISTORY_SECONDS)
+
+
+                self.log.info("Call disconnected")
 
 
         except Exception as e:
 
 
-            print(f"Error in onCallState: {e}")
+            self.log.error("Error in onCallState: %s", e)
+
+
+    @watchdog.timed("onStreamCreated")
 
 
     def onStreamCreated(self, stream):
 
 
-        print(f"Stream created for call {self.call_id}")
+        self.log.debug("Stream created")
 
 
         try:
@@ -840,25 +2352,28 @@ class RecordingCall(pj.Call):
                 })
 
 
-                asyncio.create_task(self.notify_websockets(call_data))
+                bridge.submit(notify_websockets, call_data)
 
 
-                print(f"Started recording stream: {stream_id} for call {self.call_id}")
+                self.log.info("Started recording stream: %s", stream_id)
 
 
         except Exception as e:
 
 
-            print(f"Error configuring stream: {e}")
+            self.log.error("Error configuring stream: %s", e)
 
 
 class SipAccount(pj.Account):
 
 
+    @watchdog.timed("onIncomingCall")
+
+
     def onIncomingCall(self, prm):
 
 
-        print("Incoming SIPREC call received")
+        call_log.debug("Incoming SIPREC call received")
 
 
         try:
@@ -870,43 +2385,43 @@ class SipAccount(pj.Account):
             call = RecordingCall(self)
 
 
-            # Send immediate 100 Trying
+            pj_calls[call.call_id] = call
 
 
-            callOpParam = pj.CallOpParam()
+            # Shed load before anything is allocated for the call
 
 
-            callOpParam.statusCode = 100
+            decision = admission.check(invite_source(prm))
 
 
-            call.answer(callOpParam)
+            if not decision.admitted:
 
 
-            # Extract headers
+                call_log.info("Rejected call: %s", decision.reason, extra={"call_id": call.call_id})
 
 
-            headers = prm.getRxHeader()
+                reject_call(call, decision)
 
 
-            seq_id = "unknown"
+                return
 
 
-            agent_dnis = "unknown"
+            # Send immediate 100 Trying
 
 
-            for header in headers:
+            callOpParam = pj.CallOpParam()
 
 
-                if "X-Sequence-ID" in header:
+            callOpParam.statusCode = 100
 
 
-                    seq_id = header.split(":")[1].strip()
+            call.answer(callOpParam)
 
 
-                elif "X-Agent-DNIS" in header:
+            # Extract headers
 
 
-                    agent_dnis = header.split(":")[1].strip()
+            headers = extract_call_headers(invite_message(prm))
 
 
             # Create initial call data
@@ -918,12 +2433,6 @@ class SipAccount(pj.Account):
                 call_id=call.call_id,
 
 
-                seq_id=seq_id,
-
-
-                agent_dnis=agent_dnis,
-
-
                 start_time=datetime.now(),
 
 
@@ -933,19 +2442,25 @@ class SipAccount(pj.Account):
                 codec_info={},
 
 
-                status="establishing"
+                status="establishing",
+
+
+                **headers
 
 
             )
 
 
-            active_calls[call.call_id] = call_data
+            register_call(call_data)
+
+
+            call.log.bind(agent_dnis=call_data.agent_dnis, seq_id=call_data.seq_id)
 
 
-            asyncio.create_task(call.notify_websockets(call_data))
+            bridge.submit(notify_websockets, call_data)
 
 
-            print(f"Call establishment in progress: {call_data}")
+            call.log.info("Call establishment in progress")
 
 
             # Let call proceed to onCallState for further processing
@@ -954,7 +2469,7 @@ class SipAccount(pj.Account):
         except Exception as e:
 
 
-            print(f"Error handling incoming call: {e}")
+            call_log.error("Error handling incoming call: %s", e)
 
 
             # Send 500 if something went wrong
@@ -0,0 +1,162 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Overload limits; an INVITE arriving while any is exceeded gets 503 + Retry-After
+MAX_CALLS = int(os.environ.get("CCA_MAX_CALLS", "32"))  # matches uaConfig.maxCalls
+MAX_BRIDGE_DEPTH = int(os.environ.get("CCA_MAX_BRIDGE_DEPTH", "500"))
+MAX_LOOP_LAG_MS = float(os.environ.get("CCA_MAX_LOOP_LAG_MS", "250"))
+MAX_MEDIA_LOAD = float(os.environ.get("CCA_MAX_MEDIA_LOAD", "0.8"))  # tap sink time share, or recorder slots in use
+RETRY_AFTER = int(os.environ.get("CCA_RETRY_AFTER", "30"))
+
+# Per-source INVITE rate limit (token bucket), off by default: a SIPREC site
+# usually sends everything from one SBC, so a per-source limit is a limit on
+# the whole site. When enabled, size it for the SBC's peak call setup rate.
+SOURCE_RATE = float(os.environ.get("CCA_ADMIT_RATE", "0"))
+SOURCE_BURST = float(os.environ.get("CCA_ADMIT_BURST", "100"))
+
+SAMPLE_INTERVAL = 0.5
+
+Decision = namedtuple("Decision", "admitted status reason retry_after")
+ADMITTED = Decision(True, 200, None, 0)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    # 0 if a token was taken, else seconds until one is available
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class CallCounter:
+    # Calls in progress as admitted minus released, bumped where calls are
+    # added and finished, so reading it per INVITE is O(1) and never walks a
+    # dict another thread is changing
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.released = 0
+
+    def admit(self):
+        with self.lock:
+            self.admitted += 1
+
+    def release(self):
+        with self.lock:
+            self.released += 1
+
+    def __call__(self):
+        return self.admitted - self.released
+
+
+class AdmissionController:
+    # Decides per INVITE from signals that are already sampled, so check() is
+    # O(1) on the pjsip thread: the call count and bridge depth are read
+    # directly, loop lag and media load come from monitor() on the loop.
+    def __init__(self, active_calls, bridge_depth, media_load=None, loop_lag=None, max_calls=MAX_CALLS,
+                 max_bridge_depth=MAX_BRIDGE_DEPTH, max_loop_lag_ms=MAX_LOOP_LAG_MS, max_media_load=MAX_MEDIA_LOAD,
+                 rate=SOURCE_RATE, burst=SOURCE_BURST, clock=time.monotonic):
+        self.active_calls = active_calls
+        self.bridge_depth = bridge_depth
+        self.media_load = media_load
+        self.loop_lag = loop_lag
+        self.max_calls = max_calls
+        self.max_bridge_depth = max_bridge_depth
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.max_media_load = max_media_load
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.buckets = {}
+        self.loop_lag_ms = 0.0
+        self.media_utilization = 0.0
+        self.admitted = 0
+        self.rejected = {}
+        self.draining = False
+
+    # The first exceeded limit, or None
+    def overload(self):
+        if self.draining:
+            return "draining"
+        if self.active_calls() >= self.max_calls:
+            return "capacity"
+        if self.bridge_depth() >= self.max_bridge_depth:
+            return "bridge_backlog"
+        if self.loop_lag_ms >= self.max_loop_lag_ms:
+            return "loop_lag"
+        if self.media_utilization >= self.max_media_load:
+            return "media_backlog"
+        return None
+
+    def check(self, source):
+        reason = self.overload()
+        if reason is not None:
+            return self._reject(reason, RETRY_AFTER)
+        if self.rate <= 0:
+            self.admitted += 1
+            return ADMITTED
+        now = self.clock()
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            bucket = self.buckets[source] = TokenBucket(self.rate, self.burst, now)
+        wait = bucket.take(now)
+        if wait:
+            return self._reject("rate_limited", max(1, math.ceil(wait)))
+        self.admitted += 1
+        return ADMITTED
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return Decision(False, 503, reason, retry_after)
+
+    # Sample loop lag (how late a sleep wakes up, or the loop_lag() probe if
+    # one was given) and media thread load
+    async def monitor(self, interval=SAMPLE_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = self.loop_lag() if self.loop_lag else max(0.0, (loop.time() - started - interval) * 1000)
+            # Halve rather than forget a stall, so one good sample doesn't reopen the gate
+            self.loop_lag_ms = max(lag, self.loop_lag_ms / 2)
+            if self.media_load is not None:
+                self.media_utilization = self.media_load.sample()
+            self._prune()
+
+    # Buckets that have refilled completely carry no state worth keeping
+    def _prune(self):
+        now = self.clock()
+        idle = [source for source, bucket in list(self.buckets.items())
+                if bucket.tokens + (now - bucket.stamp) * bucket.rate >= bucket.burst]
+        for source in idle:
+            self.buckets.pop(source, None)
+
+    def stats(self):
+        return {
+            "active_calls": self.active_calls(),
+            "max_calls": self.max_calls,
+            "bridge_depth": self.bridge_depth(),
+            "loop_lag_ms": round(self.loop_lag_ms, 1),
+            "media_load": round(self.media_utilization, 3),
+            "overloaded": self.overload(),
+            "draining": self.draining,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "rate_limit": {"rate": self.rate, "burst": self.burst} if self.rate > 0 else None,
+            "sources": len(self.buckets),
+        }
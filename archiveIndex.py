@@ -0,0 +1,344 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from vad import StreamingVad
+
+DEFAULT_INDEX = os.environ.get("CCA_ARCHIVE_INDEX", "archive_index.sqlite")
+
+# Agent folders look like "sample audios-agent1"; the DNIS is what follows the last dash
+AGENT_DIR_PATTERN = os.environ.get("CCA_ARCHIVE_AGENT_PATTERN", r"-([^-]+)$")
+
+# Files handed to a worker per task, and tasks kept in flight per worker, so
+# the walk never queues more than a few thousand paths however big the tree is
+BATCH_FILES = 64
+TASKS_PER_WORKER = 4
+COMMIT_EVERY = 2000
+READ_BLOCK = 1 << 20
+
+WavHeader = namedtuple("WavHeader", "format channels sample_rate sample_width frames data_offset data_size")
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    agent_dnis TEXT,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    sample_width INTEGER,
+    duration_ms INTEGER,
+    rms_dbfs REAL,
+    speech_ratio REAL,
+    content_hash TEXT,
+    error TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_directory ON recordings (directory);
+CREATE INDEX IF NOT EXISTS recordings_agent ON recordings (agent_dnis);
+CREATE INDEX IF NOT EXISTS recordings_hash ON recordings (content_hash);
+"""
+
+COLUMNS = ("path", "directory", "agent_dnis", "size", "mtime_ns", "sample_rate", "channels",
+           "sample_width", "duration_ms", "rms_dbfs", "speech_ratio", "content_hash", "error", "indexed_at")
+
+
+class WavError(Exception):
+    pass
+
+
+# Parse the RIFF chunk list up to the data chunk; only headers are read
+def read_wav_header(f):
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise WavError("not a RIFF/WAVE file")
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise WavError("no data chunk")
+        chunk_id, size = struct.unpack("<4sI", chunk)
+        if chunk_id == b"fmt ":
+            body = f.read(size + (size & 1))
+            if len(body) < 16:
+                raise WavError("truncated fmt chunk")
+            fmt = struct.unpack_from("<HHIIHH", body)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                # The real format tag is the first two bytes of the sub-format GUID
+                fmt = (struct.unpack_from("<H", body, 24)[0],) + fmt[1:]
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavError("data chunk before fmt chunk")
+            tag, channels, rate, _, block_align, bits = fmt
+            offset = f.tell()
+            # Recorders that died mid-call leave 0 or 0xFFFFFFFF; trust the file size
+            available = f.seek(0, os.SEEK_END) - offset
+            f.seek(offset)
+            if size == 0 or size > available:
+                size = available
+            frames = size // block_align if block_align else 0
+            return WavHeader(tag, channels, rate, bits // 8, frames, offset, size)
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+# Map a file to its agent DNIS from the first directory under the archive root
+def agent_for(root, directory, pattern, dnis_map):
+    relative = os.path.relpath(directory, root)
+    top = os.path.basename(os.path.normpath(root)) if relative == "." else relative.split(os.sep)[0]
+    if top in dnis_map:
+        return dnis_map[top]
+    match = pattern.search(top)
+    return match.group(1) if match else top
+
+
+# Yield (directory, [(name, size, mtime_ns), ...]) for every directory holding WAVs
+def walk_wavs(root):
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        files = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(".wav") and entry.is_file():
+                        st = entry.stat()
+                        files.append((entry.name, st.st_size, st.st_mtime_ns))
+        except OSError as e:
+            print(f"Skipping {directory}: {e}", file=sys.stderr)
+            continue
+        if files:
+            yield directory, files
+
+
+# Worker: stream the data chunk once for hash, RMS and speech ratio
+def analyse_file(path, headers_only=False):
+    result = {"path": path, "error": None}
+    try:
+        with open(path, "rb") as f:
+            header = read_wav_header(f)
+            result.update(sample_rate=header.sample_rate, channels=header.channels, sample_width=header.sample_width,
+                          duration_ms=round(header.frames * 1000 / header.sample_rate) if header.sample_rate else 0)
+            if headers_only:
+                return result
+            if header.format != WAVE_FORMAT_PCM or header.sample_width != 2:
+                raise WavError(f"unsupported format {header.format}/{header.sample_width * 8}-bit")
+
+            digest = hashlib.blake2b(digest_size=16)
+            detector = StreamingVad(header.sample_rate)
+            energy = 0.0
+            samples = 0
+            remaining = header.data_size - header.data_size % (2 * header.channels)
+            block = READ_BLOCK - READ_BLOCK % (2 * header.channels)
+            while remaining > 0:
+                data = f.read(min(block, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                digest.update(data)
+                pcm = np.frombuffer(data, dtype="<i2")
+                if header.channels > 1:
+                    pcm = pcm.reshape(-1, header.channels).mean(axis=1).astype(np.int16)
+                as_float = pcm.astype(np.float64)
+                energy += float(np.dot(as_float, as_float))
+                samples += len(pcm)
+                detector.push(pcm)
+            detector.finish()
+
+        rms = (energy / samples) ** 0.5 if samples else 0.0
+        result.update(
+            rms_dbfs=round(20 * np.log10(rms / 32768.0), 2) if rms else None,
+            speech_ratio=round(detector.speech_ratio, 4),
+            content_hash=digest.hexdigest(),
+        )
+    except (OSError, WavError, ValueError, struct.error) as e:
+        result["error"] = str(e) or type(e).__name__
+    return result
+
+
+def analyse_batch(paths, headers_only=False):
+    return [analyse_file(path, headers_only) for path in paths]
+
+
+def open_index(path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+# Split one directory listing into files needing work, using size+mtime from the index.
+# Rows from a --headers-only pass are redone when a full pass asks for analysis.
+def pending_files(db, directory, files, headers_only=False):
+    analysed = "" if headers_only else " AND (content_hash IS NOT NULL OR error IS NOT NULL)"
+    known = {path: (size, mtime) for path, size, mtime in
+             db.execute(f"SELECT path, size, mtime_ns FROM recordings WHERE directory = ?{analysed}", (directory,))}
+    todo = []
+    for name, size, mtime in files:
+        path = os.path.join(directory, name)
+        if known.get(path) != (size, mtime):
+            todo.append((path, size, mtime))
+    return todo
+
+
+def ingest(root, index_path=DEFAULT_INDEX, workers=None, headers_only=False, dnis_map=None, prune=False):
+    root = os.path.abspath(root)
+    pattern = re.compile(AGENT_DIR_PATTERN)
+    dnis_map = dnis_map or {}
+    workers = workers or os.cpu_count() or 1
+    db = open_index(index_path)
+    stats = {"seen": 0, "skipped": 0, "indexed": 0, "errors": 0, "pruned": 0}
+    started = time.perf_counter()
+
+    pending = {}  # future -> {path: (directory, agent, size, mtime)}
+    rows = []
+
+    def collect(done):
+        for future in done:
+            info = pending.pop(future)
+            for result in future.result():
+                directory, agent, size, mtime = info[result["path"]]
+                row = dict.fromkeys(COLUMNS)
+                row.update(result, directory=directory, agent_dnis=agent, size=size, mtime_ns=mtime,
+                           indexed_at=time.time())
+                rows.append(tuple(row[c] for c in COLUMNS))
+                stats["errors" if result["error"] else "indexed"] += 1
+        if len(rows) >= COMMIT_EVERY:
+            flush()
+
+    # Committed rows are what makes a rerun resume instead of starting over
+    def flush():
+        if rows:
+            db.executemany(f"INSERT OR REPLACE INTO recordings ({', '.join(COLUMNS)}) "
+                           f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            db.commit()
+            rows.clear()
+
+    def submit(pool, batch):
+        future = pool.submit(analyse_batch, [path for path, _ in batch], headers_only)
+        pending[future] = dict(batch)
+        if len(pending) >= workers * TASKS_PER_WORKER:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            batch = []
+            for directory, files in walk_wavs(root):
+                stats["seen"] += len(files)
+                agent = agent_for(root, directory, pattern, dnis_map)
+                todo = pending_files(db, directory, files, headers_only)
+                stats["skipped"] += len(files) - len(todo)
+                if prune:
+                    stats["pruned"] += prune_directory(db, directory, files)
+                for path, size, mtime in todo:
+                    batch.append((path, (directory, agent, size, mtime)))
+                    if len(batch) >= BATCH_FILES:
+                        submit(pool, batch)
+                        batch = []
+            if batch:
+                submit(pool, batch)
+            while pending:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+    finally:
+        flush()
+        db.close()
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["files_per_sec"] = round((stats["indexed"] + stats["errors"]) / stats["seconds"], 1) if stats["seconds"] else 0
+    return stats
+
+
+# Drop index rows for files that have disappeared from a directory
+def prune_directory(db, directory, files):
+    present = {os.path.join(directory, name) for name, _, _ in files}
+    gone = [(path,) for (path,) in db.execute("SELECT path FROM recordings WHERE directory = ?", (directory,))
+            if path not in present]
+    db.executemany("DELETE FROM recordings WHERE path = ?", gone)
+    return len(gone)
+
+
+def summary(index_path=DEFAULT_INDEX):
+    db = open_index(index_path)
+    try:
+        agents = [dict(zip(("agent_dnis", "files", "hours", "avg_speech_ratio", "errors"), row)) for row in db.execute(
+            "SELECT agent_dnis, COUNT(*), ROUND(SUM(duration_ms) / 3600000.0, 3), ROUND(AVG(speech_ratio), 4), "
+            "COUNT(error) FROM recordings GROUP BY agent_dnis ORDER BY agent_dnis")]
+        duplicates = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(n - 1), 0) FROM (SELECT COUNT(*) AS n FROM recordings "
+            "WHERE content_hash IS NOT NULL GROUP BY content_hash HAVING n > 1)").fetchone()
+    finally:
+        db.close()
+    return {"agents": agents, "duplicate_groups": duplicates[0], "redundant_files": duplicates[1]}
+
+
+def query(index_path=DEFAULT_INDEX, agent_dnis=None, content_hash=None, limit=100):
+    db = open_index(index_path)
+    db.row_factory = sqlite3.Row
+    clauses, args = [], []
+    if agent_dnis:
+        clauses.append("agent_dnis = ?")
+        args.append(agent_dnis)
+    if content_hash:
+        clauses.append("content_hash = ?")
+        args.append(content_hash)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    try:
+        return [dict(row) for row in db.execute(f"SELECT * FROM recordings {where} ORDER BY path LIMIT ?", args + [limit])]
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index archived call recordings into SQLite")
+    parser.add_argument("--index", default=DEFAULT_INDEX, help="SQLite index file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("ingest", help="walk archive roots and (re)index new or changed WAVs")
+    run.add_argument("roots", nargs="+")
+    run.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    run.add_argument("--headers-only", action="store_true", help="record format and duration only")
+    run.add_argument("--dnis-map", help="JSON file mapping agent folder name to DNIS")
+    run.add_argument("--prune", action="store_true", help="drop rows for files no longer on disk")
+
+    commands.add_parser("summary", help="per-agent totals and duplicate content")
+
+    find = commands.add_parser("query", help="list indexed recordings")
+    find.add_argument("--agent")
+    find.add_argument("--hash")
+    find.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        dnis_map = {}
+        if args.dnis_map:
+            with open(args.dnis_map) as f:
+                dnis_map = json.load(f)
+        for root in args.roots:
+            stats = ingest(root, args.index, args.workers, args.headers_only, dnis_map, args.prune)
+            print(f"{root}: {json.dumps(stats)}")
+    elif args.command == "summary":
+        print(json.dumps(summary(args.index), indent=2))
+    else:
+        for row in query(args.index, args.agent, args.hash, args.limit):
+            print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import glob
+import io
+import mmap
+import os
+import re
+
+import numpy as np
+
+from archiveIndex import read_wav_header
+from chunkStore import STORE_DIR, default_store, wav_header
+from compressTier import FRAME_HEADER, FRAMED_HEADER, iter_framed, read_recording
+from recorder import call_dir
+from rtpArchive import archive_path, decoded_wav, RtpArchive
+
+STREAM_BLOCK = 256 * 1024
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class PcmSource:
+    # Common shape for every stored form: 16-bit PCM frames, read by frame range.
+    # read(start, count) returns something bytes-like; for plain WAVs it is a
+    # view straight into the mmap, so nothing is copied before the socket write.
+    sample_rate = 0
+    channels = 1
+    frames = 0
+
+    def read(self, start, count):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class WavSource(PcmSource):
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        header = read_wav_header(self.file)
+        if header.format != 1 or header.sample_width != 2:
+            self.file.close()
+            raise ValueError(f"{path}: only 16-bit PCM is served")
+        self.sample_rate, self.channels = header.sample_rate, header.channels
+        self.block = 2 * header.channels
+        self.frames = header.data_size // self.block
+        self.offset = header.data_offset
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.frames else None
+        self.view = memoryview(self.map) if self.map else memoryview(b"")
+
+    def read(self, start, count):
+        begin = self.offset + start * self.block
+        return self.view[begin:begin + count * self.block]
+
+    def close(self):
+        try:
+            self.view.release()
+            if self.map:
+                self.map.close()
+        except BufferError:
+            pass  # a response chunk still references the map; it goes with the last view
+        self.file.close()
+
+
+class FramedSource(PcmSource):
+    # .ccaf from the compression tier: only the frames covering a read are inflated
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            frames = iter_framed(f)
+            prefix, self.frame_samples = next(frames)
+            header = read_wav_header(io.BytesIO(prefix))
+            self.sample_rate, self.channels = header.sample_rate, header.channels
+            # Frame offsets come from walking the frame headers, not decoding
+            self.frame_offsets = []
+            position = FRAMED_HEADER.size + len(prefix)
+            f.seek(position)
+            raw_total = 0
+            while True:
+                head = f.read(FRAME_HEADER.size)
+                if len(head) < FRAME_HEADER.size:
+                    break
+                raw_len, packed_len = FRAME_HEADER.unpack(head)
+                self.frame_offsets.append(position)
+                raw_total += raw_len // 2
+                position += FRAME_HEADER.size + packed_len
+                f.seek(position)
+        self.frames = raw_total // self.channels
+        self.cache = {}
+
+    def _frame(self, index):
+        pcm = self.cache.get(index)
+        if pcm is None:
+            with open(self.path, "rb") as f:
+                frames = iter_framed(f)
+                next(frames)
+                f.seek(self.frame_offsets[index])
+                pcm = next(frames)
+            self.cache = {index: pcm}  # sequential reads only ever need the current frame
+        return pcm
+
+    def read(self, start, count):
+        first = start * self.channels
+        last = (start + count) * self.channels
+        out = []
+        while first < last:
+            index, within = divmod(first, self.frame_samples)
+            piece = self._frame(index)[within:within + last - first]
+            if not len(piece):
+                break
+            out.append(piece)
+            first += len(piece)
+        return b"".join(p.astype("<i2", copy=False).tobytes() for p in out)
+
+
+class ArraySource(PcmSource):
+    # Anything decoded up front (FLAC)
+    def __init__(self, pcm, sample_rate):
+        self.pcm = np.ascontiguousarray(pcm, dtype="<i2")
+        self.sample_rate = sample_rate
+        self.channels = 1 if self.pcm.ndim == 1 else self.pcm.shape[1]
+        self.frames = len(self.pcm)
+
+    def read(self, start, count):
+        return memoryview(self.pcm[start:start + count]).cast("B")
+
+
+class ChunkSource(PcmSource):
+    # chunks://<call_id>/<leg>: lazily reassembled from the content-addressed store
+    def __init__(self, location):
+        call_id, leg = location[len("chunks://"):].rsplit("/", 1)
+        self.file = default_store().open(call_id, leg)
+        header = read_wav_header(self.file)
+        self.sample_rate, self.channels = header.sample_rate, header.channels
+        self.block = 2 * header.channels
+        self.frames = header.data_size // self.block
+        self.offset = header.data_offset
+
+    def read(self, start, count):
+        self.file.seek(self.offset + start * self.block)
+        return self.file.read(count * self.block)
+
+    def close(self):
+        self.file.close()
+
+
+class ChannelSource(PcmSource):
+    # One channel of a multi-channel source, picked out of each read only
+    def __init__(self, source, channel):
+        self.source = source
+        self.channel = channel
+        self.sample_rate = source.sample_rate
+        self.frames = source.frames
+
+    def read(self, start, count):
+        pcm = np.frombuffer(self.source.read(start, count), dtype="<i2").reshape(-1, self.source.channels)
+        return memoryview(np.ascontiguousarray(pcm[:, self.channel])).cast("B")
+
+    def close(self):
+        self.source.close()
+
+
+class LegMix(PcmSource):
+    # Every leg as one channel, interleaved per read; shorter legs pad with silence
+    def __init__(self, sources):
+        rates = {s.sample_rate for s in sources}
+        if len(rates) > 1:
+            raise ValueError("legs have different sample rates")
+        self.sources = sources
+        self.sample_rate = rates.pop()
+        self.channels = len(sources)
+        self.frames = max(s.frames for s in sources)
+
+    def read(self, start, count):
+        count = max(0, min(count, self.frames - start))
+        mixed = np.zeros((count, self.channels), dtype="<i2")
+        for column, source in enumerate(self.sources):
+            available = min(count, source.frames - start)
+            if available > 0:
+                pcm = np.frombuffer(source.read(start, available), dtype="<i2").reshape(-1, source.channels)
+                mixed[:len(pcm), column] = pcm[:, 0]
+        return memoryview(mixed).cast("B")
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+
+def open_source(location):
+    if location.startswith("chunks://"):
+        return ChunkSource(location)
+    if location.endswith(".ccaf"):
+        return FramedSource(location)
+    if location.endswith(".flac"):
+        data = read_recording(location)
+        header = read_wav_header(io.BytesIO(data))
+        pcm = np.frombuffer(data, dtype="<i2", offset=header.data_offset)
+        return ArraySource(pcm.reshape(-1, header.channels) if header.channels > 1 else pcm, header.sample_rate)
+    path, _, stream = location.partition("#")
+    if path.endswith(".rtpc"):
+        return WavSource(decoded_wav(path, int(stream or 0)))
+    return WavSource(location)
+
+
+# Recordings for a call that has already been cleaned up from active_calls:
+# whatever the recorder, compression tier, chunk store or RTP archive left behind
+def find_recordings(call_id):
+    found = {}
+    for path in sorted(glob.glob(os.path.join(glob.escape(call_dir(call_id)), "leg*.*"))):
+        name, ext = os.path.splitext(os.path.basename(path))
+        if ext in (".wav", ".ccaf", ".flac"):
+            found.setdefault(name, path)
+    manifest = default_store().manifest(call_id) if os.path.isdir(STORE_DIR) else None
+    for leg in (manifest or {}).get("legs", {}):
+        found.setdefault(leg, f"chunks://{call_id}/{leg}")
+    rtp = archive_path(call_id)
+    if os.path.exists(rtp):
+        for stream in range(len(RtpArchive(rtp).streams)):
+            found.setdefault(f"rtp{stream}", f"{rtp}#{stream}")
+    return found
+
+
+# Select what to serve: one leg (optionally one channel of it) or every leg
+# as its own channel of a multi-channel file
+def build_source(recordings, leg=None, channel=None):
+    if not recordings:
+        raise FileNotFoundError("no recordings for this call")
+    if leg == "all":
+        sources = []
+        try:
+            for location in recordings.values():
+                sources.append(open_source(location))
+            return LegMix(sources)
+        except Exception:
+            for source in sources:
+                source.close()
+            raise
+
+    location = recordings.get(leg) if leg else next(iter(recordings.values()))
+    if location is None:
+        raise KeyError(leg)
+    source = open_source(location)
+    if channel is None or source.channels == 1 and channel == 0:
+        return source
+    if not 0 <= channel < source.channels:
+        source.close()
+        raise ValueError(f"channel {channel} out of range")
+    return ChannelSource(source, channel)
+
+
+class AudioSlice:
+    # A WAV made of a header plus a frame window of a source. Byte ranges
+    # apply to this virtual file, so Range works the same whatever was sliced.
+    def __init__(self, source, start_ms=None, end_ms=None):
+        self.source = source
+        rate = source.sample_rate
+        first = 0 if start_ms is None else min(source.frames, max(0, start_ms * rate // 1000))
+        last = source.frames if end_ms is None else min(source.frames, max(first, end_ms * rate // 1000))
+        self.first_frame = first
+        self.frame_count = last - first
+        self.block = 2 * source.channels
+        self.header = wav_header(rate, self.frame_count * self.block, source.channels)
+        self.size = len(self.header) + self.frame_count * self.block
+
+    # (start, end) inclusive, or None for the whole file. Multiple ranges are
+    # ignored (RFC 7233 3.1 lets a server answer 200 with the full file)
+    def parse_range(self, value):
+        if not value or "," in value:
+            return None
+        match = RANGE_PATTERN.match(value.strip())
+        if not match or match.groups() == ("", ""):
+            raise RangeNotSatisfiable(value)
+        first, last = match.groups()
+        if first == "":
+            start, end = max(0, self.size - int(last)), self.size - 1
+        else:
+            start, end = int(first), min(int(last), self.size - 1) if last else self.size - 1
+        if start >= self.size or start > end:
+            raise RangeNotSatisfiable(value)
+        return start, end
+
+    def iter_bytes(self, start=0, end=None, block=STREAM_BLOCK):
+        end = self.size - 1 if end is None else end
+        position = start
+        if position < len(self.header):
+            yield self.header[position:end + 1]
+            position = len(self.header)
+        # Align reads to whole frames; trim the ends to the requested bytes
+        while position <= end:
+            data_offset = position - len(self.header)
+            frame, skew = divmod(data_offset, self.block)
+            count = min(self.frame_count - frame, max(1, (min(block, end + 1 - position) + skew + self.block - 1) // self.block))
+            data = self.source.read(self.first_frame + frame, count)
+            piece = data[skew:skew + end + 1 - position]
+            if not len(piece):
+                break
+            yield piece
+            position += len(piece)
+
+    def close(self):
+        self.source.close()
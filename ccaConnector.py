@@ -1,17 +1,68 @@
+import logging
+import os
 import socket
-import pjsua2 as pj
+import threading
+import time
+
+from g711 import DECODERS
+from rtpArchive import RtpArchiveWriter, archive_path, parse_rtpmap, payload_info
+from rtpQuality import StreamQuality
+from dtmf import REVEAL_DIGITS, TelephoneEventTracker
+from sharedAudio import MAX_LEGS, rings
+from sipTcp import serve_forever as tcp_server
+from sipTransactions import TransactionTable, is_sip, transaction_key
+from structuredLog import install_debug_toggle, setup_logging
+
+log = logging.getLogger("cca.sip")
+packet_log = logging.getLogger("cca.packet")
 
 # Declare call_id as a global variable
 call_id = None
 
+# "decode" feeds G.711 into the shared-memory rings, "raw" only archives the
+# RTP payloads (decoded when fetched), "both" does both
+RTP_MODE = os.environ.get("CCA_RTP_MODE", "decode")
+
+# Create a pjsua2 endpoint alongside the listeners (nothing here uses it)
+USE_PJSUA = os.environ.get("CCA_CONNECTOR_PJSUA", "0") == "1"
+
+# SIP transports to listen on: "udp", "tcp" or "both"
+SIP_TRANSPORT = os.environ.get("CCA_SIP_TRANSPORT", "udp")
+
+# RTP SSRC -> leg index, per call
+call_legs = {}
+
+# Raw RTP archive and negotiated payload types, per call
+call_archives = {}
+call_rtpmaps = {}
+
+# RTP SSRC -> RFC 3550 receiver statistics, per call
+call_quality = {}
+
+# RTP SSRC -> RFC 4733 event tracker, per call
+call_dtmf = {}
+
+# RTP source (host, port) -> call, learned from each INVITE; call -> its keys
+media_routes = {}
+call_routes = {}
+
+# UDP server transactions: retransmitted requests replay the cached response
+transactions = TransactionTable()
+
+# UDP and TCP listeners run on separate threads but share the call state above
+sip_lock = threading.Lock()
+
 # PJSUA2 config function
 def create_transport(endpoint):
+    import pjsua2 as pj
     transport_config = pj.TransportConfig()
     transport = endpoint.transportCreate(pj.PJSIP_TRANSPORT_UDP, transport_config)
     return transport
 
-# PJSUA2 instance initialization function
+# PJSUA2 instance initialization function; pjsua2 is only imported if an
+# endpoint is actually wanted (CCA_CONNECTOR_PJSUA=1), the UDP/TCP paths don't use it
 def initialize_pjsua2():
+    import pjsua2 as pj
     endpoint = pj.Endpoint()
     try:
         endpoint.libCreate()
@@ -37,17 +88,7 @@ def cleanup_pjsua2(endpoint):
 
 # Generate a realistic SIP 200 OK response
 def generate_sip_200_ok(call_id, cseq):
-    sip_200_ok = (
-        "SIP/2.0 200 OK\r\n"
-        "Via: SIP/2.0/TCP sbc.domain.com;branch=z9hG4bK8ej5gf0048h2al8c1j60\r\n"
-        "To: <sip:receiver@domain.com>;tag=1928301774\r\n"
-        f"From: \"caller\" <sip:caller@domain.com>;tag=1928301774\r\n"
-        f"Call-ID: {call_id}\r\n"
-        f"CSeq: {cseq} INVITE\r\n"
-        "Contact: <sip:receiver@domain.com>\r\n"
-        "Content-Type: multipart/mixed; boundary=unique-boundary-1\r\n"
-        "Content-Length: 142\r\n"
-        "\r\n"
+    body = (
         "--unique-boundary-1\r\n"
         "Content-Type: application/sdp\r\n"
         "\r\n"
@@ -76,9 +117,46 @@ def generate_sip_200_ok(call_id, cseq):
         "</recording>\r\n"
         "--unique-boundary-1--\r\n"
     )
-    return sip_200_ok
+    # Stream transports frame on Content-Length, so it has to be the encoded body's size
+    sip_200_ok = (
+        "SIP/2.0 200 OK\r\n"
+        "Via: SIP/2.0/TCP sbc.domain.com;branch=z9hG4bK8ej5gf0048h2al8c1j60\r\n"
+        "To: <sip:receiver@domain.com>;tag=1928301774\r\n"
+        f"From: \"caller\" <sip:caller@domain.com>;tag=1928301774\r\n"
+        f"Call-ID: {call_id}\r\n"
+        f"CSeq: {cseq} INVITE\r\n"
+        "Contact: <sip:receiver@domain.com>\r\n"
+        "Content-Type: multipart/mixed; boundary=unique-boundary-1\r\n"
+        f"Content-Length: {len(body.encode())}\r\n"
+        "\r\n"
+    )
+    return sip_200_ok + body
 
-# Handle SIP INVITE and respond with 200 OK
+# Headers a response copies from its request (RFC 3261 8.2.6.2), by full and compact name
+_ECHOED_HEADERS = {b"via": b"Via", b"v": b"Via", b"from": b"From", b"f": b"From", b"to": b"To", b"t": b"To",
+                   b"call-id": b"Call-ID", b"i": b"Call-ID", b"cseq": b"CSeq"}
+
+# Methods answered with a bare 200; anything else other than INVITE/ACK gets 501
+_ACCEPTED_METHODS = (b"BYE", b"CANCEL", b"OPTIONS")
+
+# A bodiless response to any request; returns the encoded response
+def generate_sip_response(request, status, reason):
+    end = request.find(b"\r\n\r\n")
+    head = request[:end] if end >= 0 else request
+    lines = [f"SIP/2.0 {status} {reason}".encode()]
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        canonical = _ECHOED_HEADERS.get(name.strip().lower())
+        if canonical is None:
+            continue
+        value = value.strip()
+        if canonical == b"To" and b";tag=" not in value.lower():
+            value += f";tag={os.urandom(4).hex()}".encode()
+        lines.append(canonical + b": " + value)
+    lines.append(b"Content-Length: 0")
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+# Handle SIP INVITE and respond with 200 OK; returns the encoded response
 def handle_sip_invite(sock, data, addr):
     global call_id  # Declare call_id as global to modify its value
     lines = data.decode().split("\r\n")
@@ -89,40 +167,201 @@ def handle_sip_invite(sock, data, addr):
             call_id = line.split(":")[1].strip()  # Extract Call-ID properly
         if line.startswith("CSeq:"):
             cseq = line.split(":")[1].strip()  # Extract CSeq properly
+    call_rtpmaps[call_id] = parse_rtpmap(data.decode(errors="replace"))
+    route_media(call_id, media_sources(data.decode(errors="replace"), addr))
     
     # Generate and send the 200 OK response
-    sip_200_ok = generate_sip_200_ok(call_id, cseq)
-    sock.sendto(sip_200_ok.encode(), addr)
-    print(f"Sent 200 OK to {addr}")
-    print(f"Parsed Call-ID: {call_id}")  # Print the parsed Call-ID for debugging
+    sip_200_ok = generate_sip_200_ok(call_id, cseq).encode()
+    sock.sendto(sip_200_ok, addr)
+    log.info("Sent 200 OK to %s", addr, extra={"call_id": call_id})
+    return sip_200_ok
+
+# Where a call's RTP can come from: each SDP m= port at the c= address and at
+# the INVITE's source host, plus the INVITE's source address itself for
+# senders that put SIP and RTP on one socket
+def media_sources(sdp, addr):
+    session_host, streams = None, []  # streams: [c= host, m= port]
+    for line in sdp.splitlines():
+        parts = line.split()
+        if line.startswith("c=") and len(parts) == 3:
+            if streams:
+                streams[-1][0] = parts[2]
+            else:
+                session_host = parts[2]
+        elif line.startswith("m=") and len(parts) > 1:
+            port = parts[1].split("/")[0]
+            streams.append([None, int(port) if port.isdigit() else 0])
+
+    sources = []
+    for c_host, port in streams:
+        if port == 0:
+            continue  # a rejected stream
+        for host in (c_host or session_host, addr[0]):
+            if host and (host, port) not in sources:
+                sources.append((host, port))
+    if tuple(addr[:2]) not in sources:
+        sources.append(tuple(addr[:2]))
+    return sources
+
+# Point RTP from these sources at the call; a later INVITE reusing one takes it over
+def route_media(route_id, sources):
+    keys = call_routes.setdefault(route_id, [])
+    for source in sources:
+        media_routes[source] = route_id
+        keys.append(source)
+
+# Archive the raw packet and/or decode G.711 into its call's shared-memory audio ring
+def ingest_rtp(data, addr):
+    if len(data) < 12 or data[0] >> 6 != 2:
+        return
+    call_id = media_routes.get(tuple(addr[:2]))
+    if call_id is None:
+        return
+    track_quality(call_id, data)
+    if payload_info(data[1] & 0x7F, call_rtpmaps.get(call_id, {}))[0] == "TELEPHONE-EVENT":
+        track_dtmf(call_id, data)
+    if RTP_MODE != "decode":
+        archive = call_archives.get(call_id)
+        if archive is None:
+            archive = call_archives[call_id] = RtpArchiveWriter(archive_path(call_id), call_rtpmaps.get(call_id))
+        archive.append(data)
+        if RTP_MODE == "raw":
+            return
+    decoder = DECODERS.get(data[1] & 0x7F)
+    if decoder is None:
+        return
+    offset = 12 + 4 * (data[0] & 0x0F)  # CSRC list
+    if data[0] & 0x10:  # header extension
+        offset += 4 + 4 * int.from_bytes(data[offset + 2:offset + 4], "big")
+    end = len(data) - (data[-1] if data[0] & 0x20 else 0)  # padding
+    if offset >= end:
+        return
+
+    legs = call_legs.setdefault(call_id, {})
+    leg = legs.setdefault(data[8:12], len(legs))
+    if leg < MAX_LEGS:
+        rings.writer(call_id, leg, 8000).write(decoder(data[offset:end]))
+
+# Update the sender's loss/jitter/reorder counters; O(1) per packet
+def track_quality(call_id, data):
+    streams = call_quality.setdefault(call_id, {})
+    stats = streams.get(data[8:12])
+    if stats is None:
+        encoding, rate = payload_info(data[1] & 0x7F, call_rtpmaps.get(call_id, {}))
+        stats = streams[data[8:12]] = StreamQuality(rate, encoding)
+    seq = (data[2] << 8) | data[3]
+    stats.update(seq, int.from_bytes(data[4:8], "big"), time.monotonic())
+
+# Report each RFC 4733 key press once (events repeat per packet and the end is retransmitted)
+def track_dtmf(call_id, data):
+    tracker = call_dtmf.setdefault(call_id, {}).setdefault(data[8:12], TelephoneEventTracker())
+    offset = 12 + 4 * (data[0] & 0x0F)
+    digit = tracker.update(data[offset:], int.from_bytes(data[4:8], "big"))
+    if digit:
+        log.info("DTMF digit %s", digit if REVEAL_DIGITS else "*", extra={"call_id": call_id})
+
+# Snapshot of every stream's quality for a call, keyed by SSRC
+def quality_report(report_id):
+    return {ssrc.hex(): stats.snapshot() for ssrc, stats in call_quality.get(report_id, {}).items()}
+
+# Free a call's audio rings and finish its RTP archive once it's torn down
+def release_call(released_id):
+    report = quality_report(released_id)
+    if report:
+        log.info("Call media quality", extra={"call_id": released_id, "fields": {"quality": report}})
+    call_quality.pop(released_id, None)
+    call_dtmf.pop(released_id, None)
+    call_legs.pop(released_id, None)
+    call_rtpmaps.pop(released_id, None)
+    for source in call_routes.pop(released_id, ()):
+        if media_routes.get(source) == released_id:
+            del media_routes[source]
+    archive = call_archives.pop(released_id, None)
+    if archive is not None:
+        archive.close()
+    rings.release(released_id)
+
+# SIP requests go through the transaction table: a retransmission gets the
+# cached response back without being parsed again, ACKs are never answered.
+# sock is the UDP socket or a sipTcp.StreamTransport; both have sendto().
+def handle_sip_request(sock, data, addr):
+    with sip_lock:
+        _handle_sip_request(sock, data, addr)
+
+def _handle_sip_request(sock, data, addr):
+    if data.startswith(b"SIP/2.0"):
+        return  # a response; this side never sends requests
+    tx = transactions.lookup(data)
+    if tx is not None:
+        if tx.response is not None:
+            sock.sendto(tx.response, addr)
+        if packet_log.isEnabledFor(logging.DEBUG):
+            packet_log.debug("Absorbed %s retransmission #%d from %s", tx.method.decode(), tx.retransmits, addr)
+        return
+    if data.startswith(b"ACK"):
+        transactions.absorb_ack(data)
+        return
+
+    tx = transactions.create(data, addr)
+    if data.startswith(b"INVITE"):
+        log.info("Received SIP INVITE from %s", addr)
+        transactions.respond(tx, handle_sip_invite(sock, data, addr))
+        return
+    if data.startswith(b"BYE"):
+        release_call(transaction_key(data)[1].decode())
+    status, reason = (200, "OK") if data.startswith(_ACCEPTED_METHODS) else (501, "Not Implemented")
+    response = generate_sip_response(data, status, reason)
+    sock.sendto(response, addr)
+    transactions.respond(tx, response, status)
 
 # UDP server function
 def udp_server(ip, port):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Reuse address
     sock.bind((ip, port))
-    print(f"UDP server started at {ip}:{port}")
+    # Wake up now and then so transaction timers fire on an idle socket too
+    sock.settimeout(1.0)
+    log.info("UDP server started at %s:%s", ip, port)
 
     while True:
-        data, addr = sock.recvfrom(16384)  # Buffer size is 16384 bytes
-        if data.startswith(b"INVITE"):
-            print(f"Received SIP INVITE from {addr}")
-            handle_sip_invite(sock, data, addr)
+        transactions.expire()
+        try:
+            data, addr = sock.recvfrom(16384)  # Buffer size is 16384 bytes
+        except socket.timeout:
+            continue
+        if is_sip(data):
+            handle_sip_request(sock, data, addr)
         else:
-            print(f"Received {len(data)} bytes from {addr} for callID - {call_id}")  # Print call_id here
+            if packet_log.isEnabledFor(logging.DEBUG):
+                packet_log.debug("Received %d bytes from %s", len(data), addr,
+                                 extra={"call_id": media_routes.get(addr)})
+            with sip_lock:
+                ingest_rtp(data, addr)
+            # Media acknowledgement for the UDP test senders; never reaches a SIP stream
             response = f"Received {len(data)} bytes"
             sock.sendto(response.encode('utf-8'), addr)
 
 # Main function to initialize PJSUA2 and start UDP server
 def main():
-    endpoint = initialize_pjsua2()
-    if not endpoint:
-        return
+    setup_logging()
+    install_debug_toggle()
+
+    endpoint = None
+    if USE_PJSUA:
+        endpoint = initialize_pjsua2()
+        if not endpoint:
+            return
 
     udp_port = 5059
     udp_ip = "localhost"
     try:
-        udp_server(udp_ip, udp_port)
+        if SIP_TRANSPORT == "tcp":
+            tcp_server(udp_ip, udp_port, handle_sip_request)
+        elif SIP_TRANSPORT == "both":
+            threading.Thread(target=udp_server, args=(udp_ip, udp_port), name="sip-udp", daemon=True).start()
+            tcp_server(udp_ip, udp_port, handle_sip_request)
+        else:
+            udp_server(udp_ip, udp_port)
 
     except OSError as e:
         if e.errno == 98:
@@ -135,7 +374,12 @@ def main():
         print("UDP server stopped")
 
     finally:
-        cleanup_pjsua2(endpoint)
+        log.info("SIP transactions", extra={"fields": transactions.stats()})
+        rings.release_all()
+        for archive in call_archives.values():
+            archive.close()
+        if endpoint:
+            cleanup_pjsua2(endpoint)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,75 +1,334 @@
+import argparse
+import json
+import random
+import resource
+import signal
+import time
+from collections import deque
+
 import pjsua2 as pj
 
+STATE_NAMES = {
+    pj.PJSIP_INV_STATE_NULL: "NULL",
+    pj.PJSIP_INV_STATE_CALLING: "CALLING",
+    pj.PJSIP_INV_STATE_INCOMING: "INCOMING",
+    pj.PJSIP_INV_STATE_EARLY: "EARLY",
+    pj.PJSIP_INV_STATE_CONNECTING: "CONNECTING",
+    pj.PJSIP_INV_STATE_CONFIRMED: "CONFIRMED",
+    pj.PJSIP_INV_STATE_DISCONNECTED: "DISCONNECTED",
+}
+
+# Keep this many latency samples per metric so hours-long soaks stay bounded
+SAMPLE_WINDOW = 10000
+
+
+class SoakStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {}
+        self.latencies = {}
+        self.started_cpu = self._cpu()
+        self.last_report = (self.started, self.started_cpu)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def latency(self, name, seconds):
+        samples = self.latencies.get(name)
+        if samples is None:
+            samples = self.latencies[name] = deque(maxlen=SAMPLE_WINDOW)
+        samples.append(seconds * 1000.0)
+
+    @staticmethod
+    def _cpu():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def _percentiles(self, samples):
+        ordered = sorted(samples)
+        n = len(ordered)
+        return {
+            "count": n,
+            "p50_ms": round(ordered[n // 2], 2),
+            "p95_ms": round(ordered[min(n - 1, int(n * 0.95))], 2),
+            "p99_ms": round(ordered[min(n - 1, int(n * 0.99))], 2),
+            "max_ms": round(ordered[-1], 2),
+        }
+
+    # Rates and CPU since the previous report, totals since the start
+    def report(self, active_calls):
+        now, cpu = time.monotonic(), self._cpu()
+        last_time, last_cpu = self.last_report
+        interval = max(now - last_time, 1e-9)
+        self.last_report = (now, cpu)
+        elapsed = now - self.started
+
+        snapshot = {
+            "elapsed_sec": round(elapsed, 1),
+            "active_calls": active_calls,
+            "counters": dict(self.counters),
+            "register_per_sec": round(self.counters.get("register_ok", 0) / elapsed, 2) if elapsed else 0,
+            "invite_per_sec": round(self.counters.get("call_confirmed", 0) / elapsed, 2) if elapsed else 0,
+            "cpu_percent": round(100.0 * (cpu - last_cpu) / interval, 1),
+            "cpu_percent_avg": round(100.0 * (cpu - self.started_cpu) / elapsed, 1) if elapsed else 0,
+            "latency": {name: self._percentiles(s) for name, s in sorted(self.latencies.items()) if s},
+        }
+        return snapshot
+
+
+stats = SoakStats()
+
+
+class SoakAccount(pj.Account):
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.register_started = None
+        self.registered = False
+
+    def onRegState(self, prm):
+        if prm.code // 100 == 2:
+            stats.count("register_ok")
+            if self.register_started is not None:
+                stats.latency("register", time.monotonic() - self.register_started)
+                self.register_started = None
+            self.registered = True
+        else:
+            stats.count("register_failed")
+            self.registered = False
+            print(f"Account {self.index} registration failed: {prm.code} {prm.reason}")
+
+
 class MyCall(pj.Call):
-    def __init__(self, account, call_id=None):
+    def __init__(self, account, call_id=None, harness=None):
         if call_id is None:
             super().__init__(account)
         else:
             super().__init__(account, call_id)
+        self.harness = harness
+        self.created = time.monotonic()
+        self.last_state = "NULL"
+        self.last_change = self.created
+        self.hangup_at = None
+        self.confirmed = False
 
     def onCallState(self, prm):
         call_info = self.getInfo()
-        print(f"Call {call_info.callId} state: {call_info.stateText}")
+        now = time.monotonic()
+        state = STATE_NAMES.get(call_info.state, call_info.stateText)
+
+        stats.latency(f"{self.last_state}->{state}", now - self.last_change)
+        self.last_state, self.last_change = state, now
+
+        if call_info.state == pj.PJSIP_INV_STATE_CONFIRMED:
+            stats.count("call_confirmed")
+            self.confirmed = True
+            stats.latency("call_setup", now - self.created)
+            if self.harness:
+                self.hangup_at = now + self.harness.hold_time()
+        elif call_info.state == pj.PJSIP_INV_STATE_DISCONNECTED:
+            if self.confirmed:
+                stats.count("call_completed")
+            else:
+                stats.count("call_failed")
+                stats.count(f"call_failed_{call_info.lastStatusCode}")
+            if self.harness:
+                self.harness.finished(self)
 
     def onCallMediaState(self, prm):
-        print("Media state changed.")
+        stats.count("media_state")
+
 
 def register_thread():
     if not hasattr(register_thread, "is_registered"):
         pj.ThreadRegister("MyThread", None)
         register_thread.is_registered = True
 
-def create_call(account, target_uri):
-    call = MyCall(account)
+
+def create_call(account, target_uri, harness=None):
+    call = MyCall(account, harness=harness)
     call_prm = pj.CallOpParam()
+    call_prm.opt.audioCount = 1
+    call_prm.opt.videoCount = 0
     call.makeCall(target_uri, call_prm)
-    print(f"Call to {target_uri} initiated.")
+    stats.count("call_attempted")
     return call
 
+
+class SoakHarness:
+    def __init__(self, args):
+        self.args = args
+        self.accounts = []
+        self.calls = set()
+        self.done = []
+        self.next_account = 0
+        self.running = True
+        self.next_call_slot = time.monotonic()
+
+    def hold_time(self):
+        jitter = self.args.hold_jitter
+        return max(0.0, self.args.hold + random.uniform(-jitter, jitter))
+
+    # pjsua2 must not drop a Call from inside its own callback; reap on the next tick
+    def finished(self, call):
+        self.calls.discard(call)
+        self.done.append(call)
+
+    def create_accounts(self):
+        args = self.args
+        for i in range(args.accounts):
+            user = args.user if args.accounts == 1 else f"{args.user}{i + args.first_index}"
+            acc_cfg = pj.AccountConfig()
+            acc_cfg.idUri = f"sip:{user}@{args.domain}"
+            acc_cfg.regConfig.registrarUri = args.registrar
+            acc_cfg.regConfig.timeoutSec = args.reg_timeout
+            cred = pj.AuthCredInfo("digest", "*", user, 0, args.password)
+            acc_cfg.sipConfig.authCreds.append(cred)
+
+            account = SoakAccount(i)
+            account.register_started = time.monotonic()
+            account.create(acc_cfg)
+            stats.count("register_sent")
+            self.accounts.append(account)
+        print(f"{len(self.accounts)} account(s) created.")
+
+    def _pick_account(self):
+        for _ in range(len(self.accounts)):
+            account = self.accounts[self.next_account]
+            self.next_account = (self.next_account + 1) % len(self.accounts)
+            if account.registered or not self.args.require_registration:
+                return account
+        return None
+
+    # Start calls up to the concurrency target, no faster than --call-rate
+    def top_up(self, now):
+        interval = 1.0 / self.args.call_rate if self.args.call_rate > 0 else 0.0
+        while self.running and len(self.calls) < self.args.calls and now >= self.next_call_slot:
+            account = self._pick_account()
+            if account is None:
+                return
+            try:
+                self.calls.add(create_call(account, self.args.target, harness=self))
+            except pj.Error as e:
+                stats.count("call_create_error")
+                print(f"makeCall failed: {e.info() if hasattr(e, 'info') else e}")
+                return
+            self.next_call_slot = max(self.next_call_slot + interval, now) if interval else now
+
+    def hang_up_due(self, now, everything=False):
+        for call in list(self.calls):
+            if everything or (call.hangup_at is not None and now >= call.hangup_at):
+                call.hangup_at = call.hangup_at or now
+                try:
+                    call.hangup(pj.CallOpParam())
+                except pj.Error:
+                    self.finished(call)
+
+    def run(self, ep):
+        args = self.args
+        deadline = time.monotonic() + args.duration if args.duration > 0 else None
+        next_report = time.monotonic() + args.report_interval
+
+        # libHandleEvents blocks in the ioqueue for up to --poll-ms when idle,
+        # so the harness sleeps instead of spinning between SIP events
+        while self.running:
+            ep.libHandleEvents(args.poll_ms)
+            now = time.monotonic()
+            self.done.clear()
+            self.hang_up_due(now)
+            self.top_up(now)
+
+            if now >= next_report:
+                print(json.dumps(stats.report(len(self.calls))))
+                next_report = now + args.report_interval
+            if deadline and now >= deadline:
+                self.running = False
+
+        self.drain(ep)
+
+    def drain(self, ep, timeout=5.0):
+        self.hang_up_due(time.monotonic(), everything=True)
+        stop_at = time.monotonic() + timeout
+        while self.calls and time.monotonic() < stop_at:
+            ep.libHandleEvents(self.args.poll_ms)
+        self.done.clear()
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-account REGISTER/INVITE soak harness")
+    parser.add_argument("--domain", default="10.1.0.4")
+    parser.add_argument("--registrar", default="sip:10.1.0.4:60102")
+    parser.add_argument("--user", default="username", help="account user, or prefix when --accounts > 1")
+    parser.add_argument("--first-index", type=int, default=1, help="suffix of the first generated user")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--reg-timeout", type=int, default=300, help="REGISTER expiry in seconds")
+    parser.add_argument("--require-registration", action="store_true",
+                        help="only place calls from accounts that registered")
+    parser.add_argument("--target", default="sip:recorder@10.1.0.4:5060", help="URI the calls go to")
+    parser.add_argument("--calls", type=int, default=0, help="concurrent calls to keep up")
+    parser.add_argument("--call-rate", type=float, default=5.0, help="new calls per second, 0 = unlimited")
+    parser.add_argument("--hold", type=float, default=30.0, help="seconds to hold each call")
+    parser.add_argument("--hold-jitter", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds to run, 0 = until Ctrl+C")
+    parser.add_argument("--port", type=int, default=3030)
+    parser.add_argument("--poll-ms", type=int, default=20)
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    parser.add_argument("--pj-log-level", type=int, default=3)
+    parser.add_argument("--output", help="write the final report as JSON to this file")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    harness = SoakHarness(args)
+    signal.signal(signal.SIGINT, harness.stop)
+    signal.signal(signal.SIGTERM, harness.stop)
+
     ep = pj.Endpoint()
     ep.libCreate()
 
     try:
-        # Initialize endpoint
+        # Initialize endpoint; no worker threads, this process pumps events itself
         ep_cfg = pj.EpConfig()
+        ep_cfg.uaConfig.threadCnt = 0
+        ep_cfg.uaConfig.mainThreadOnly = True
+        ep_cfg.uaConfig.maxCalls = max(4, args.calls)
         log_cfg = pj.LogConfig()
-        log_cfg.level = 5
-        log_cfg.consoleLevel = 5
+        log_cfg.level = args.pj_log_level
+        log_cfg.consoleLevel = args.pj_log_level
         ep_cfg.logConfig = log_cfg
         ep.libInit(ep_cfg)
 
         # Create transport
         transport_cfg = pj.TransportConfig()
-        transport_cfg.port = 3030
+        transport_cfg.port = args.port
         ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, transport_cfg)
 
-        # Start the library
+        # Start the library; no sound card needed to soak
         ep.libStart()
+        ep.audDevManager().setNullDev()
         print("PJSUA2 library started.")
 
-        # Create account
-        acc_cfg = pj.AccountConfig()
-        acc_cfg.idUri = "sip:username@10.1.0.4"
-        acc_cfg.regConfig.registrarUri = "sip:10.1.0.4:60102"
-        cred = pj.AuthCredInfo("digest", "*", "username", 0, "password")
-        acc_cfg.sipConfig.authCreds.append(cred)
-
-        # Instantiate and register the account
-        account = pj.Account()
-        account.create(acc_cfg)
-        print("Account registered.")
-
-        # Wait for SIP events or implement call handling logic here
-        print("Press Ctrl+C to quit.")
-        while True:
-            pass  # Replace with actual call handling logic if necessary
-
-    except Exception as e:
-        print(f"Error: {e}")
+        harness.create_accounts()
+        print("Soaking, press Ctrl+C to stop.")
+        harness.run(ep)
+
+    except pj.Error as e:
+        print(f"Error: {e.info() if hasattr(e, 'info') else e}")
     finally:
+        final = stats.report(len(harness.calls))
+        print(json.dumps(final, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(final, f, indent=2)
+        harness.accounts.clear()
         ep.libDestroy()
         print("PJSUA2 library destroyed.")
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,311 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+STORE_DIR = os.environ.get("CCA_CHUNK_STORE", "chunkstore")
+CHUNK_SIZE = int(os.environ.get("CCA_CHUNK_SIZE", str(64 * 1024)))
+READ_CACHE_CHUNKS = 32
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def wav_header(sample_rate, data_size, channels=1, sample_width=2):
+    block_align = channels * sample_width
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, channels,
+                       sample_rate, sample_rate * block_align, block_align, sample_width * 8, b"data", data_size)
+
+
+# Write to a temp name and rename, so a crash never leaves a torn object
+def _write_atomic(path, data, mode="wb"):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, mode) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ChunkStore:
+    # Layout under root:
+    #   chunks/ab/<blake2b>       fixed-size chunks, stored once whoever references them
+    #   calls/<call_id>.json      per-call manifest: legs -> header + chunk list
+    #   ucid/<ucid>.json          call_ids recorded for a UCID (SBC failover makes several)
+    # A leg is its WAV prefix (kept inline, it changes with the length) followed
+    # by the audio payload cut into CHUNK_SIZE chunks, so identical audio dedups
+    # whatever container header it came with.
+    def __init__(self, root=STORE_DIR, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        for sub in ("chunks", "calls", "ucid"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def chunk_path(self, digest):
+        return os.path.join(self.root, "chunks", digest[:2], digest)
+
+    # Returns True if the chunk was new
+    def put_chunk(self, data):
+        digest = chunk_hash(data)
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, data)
+        return digest, True
+
+    def get_chunk(self, digest):
+        with open(self.chunk_path(digest), "rb") as f:
+            return f.read()
+
+    def manifest_path(self, call_id):
+        return os.path.join(self.root, "calls", f"{call_id.replace('/', '_')}.json")
+
+    def manifest(self, call_id):
+        try:
+            with open(self.manifest_path(call_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # Legs of one call finish on different media threads; merge under the lock
+    def add_leg(self, call_id, leg, entry, ucid=None):
+        with self.lock:
+            manifest = self.manifest(call_id) or {"call_id": call_id, "ucid": None, "legs": {}}
+            manifest["legs"][str(leg)] = entry
+            if ucid:
+                manifest["ucid"] = ucid
+            _write_atomic(self.manifest_path(call_id), json.dumps(manifest), "w")
+        if ucid:
+            self.link_ucid(ucid, call_id)
+
+    def link_ucid(self, ucid, call_id):
+        path = os.path.join(self.root, "ucid", f"{ucid.replace('/', '_')}.json")
+        with self.lock:
+            try:
+                with open(path) as f:
+                    calls = json.load(f)
+            except FileNotFoundError:
+                calls = []
+            if call_id not in calls:
+                calls.append(call_id)
+                _write_atomic(path, json.dumps(calls), "w")
+            manifest = self.manifest(call_id)
+            if manifest is not None and manifest.get("ucid") != ucid:
+                manifest["ucid"] = ucid
+                _write_atomic(self.manifest_path(call_id), json.dumps(manifest), "w")
+
+    def calls_for_ucid(self, ucid):
+        try:
+            with open(os.path.join(self.root, "ucid", f"{ucid.replace('/', '_')}.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def writer(self, call_id, leg, prefix=b"", ucid=None):
+        return ChunkWriter(self, call_id, leg, prefix, ucid)
+
+    # Store an existing WAV: header inline, data chunk deduplicated
+    def put_file(self, path, call_id, leg="0", ucid=None):
+        from archiveIndex import read_wav_header
+
+        with open(path, "rb") as f:
+            header = read_wav_header(f)
+            f.seek(0)
+            writer = self.writer(call_id, leg, f.read(header.data_offset), ucid)
+            while True:
+                block = f.read(self.chunk_size)
+                if not block:
+                    break
+                writer.write(block)
+        return writer.finish()
+
+    # Lazy reader over one leg; nothing is fetched until it is read
+    def open(self, call_id, leg="0"):
+        manifest = self.manifest(call_id)
+        if manifest is None or str(leg) not in manifest["legs"]:
+            raise FileNotFoundError(f"no stored recording for {call_id} leg {leg}")
+        return ChunkedFile(self, manifest["legs"][str(leg)])
+
+    def stats(self):
+        logical = stored = chunks = 0
+        referenced = set()
+        for name in os.listdir(os.path.join(self.root, "calls")):
+            with open(os.path.join(self.root, "calls", name)) as f:
+                for entry in json.load(f)["legs"].values():
+                    logical += entry["size"]
+                    referenced.update(entry["chunks"])
+        for digest in referenced:
+            try:
+                stored += os.path.getsize(self.chunk_path(digest))
+                chunks += 1
+            except FileNotFoundError:
+                pass
+        return {"logical_bytes": logical, "stored_bytes": stored, "chunks": chunks,
+                "dedup_ratio": round(logical / stored, 3) if stored else None}
+
+
+class ChunkWriter:
+    # Fed sequentially (recorder frames or file blocks); hashes the whole stream
+    # and each chunk as it fills, writing only chunks the store hasn't seen
+    def __init__(self, store, call_id, leg, prefix=b"", ucid=None):
+        self.store = store
+        self.call_id = call_id
+        self.leg = leg
+        self.prefix = prefix
+        self.ucid = ucid
+        self.buffer = bytearray()
+        self.chunks = []
+        self.payload_size = 0
+        self.new_chunks = 0
+        self.digest = hashlib.blake2b(digest_size=20)
+
+    def write(self, data):
+        self.buffer += data
+        self.payload_size += len(data)
+        self.digest.update(data)
+        size = self.store.chunk_size
+        if len(self.buffer) >= size:
+            view = memoryview(self.buffer)
+            full = len(self.buffer) - len(self.buffer) % size
+            for offset in range(0, full, size):
+                self._store(bytes(view[offset:offset + size]))
+            view.release()
+            del self.buffer[:full]
+
+    def _store(self, data):
+        digest, new = self.store.put_chunk(data)
+        self.chunks.append(digest)
+        self.new_chunks += new
+
+    # prefix may be given late, e.g. a WAV header that needs the final length
+    def finish(self, prefix=None):
+        if self.buffer:
+            self._store(bytes(self.buffer))
+            self.buffer.clear()
+        if prefix is not None:
+            self.prefix = prefix
+        entry = {
+            "size": len(self.prefix) + self.payload_size,
+            "prefix": self.prefix.hex(),
+            "payload_hash": self.digest.hexdigest(),
+            "chunk_size": self.store.chunk_size,
+            "chunks": self.chunks,
+        }
+        self.store.add_leg(self.call_id, self.leg, entry, self.ucid)
+        return entry
+
+
+class ChunkedFile(io.RawIOBase):
+    # Seekable read-only file over a manifest entry; works with wave.open(),
+    # shutil.copyfileobj() and HTTP range readers. Chunks are loaded on demand
+    # and the most recent READ_CACHE_CHUNKS are kept.
+    def __init__(self, store, entry):
+        self.store = store
+        self.prefix = bytes.fromhex(entry["prefix"])
+        self.chunk_size = entry["chunk_size"]
+        self.chunks = entry["chunks"]
+        self.size = entry["size"]
+        self.position = 0
+        self.cache = OrderedDict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def _chunk(self, index):
+        data = self.cache.get(index)
+        if data is None:
+            data = self.cache[index] = self.store.get_chunk(self.chunks[index])
+            if len(self.cache) > READ_CACHE_CHUNKS:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(index)
+        return data
+
+    def readinto(self, buffer):
+        out = memoryview(buffer).cast("B")
+        written = 0
+        while written < len(out) and self.position < self.size:
+            if self.position < len(self.prefix):
+                piece = self.prefix[self.position:self.position + len(out) - written]
+            else:
+                offset = self.position - len(self.prefix)
+                index, within = divmod(offset, self.chunk_size)
+                piece = self._chunk(index)[within:within + len(out) - written]
+            out[written:written + len(piece)] = piece
+            written += len(piece)
+            self.position += len(piece)
+        return written
+
+
+store = None
+
+
+# The store is created on first use so importing recorder doesn't touch the disk
+def default_store():
+    global store
+    if store is None:
+        store = ChunkStore()
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed recording store")
+    parser.add_argument("--root", default=STORE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    put = commands.add_parser("put", help="store WAV files, one call per file unless --call-id is given")
+    put.add_argument("files", nargs="+")
+    put.add_argument("--call-id")
+    put.add_argument("--ucid")
+
+    get = commands.add_parser("get", help="reassemble a stored leg into a file")
+    get.add_argument("call_id")
+    get.add_argument("output")
+    get.add_argument("--leg", default="0")
+
+    find = commands.add_parser("ucid", help="list calls recorded for a UCID")
+    find.add_argument("ucid")
+
+    commands.add_parser("stats", help="logical vs stored bytes")
+    args = parser.parse_args()
+
+    chunk_store = ChunkStore(args.root)
+    if args.command == "put":
+        for leg, path in enumerate(args.files):
+            call_id = args.call_id or hashlib.blake2b(os.path.abspath(path).encode(), digest_size=8).hexdigest()
+            entry = chunk_store.put_file(path, call_id, str(leg) if args.call_id else "0", args.ucid)
+            print(f"{path}: call {call_id}, {len(entry['chunks'])} chunks")
+    elif args.command == "get":
+        with chunk_store.open(args.call_id, args.leg) as src, open(args.output, "wb") as dst:
+            while True:
+                block = src.read(1 << 20)
+                if not block:
+                    break
+                dst.write(block)
+    elif args.command == "ucid":
+        print(json.dumps(chunk_store.calls_for_ucid(args.ucid)))
+    else:
+        print(json.dumps(chunk_store.stats()))
+
+
+if __name__ == "__main__":
+    main()
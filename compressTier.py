@@ -0,0 +1,396 @@
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from recorder import RECORDINGS_DIR
+
+log = logging.getLogger("cca.compress")
+
+# "auto" picks flac, then zstd, then deflate, by what is installed; "none" disables the tier
+CODEC = os.environ.get("CCA_COMPRESS_CODEC", "auto")
+WORKERS = int(os.environ.get("CCA_COMPRESS_WORKERS", "2"))
+JOURNAL_DIR = os.environ.get("CCA_COMPRESS_JOURNAL", os.path.join(RECORDINGS_DIR, ".compress-jobs"))
+FRAME_SECONDS = 1
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Framed PCM container (.ccaf), used for zstd and deflate:
+#   magic "CCAF", version u8, codec u8, filter u8, pad u8, prefix_len u32, frame_samples u32
+#   prefix (the original WAV header, verbatim)
+#   frames: raw_len u32, packed_len u32, packed bytes
+# Each frame is about FRAME_SECONDS of audio and decodes on its own, so a
+# reader can seek by skipping frame headers without inflating anything.
+FRAMED_MAGIC = b"CCAF"
+FRAMED_VERSION = 1
+FRAMED_HEADER = struct.Struct("<4sBBBxII")
+FRAME_HEADER = struct.Struct("<II")
+FRAMED_CODECS = {"zstd": 1, "deflate": 2}
+FILTER_DELTA_PLANES = 1
+
+EXTENSIONS = {"flac": ".flac", "zstd": ".ccaf", "deflate": ".ccaf"}
+
+
+def available_codecs():
+    codecs = ["deflate"]
+    if zstandard is not None:
+        codecs.insert(0, "zstd")
+    if soundfile is not None:
+        codecs.insert(0, "flac")
+    return codecs
+
+
+def resolve_codec(codec=CODEC):
+    if codec == "auto":
+        return available_codecs()[0]
+    if codec != "none" and codec not in available_codecs():
+        raise ValueError(f"compression codec {codec} is not available (have {', '.join(available_codecs())})")
+    return codec
+
+
+# Sample deltas split into low/high byte planes: speech deltas are small, so
+# the high plane is mostly 0x00/0xFF and compresses very well
+def pack_samples(pcm):
+    delta = np.diff(pcm, prepend=np.int16(0)).astype("<i2")
+    planes = delta.view(np.uint8).reshape(-1, 2)
+    return planes[:, 0].tobytes() + planes[:, 1].tobytes()
+
+
+def unpack_samples(data):
+    half = len(data) // 2
+    planes = np.empty((half, 2), dtype=np.uint8)
+    planes[:, 0] = np.frombuffer(data, dtype=np.uint8, count=half)
+    planes[:, 1] = np.frombuffer(data, dtype=np.uint8, offset=half)
+    return np.cumsum(planes.view("<i2").ravel(), dtype=np.int16)
+
+
+def _compressor(codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress
+    return lambda data: zlib.compress(data, 1)
+
+
+def _decompressor(codec_id):
+    if codec_id == FRAMED_CODECS["zstd"]:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this recording")
+        return zstandard.ZstdDecompressor().decompress
+    return zlib.decompress
+
+
+class Incompressible(ValueError):
+    # The recording would not round-trip byte for byte, so it stays a WAV
+    pass
+
+
+# Header, everything before the samples, and the samples; raises
+# Incompressible for layouts the stored forms can't reproduce exactly
+def _split_wav(data):
+    from archiveIndex import read_wav_header
+
+    header = read_wav_header(io.BytesIO(data))
+    if header.format != 1 or header.sample_width != 2:
+        raise Incompressible("only 16-bit PCM recordings are compressed")
+    prefix = data[:header.data_offset]
+    payload = data[header.data_offset:header.data_offset + header.data_size]
+    if len(payload) % (2 * header.channels):
+        raise Incompressible("data chunk ends in a partial sample frame")
+    if len(data) > header.data_offset + len(payload):
+        raise Incompressible("chunks after the data chunk")
+    return header, prefix, payload
+
+
+# FLAC decodes to a bare 44-byte header, so anything else before the data
+# (LIST, fact, ...) only survives in the framed container, which keeps it verbatim
+def _flac_safe(header, prefix, payload):
+    from chunkStore import wav_header
+
+    return prefix == wav_header(header.sample_rate, len(payload), header.channels)
+
+
+def write_framed(out, data, codec):
+    header, prefix, payload = _split_wav(data)
+    pcm = np.frombuffer(payload, dtype="<i2")
+    frame_samples = max(1, header.sample_rate * header.channels * FRAME_SECONDS)
+    compress = _compressor(codec)
+    out.write(FRAMED_HEADER.pack(FRAMED_MAGIC, FRAMED_VERSION, FRAMED_CODECS[codec], FILTER_DELTA_PLANES,
+                                 len(prefix), frame_samples))
+    out.write(prefix)
+    for start in range(0, len(pcm), frame_samples):
+        raw = pack_samples(pcm[start:start + frame_samples])
+        packed = compress(raw)
+        out.write(FRAME_HEADER.pack(len(raw), len(packed)))
+        out.write(packed)
+
+
+# Yields (prefix, frame_samples) first, then int16 arrays one frame at a time
+def iter_framed(f):
+    magic, version, codec_id, _, prefix_len, frame_samples = FRAMED_HEADER.unpack(f.read(FRAMED_HEADER.size))
+    if magic != FRAMED_MAGIC or version != FRAMED_VERSION:
+        raise ValueError("not a framed PCM recording")
+    decompress = _decompressor(codec_id)
+    yield f.read(prefix_len), frame_samples
+    while True:
+        head = f.read(FRAME_HEADER.size)
+        if len(head) < FRAME_HEADER.size:
+            return
+        _, packed_len = FRAME_HEADER.unpack(head)
+        yield unpack_samples(decompress(f.read(packed_len)))
+
+
+# Decode any stored form (.wav, .flac, .ccaf) back to the original WAV bytes
+def read_recording(path):
+    if path.endswith(".flac"):
+        if soundfile is None:
+            raise RuntimeError("soundfile is required to read FLAC recordings")
+        pcm, rate = soundfile.read(path, dtype="int16")
+        from chunkStore import wav_header
+
+        channels = 1 if pcm.ndim == 1 else pcm.shape[1]
+        return wav_header(rate, pcm.nbytes, channels) + pcm.astype("<i2", copy=False).tobytes()
+    if path.endswith(".ccaf"):
+        with open(path, "rb") as f:
+            frames = iter_framed(f)
+            prefix, _ = next(frames)
+            return prefix + b"".join(frame.astype("<i2", copy=False).tobytes() for frame in frames)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# Compress one finished recording and atomically swap it in. Safe to repeat
+# after a crash at any point: the .wav is only removed once the target exists.
+def compress_file(path, codec):
+    base = os.path.splitext(path)[0]
+    if not os.path.exists(path):
+        for extension in set(EXTENSIONS.values()):
+            if os.path.exists(base + extension):
+                return base + extension, None
+        raise FileNotFoundError(path)
+
+    with open(path, "rb") as f:
+        data = f.read()
+    started = time.perf_counter()
+    header, prefix, payload = _split_wav(data)
+    if codec == "flac" and not _flac_safe(header, prefix, payload):
+        codec = "zstd" if zstandard is not None else "deflate"
+    target = base + EXTENSIONS[codec]
+    tmp = f"{target}.tmp"
+    if codec == "flac":
+        pcm = np.frombuffer(payload, dtype="<i2")
+        if header.channels > 1:
+            pcm = pcm.reshape(-1, header.channels)
+        soundfile.write(tmp, pcm, header.sample_rate, format="FLAC", subtype="PCM_16")
+    else:
+        with open(tmp, "wb") as out:
+            write_framed(out, data, codec)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, target)
+    os.remove(path)
+
+    result = {
+        "codec": codec,
+        "input_bytes": len(data),
+        "output_bytes": os.path.getsize(target),
+        "seconds": time.perf_counter() - started,
+    }
+    return target, result
+
+
+class CompressionTier:
+    # Bounded pool for post-call compression. Every job is journalled as a
+    # small file before it is queued and removed when it completes, so
+    # resume() picks up whatever a restart interrupted.
+    def __init__(self, codec=CODEC, workers=WORKERS, journal_dir=JOURNAL_DIR):
+        self.codec = resolve_codec(codec)
+        self.workers = workers
+        self.journal_dir = journal_dir
+        self.pool = None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def enabled(self):
+        return self.codec != "none"
+
+    def start(self):
+        if not self.enabled or self.pool is not None:
+            return 0
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="compress")
+        return self.resume()
+
+    def resume(self):
+        resumed = 0
+        for job_path in sorted(glob.glob(os.path.join(self.journal_dir, "*.json"))):
+            try:
+                with open(job_path) as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                os.remove(job_path)
+                continue
+            self._queue(job_path, job)
+            resumed += 1
+        if resumed:
+            log.info("Resumed %d compression jobs", resumed)
+        return resumed
+
+    # on_done(call_id, leg, new_path) runs on the worker thread
+    def submit(self, path, call_id=None, leg=None, on_done=None):
+        if not self.enabled or self.pool is None:
+            return None
+        job = {"path": path, "codec": self.codec, "call_id": call_id, "leg": leg, "queued_at": time.time()}
+        job_path = os.path.join(self.journal_dir, f"{uuid.uuid4().hex}.json")
+        with open(f"{job_path}.tmp", "w") as f:
+            json.dump(job, f)
+        os.replace(f"{job_path}.tmp", job_path)
+        return self._queue(job_path, job, on_done)
+
+    def _queue(self, job_path, job, on_done=None):
+        with self.lock:
+            self.in_flight += 1
+        return self.pool.submit(self._run, job_path, job, on_done)
+
+    def _run(self, job_path, job, on_done):
+        skipped = False
+        try:
+            target, result = compress_file(job["path"], job["codec"])
+        except Incompressible as e:
+            with self.lock:
+                self.skipped += 1
+            log.info("Leaving %s uncompressed: %s", job["path"], e, extra={"call_id": job.get("call_id")})
+            target, skipped = None, True
+        except Exception as e:
+            with self.lock:
+                self.failed += 1
+            log.error("Compression of %s failed: %s", job["path"], e, extra={"call_id": job.get("call_id")})
+            target = None
+        else:
+            with self.lock:
+                self.completed += 1
+                if result:
+                    self.bytes_in += result["input_bytes"]
+                    self.bytes_out += result["output_bytes"]
+            if result:
+                log.debug("Compressed %s %.2fx in %.3fs", target, result["input_bytes"] / result["output_bytes"],
+                          result["seconds"], extra={"call_id": job.get("call_id")})
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        # A failed job stays journalled only if the source is still there to retry
+        if target or skipped or not os.path.exists(job["path"]):
+            os.remove(job_path)
+        if target and on_done:
+            on_done(job.get("call_id"), job.get("leg"), target)
+        return target
+
+    # Pending jobs stay in the journal; they run again on the next start()
+    def shutdown(self, wait=False):
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait, cancel_futures=not wait)
+            self.pool = None
+
+    def stats(self):
+        return {
+            "codec": self.codec,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "ratio": round(self.bytes_in / self.bytes_out, 3) if self.bytes_out else None,
+        }
+
+
+tier = CompressionTier()
+
+
+# Round-trips copies of the given WAVs through each codec in a scratch directory
+def run_benchmark(paths, codecs=None, repeats=3):
+    report = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for codec in codecs or available_codecs():
+            total_in = total_out = 0
+            encode_s = decode_s = 0.0
+            stored_as = set()
+            for path in paths:
+                with open(path, "rb") as f:
+                    data = f.read()
+                for _ in range(repeats):
+                    copy = os.path.join(scratch, "bench.wav")
+                    with open(copy, "wb") as f:
+                        f.write(data)
+                    started = time.perf_counter()
+                    target, result = compress_file(copy, codec)
+                    encode_s += time.perf_counter() - started
+                    started = time.perf_counter()
+                    restored = read_recording(target)
+                    decode_s += time.perf_counter() - started
+                    if restored != data:
+                        raise AssertionError(f"{codec} round trip changed {path}")
+                    stored_as.add(result["codec"])
+                    total_in += result["input_bytes"]
+                    total_out += result["output_bytes"]
+                    os.remove(target)
+            report.append({
+                "codec": codec,
+                "stored_as": sorted(stored_as),
+                "ratio": round(total_in / total_out, 3),
+                "encode_mb_s": round(total_in / encode_s / 1e6, 1),
+                "decode_mb_s": round(total_in / decode_s / 1e6, 1),
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-call recording compression")
+    parser.add_argument("files", nargs="*", help="recordings to compress (default with --bench: the sample WAVs)")
+    parser.add_argument("--codec", default=CODEC)
+    parser.add_argument("--bench", action="store_true", help="report ratio and throughput per codec, files untouched")
+    parser.add_argument("--resume", action="store_true", help="run jobs left in the journal and exit")
+    args = parser.parse_args()
+
+    if args.bench:
+        paths = args.files or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            "sample audios-agent1", "*.wav")))
+        codecs = None if args.codec == "auto" else [args.codec]
+        for row in run_benchmark(paths, codecs):
+            stored = "" if row["stored_as"] == [row["codec"]] else f"  (stored as {'/'.join(row['stored_as'])})"
+            print(f"{row['codec']:8} ratio {row['ratio']:.3f}  encode {row['encode_mb_s']} MB/s  "
+                  f"decode {row['decode_mb_s']} MB/s{stored}")
+        return
+
+    compression = CompressionTier(args.codec)
+    compression.start()
+    futures = [compression.submit(path) for path in args.files]
+    for future in futures:
+        future.result()
+    compression.shutdown(wait=True)
+    print(json.dumps(compression.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+# Recording is muted from a little before the first digit until this long after the last one
+MUTE_HOLD_MS = int(os.environ.get("CCA_DTMF_MUTE_MS", "5000"))
+LOOKBACK_MS = int(os.environ.get("CCA_DTMF_LOOKBACK_MS", "200"))
+# Digits go out on WebSocket events only when this is set; otherwise they are masked
+REVEAL_DIGITS = os.environ.get("CCA_DTMF_REVEAL", "0") == "1"
+BATCH_MS = int(os.environ.get("CCA_DTMF_BATCH_MS", "60"))
+
+PT_TELEPHONE_EVENT = 101
+EVENT_DIGITS = "0123456789*#ABCD"
+
+ROW_FREQS = (697.0, 770.0, 852.0, 941.0)
+COL_FREQS = (1209.0, 1336.0, 1477.0, 1633.0)
+KEYPAD = ("123A", "456B", "789C", "*0#D")
+
+# In-band decision thresholds
+MIN_LEVEL_DB = -35.0         # tone power relative to full scale
+MIN_TONE_SHARE = 0.65        # row + column bins as a share of frame energy
+MIN_PEAK_RATIO = 6.0         # strongest bin vs the runner-up in its group (~8 dB)
+MAX_TWIST = 8.0              # row/column power ratio either way (~9 dB)
+
+
+# RFC 4733 telephone-event payload: event, E bit, volume, duration
+def parse_telephone_event(payload):
+    if len(payload) < 4:
+        return None
+    event, flags, duration = struct.unpack_from("!BBH", payload)
+    return event, bool(flags & 0x80), flags & 0x3F, duration
+
+
+class TelephoneEventTracker:
+    # One per RTP stream. An event is sent as many packets sharing an RTP
+    # timestamp, and the end packet is retransmitted; report each event once.
+    def __init__(self):
+        self.last_ts = None
+
+    def update(self, payload, timestamp):
+        parsed = parse_telephone_event(payload)
+        if parsed is None or parsed[0] >= len(EVENT_DIGITS) or timestamp == self.last_ts:
+            return None
+        self.last_ts = timestamp
+        return EVENT_DIGITS[parsed[0]]
+
+
+class GoertzelBank:
+    # The eight DTMF bins for a block of N samples, computed as one matrix
+    # product: (streams x N) @ (N x 16) gives every stream's real and imaginary
+    # parts at once, which is the Goertzel result without the per-sample loop.
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.block = int(round(205 * sample_rate / 8000))
+        freqs = np.array(ROW_FREQS + COL_FREQS)
+        bins = np.round(freqs * self.block / sample_rate)
+        n = np.arange(self.block)[:, None]
+        angle = 2 * np.pi * bins[None, :] * n / self.block
+        self.basis = np.hstack((np.cos(angle), np.sin(angle))).astype(np.float32)
+        # Bin power of a full-scale sine: (N/2)^2 * 32768^2
+        self.full_scale = (self.block / 2.0 * 32768.0) ** 2
+
+    # blocks: (streams, N) -> digit per row ("" when nothing valid)
+    def detect(self, blocks):
+        blocks = blocks.astype(np.float32, copy=False)
+        parts = blocks @ self.basis
+        power = parts[:, :8] ** 2 + parts[:, 8:] ** 2
+        energy = np.einsum("ij,ij->i", blocks, blocks) * (self.block / 2.0)
+
+        rows, cols = power[:, :4], power[:, 4:]
+        row = rows.argmax(axis=1)
+        col = cols.argmax(axis=1)
+        index = np.arange(len(blocks))
+        row_peak = rows[index, row]
+        col_peak = cols[index, col]
+        rows_sorted = np.sort(rows, axis=1)
+        cols_sorted = np.sort(cols, axis=1)
+
+        ok = (row_peak + col_peak) > self.full_scale * 10 ** (MIN_LEVEL_DB / 10)
+        ok &= (row_peak + col_peak) > MIN_TONE_SHARE * energy
+        ok &= row_peak > MIN_PEAK_RATIO * rows_sorted[:, -2]
+        ok &= col_peak > MIN_PEAK_RATIO * cols_sorted[:, -2]
+        ok &= (row_peak < MAX_TWIST * col_peak) & (col_peak < MAX_TWIST * row_peak)
+        return [KEYPAD[r][c] if good else "" for r, c, good in zip(row.tolist(), col.tolist(), ok.tolist())]
+
+
+class InbandStream:
+    # Per-stream sample buffer plus debounce state: a digit is reported on
+    # its first valid block and not again until a block without it
+    def __init__(self, key, sample_rate, on_digit):
+        self.key = key
+        self.sample_rate = sample_rate
+        self.on_digit = on_digit
+        self.pending = []
+        self.buffered = 0
+        self.position = 0  # samples consumed so far
+        self.current = ""
+        # pending is filled by the tap thread and drained by whichever thread runs the batch
+        self.lock = threading.Lock()
+
+    def append(self, pcm):
+        with self.lock:
+            self.pending.append(pcm)
+            self.buffered += len(pcm)
+
+    # All whole blocks buffered so far as one array (None if there are none); the rest stays pending
+    def take(self, block):
+        with self.lock:
+            count = self.buffered // block
+            if not count:
+                return None
+            data = np.concatenate(self.pending) if len(self.pending) > 1 else self.pending[0]
+            used = count * block
+            rest = data[used:]
+            self.pending = [rest] if len(rest) else []
+            self.buffered = len(rest)
+        return data[:used].reshape(count, block)
+
+
+class BatchedDtmfDetector:
+    # Shared across every tapped leg. Sinks append audio from the media thread;
+    # once BATCH_MS has passed, all full blocks from all streams of the same
+    # sample rate go through one GoertzelBank.detect() call.
+    def __init__(self, batch_ms=BATCH_MS):
+        self.batch_ms = batch_ms
+        self.streams = {}
+        self.banks = {}
+        self.lock = threading.Lock()
+        # One batch at a time; a thread that finds one running leaves its audio for it
+        self.processing = threading.Lock()
+        self.last_run = time.monotonic()
+        self.blocks_processed = 0
+
+    def open_stream(self, key, sample_rate, on_digit):
+        with self.lock:
+            stream = self.streams[key] = InbandStream(key, sample_rate, on_digit)
+            if sample_rate not in self.banks:
+                self.banks[sample_rate] = GoertzelBank(sample_rate)
+        return stream
+
+    def close_stream(self, key):
+        with self.lock:
+            self.streams.pop(key, None)
+
+    def push(self, stream, pcm):
+        stream.append(pcm)
+        now = time.monotonic()
+        if (now - self.last_run) * 1000 >= self.batch_ms:
+            self.last_run = now
+            self.process()
+
+    def process(self):
+        if not self.processing.acquire(blocking=False):
+            return
+        try:
+            self._process()
+        finally:
+            self.processing.release()
+
+    def _process(self):
+        with self.lock:
+            streams = list(self.streams.values())
+        by_rate = {}
+        for stream in streams:
+            blocks = stream.take(self.banks[stream.sample_rate].block)
+            if blocks is not None:
+                by_rate.setdefault(stream.sample_rate, []).append((stream, blocks))
+
+        for rate, items in by_rate.items():
+            bank = self.banks[rate]
+            blocks = np.concatenate([b for _, b in items]) if len(items) > 1 else items[0][1]
+            digits = bank.detect(blocks)
+            self.blocks_processed += len(blocks)
+            offset = 0
+            for stream, stream_blocks in items:
+                for n, digit in enumerate(digits[offset:offset + len(stream_blocks)]):
+                    if digit and digit != stream.current:
+                        at_ms = (stream.position + n * bank.block) * 1000 // rate
+                        stream.on_digit(digit, at_ms)
+                    stream.current = digit
+                stream.position += len(stream_blocks) * bank.block
+                offset += len(stream_blocks)
+
+
+detector = BatchedDtmfDetector()
+
+
+class MuteController:
+    # Per-call mute state shared by the call's recording sinks. Intervals are
+    # kept in call milliseconds so a sink can zero audio it has held back.
+    # Paused/resumed is reported once per call, not per sink: paused when an
+    # interval opens, resumed once every sink has written past its end.
+    def __init__(self, hold_ms=MUTE_HOLD_MS, lookback_ms=LOOKBACK_MS, on_change=None):
+        self.hold_ms = hold_ms
+        self.lookback_ms = lookback_ms
+        self.on_change = on_change
+        self.intervals = []  # [start_ms, end_ms]
+        self.resumed = 0  # intervals whose resume has been reported
+        self.positions = {}  # sink -> call ms written so far
+        self.now_ms = 0  # newest audio the sinks have seen, in call time
+        self.lock = threading.Lock()
+
+    # A digit at at_ms (call time) mutes [at_ms - lookback, at_ms + hold]
+    def digit(self, at_ms):
+        start, end = max(0, at_ms - self.lookback_ms), at_ms + self.hold_ms
+        with self.lock:
+            # Extend the open interval; once its resume is out, a new one starts
+            if len(self.intervals) > self.resumed and start <= self.intervals[-1][1]:
+                self.intervals[-1][1] = max(self.intervals[-1][1], end)
+                return
+            self.intervals.append([start, end])
+        if self.on_change:
+            self.on_change("recording_paused", start)
+
+    def add_sink(self, sink):
+        with self.lock:
+            self.positions[sink] = 0
+
+    def remove_sink(self, sink):
+        with self.lock:
+            self.positions.pop(sink, None)
+        self.released(None, None)
+
+    # A sink has written up to position_ms
+    def released(self, sink, position_ms):
+        with self.lock:
+            if sink is not None:
+                self.positions[sink] = position_ms
+            if self.resumed >= len(self.intervals) or not self.positions:
+                return
+            slowest = min(self.positions.values())
+            at_ms = None
+            while self.resumed < len(self.intervals) and self.intervals[self.resumed][1] <= slowest:
+                at_ms = self.intervals[self.resumed][1]
+                self.resumed += 1
+        if at_ms is not None and self.on_change:
+            self.on_change("recording_resumed", at_ms)
+
+    # For digits that arrive without an audio position (RFC 4733, SIP INFO)
+    def digit_now(self):
+        self.digit(self.now_ms)
+
+    def muted_span(self, start_ms, end_ms):
+        with self.lock:
+            for interval_start, interval_end in reversed(self.intervals):
+                if interval_end <= start_ms:
+                    return False
+                if interval_start < end_ms:
+                    return True
+        return False
+
+
+class MutingSink:
+    # Wraps a recording sink with a LOOKBACK_MS delay line so a digit detected
+    # a block late still mutes the tone that triggered it
+    def __init__(self, inner, controller):
+        self.inner = inner
+        self.controller = controller
+        self.held = []
+        self.held_samples = 0
+        self.position = 0  # samples released to the inner sink
+        self.rate = None
+        controller.add_sink(self)
+
+    def __call__(self, pcm, rate):
+        self.rate = rate
+        self.held.append(pcm)
+        self.held_samples += len(pcm)
+        self.controller.now_ms = max(self.controller.now_ms, (self.position + self.held_samples) * 1000 // rate)
+        limit = rate * self.controller.lookback_ms // 1000
+        while self.held and self.held_samples - len(self.held[0]) >= limit:
+            self._release(self.held.pop(0))
+
+    def _release(self, pcm):
+        self.held_samples -= len(pcm)
+        start_ms = self.position * 1000 // self.rate
+        self.position += len(pcm)
+        end_ms = self.position * 1000 // self.rate
+        muted = self.controller.muted_span(start_ms, end_ms)
+        self.inner(np.zeros_like(pcm) if muted else pcm, self.rate)
+        self.controller.released(self, end_ms)
+
+    def close(self):
+        while self.held:
+            self._release(self.held.pop(0))
+        self.controller.remove_sink(self)
+        closer = getattr(self.inner, "close", None)
+        if closer:
+            closer()
+
+
+class InbandSink:
+    # LegTap sink feeding the shared batched detector
+    def __init__(self, key, on_digit, batch=None):
+        self.key = key
+        self.on_digit = on_digit
+        self.batch = batch or detector
+        self.stream = None
+
+    def __call__(self, pcm, rate):
+        if self.stream is None:
+            self.stream = self.batch.open_stream(self.key, rate, self.on_digit)
+        self.batch.push(self.stream, pcm)
+
+    def close(self):
+        self.batch.close_stream(self.key)
+
+
+def digit_event(call_id, leg, digit, source, at_ms):
+    return {"call_id": call_id, "leg": leg, "digit": digit if REVEAL_DIGITS else None, "masked": not REVEAL_DIGITS,
+            "source": source, "at_ms": at_ms}
+
+
+def tone(digit, ms, rate=8000, level=0.3):
+    row = next(r for r, keys in enumerate(KEYPAD) if digit in keys)
+    col = KEYPAD[row].index(digit)
+    t = np.arange(rate * ms // 1000) / rate
+    wave = np.sin(2 * np.pi * ROW_FREQS[row] * t) + np.sin(2 * np.pi * COL_FREQS[col] * t)
+    return (wave * level * 16383).astype(np.int16)
+
+
+# Cost of in-band detection for N concurrent streams, batched vs one call per stream
+def run_benchmark(streams=100, seconds=10, rate=8000):
+    rng = np.random.default_rng(1)
+    audio = (rng.normal(0, 1500, (streams, rate * seconds))).astype(np.int16)
+    sequence = "4111111111111111"
+    position = rate
+    for digit in sequence:
+        audio[0, position:position + rate // 10] += tone(digit, 100, rate)
+        position += rate // 5
+    frame = rate // 50
+    report = {"streams": streams, "audio_seconds": seconds}
+    for mode in ("batched", "per_stream"):
+        found = []
+        # per_stream: one detector (one NumPy call) per stream, as an unbatched design would do
+        detectors = [BatchedDtmfDetector()] if mode == "batched" else [BatchedDtmfDetector() for _ in range(streams)]
+        handles = [detectors[n % len(detectors)].open_stream(n, rate, lambda d, at, n=n: found.append((n, d)))
+                   for n in range(streams)]
+        started = time.process_time()
+        for offset in range(0, rate * seconds, frame):
+            for n, handle in enumerate(handles):
+                handle.append(audio[n, offset:offset + frame])
+            if (offset + frame) % (rate * BATCH_MS // 1000) < frame:
+                for batch in detectors:
+                    batch.process()
+        for batch in detectors:
+            batch.process()
+        cpu = time.process_time() - started
+        digits = "".join(d for n, d in found if n == 0)
+        report[mode] = {"cpu_ms_per_audio_second": round(cpu * 1000 / seconds, 2),
+                        "digits_ok": digits == sequence, "false_digits": sum(1 for n, _ in found if n != 0)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DTMF detection benchmark")
+    parser.add_argument("--streams", type=int, default=100)
+    parser.add_argument("--seconds", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.streams, args.seconds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
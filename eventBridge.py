@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger("cca.bridge")
+
+
+class EventBridge:
+    # Hands work from pjsip threads to the asyncio loop. Callbacks queue up in a
+    # deque and the loop drains them in one batch per wakeup, so a burst of
+    # pjsip events costs one call_soon_threadsafe instead of one per event.
+    def __init__(self):
+        self.loop = None
+        self.pending = deque()
+        self.scheduled = False
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.delivered = 0
+
+    def attach(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+
+    def detach(self):
+        self.loop = None
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    # Run fn(*args) on the loop; coroutine functions are scheduled as tasks
+    def submit(self, fn, *args):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            self.dropped += 1
+            log.debug("No event loop attached, dropped %s", getattr(fn, "__name__", fn))
+            return
+        with self.lock:
+            self.pending.append((fn, args))
+            if self.scheduled:
+                return
+            self.scheduled = True
+        try:
+            loop.call_soon_threadsafe(self._drain)
+        except RuntimeError:
+            # Loop shut down between the check and the call
+            with self.lock:
+                self.dropped += len(self.pending)
+                self.pending.clear()
+                self.scheduled = False
+
+    def _drain(self):
+        with self.lock:
+            batch = list(self.pending)
+            self.pending.clear()
+            self.scheduled = False
+        for fn, args in batch:
+            try:
+                result = fn(*args)
+                if asyncio.iscoroutine(result):
+                    self.loop.create_task(result)
+            except Exception:
+                log.exception("Bridged callback %s failed", getattr(fn, "__name__", fn))
+        self.delivered += len(batch)
+
+    def stats(self):
+        return {"depth": self.depth, "delivered": self.delivered, "dropped": self.dropped}
+
+
+bridge = EventBridge()
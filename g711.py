@@ -0,0 +1,50 @@
+import numpy as np
+
+# RTP static payload types for G.711
+PT_PCMU = 0
+PT_PCMA = 8
+
+# Upper bound of each mu-law segment, on the 14-bit scale the reference coder uses
+_ULAW_SEG_END = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF], dtype=np.int32)
+
+
+# Same rounding as the ITU/Sun reference coder (and audioop.lin2ulaw)
+def ulaw_encode(pcm):
+    samples = pcm.astype(np.int32) >> 2
+    mask = np.where(samples < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(samples), 8159) + 0x21
+    segment = np.searchsorted(_ULAW_SEG_END, magnitude)
+    code = np.where(segment > 7, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    return (code ^ mask).astype(np.uint8).tobytes()
+
+
+def _ulaw_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _alaw_table():
+    codes = np.arange(256, dtype=np.int32) ^ 0x55
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = np.where(exponent == 0, (mantissa << 4) + 8, ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0))
+    return np.where(codes & 0x80, magnitude, -magnitude).astype(np.int16)
+
+
+# 256-entry decode tables: decoding is a single fancy-index per packet
+ULAW_TABLE = _ulaw_table()
+ALAW_TABLE = _alaw_table()
+
+
+def ulaw_decode(payload):
+    return ULAW_TABLE[np.frombuffer(payload, dtype=np.uint8)]
+
+
+def alaw_decode(payload):
+    return ALAW_TABLE[np.frombuffer(payload, dtype=np.uint8)]
+
+
+DECODERS = {PT_PCMU: ulaw_decode, PT_PCMA: alaw_decode}
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import socket
+import time
+
+from recorder import RECORDINGS_DIR
+
+log = logging.getLogger("cca.handoff")
+
+# How long a draining instance lets in-progress calls run before hanging up;
+# deployments with long calls and a rolling restart raise this
+DRAIN_TIMEOUT = float(os.environ.get("CCA_DRAIN_TIMEOUT", "30"))
+# Where the outgoing instance leaves its call state for the replacement
+STATE_FILE = os.environ.get("CCA_STATE_FILE", os.path.join(RECORDINGS_DIR, ".state", "active_calls.json"))
+# Listen with SO_REUSEPORT so a replacement can bind while this one drains.
+# Opt-in for rolling-restart deployments only: with it on, any process under
+# the same user can bind the SIP and HTTP ports and take a share of the traffic.
+REUSE_PORT = (os.environ.get("CCA_REUSE_PORT", "0") == "1" and DRAIN_TIMEOUT > 0
+              and hasattr(socket, "SO_REUSEPORT"))
+# Left next to STATE_FILE while an instance drains, so its replacement knows a snapshot is coming
+DRAIN_MARKER = f"{STATE_FILE}.draining"
+# How long a fresh instance keeps looking for a snapshot from the one it replaces
+RESTORE_WINDOW = DRAIN_TIMEOUT + 60
+# With no drain announced, how long it waits for one (the old instance may be signalled just after this one starts)
+RESTORE_GRACE = float(os.environ.get("CCA_RESTORE_GRACE", "15"))
+
+
+# A listening TCP socket the next instance can bind alongside this one
+def listen_socket(host, port, backlog=128):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if REUSE_PORT:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def mark_draining(path=DRAIN_MARKER):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(str(os.getpid()))
+
+
+# True while another live process has announced a drain and not yet written its snapshot
+def predecessor_draining(path=DRAIN_MARKER):
+    try:
+        with open(path) as f:
+            pid = int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return False
+    if pid <= 0 or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False  # died mid-drain; no snapshot is coming
+    except PermissionError:
+        pass
+    return True
+
+
+def write_snapshot(calls, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w") as f:
+        json.dump({"written_at": time.time(), "pid": os.getpid(), "calls": calls}, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    try:
+        os.remove(DRAIN_MARKER)
+    except FileNotFoundError:
+        pass
+    log.info("Wrote call state for %d calls to %s", len(calls), path)
+
+
+# Take ownership of a snapshot: the rename makes sure only one instance restores it
+def take_snapshot(path=STATE_FILE):
+    claimed = f"{path}.{os.getpid()}.restoring"
+    try:
+        os.replace(path, claimed)
+    except FileNotFoundError:
+        return None
+    try:
+        with open(claimed) as f:
+            snapshot = json.load(f)
+    except ValueError as e:
+        log.error("Unreadable call state left at %s: %s", claimed, e)
+        return None
+    os.remove(claimed)
+    return snapshot
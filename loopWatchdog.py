@@ -0,0 +1,200 @@
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+log = logging.getLogger("cca.watchdog")
+
+# Heartbeat period of the loop probe, and how late it may be before the loop counts as blocked
+INTERVAL = float(os.environ.get("CCA_WATCHDOG_INTERVAL", "0.1"))
+LOOP_THRESHOLD_MS = float(os.environ.get("CCA_LOOP_STALL_MS", "200"))
+# A pjsip callback running longer than this holds up SIP and media for every call
+CALLBACK_THRESHOLD_MS = float(os.environ.get("CCA_CALLBACK_STALL_MS", "100"))
+STALL_HISTORY = 50
+MAX_PROFILE_SECONDS = 60
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_names():
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+
+class Watchdog:
+    # Two probes, one watcher. The loop probe is a task that wakes every
+    # INTERVAL and records how late it was; pjsip callbacks wrapped with
+    # timed() record how long they ran. A separate thread checks both, so a
+    # stall is seen while it is still happening and the stack captured is
+    # the code doing the blocking, not whatever ran after it.
+    def __init__(self, interval=INTERVAL, loop_threshold_ms=LOOP_THRESHOLD_MS,
+                 callback_threshold_ms=CALLBACK_THRESHOLD_MS):
+        self.interval = interval
+        self.loop_threshold = loop_threshold_ms / 1000
+        self.callback_threshold = callback_threshold_ms / 1000
+        self.loop_thread = None
+        self.beat = None
+        self.lags = deque(maxlen=600)  # ~1 min of loop lag samples
+        self.callbacks = {}  # name -> [count, total, max]
+        self.in_flight = {}  # thread id -> [(name, started), ...], innermost last
+        self.lock = threading.Lock()  # callbacks and in_flight are touched from every pjsip thread
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        self.reported = set()  # stalls already captured, so each is logged once
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.profile_lock = threading.Lock()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.beat = time.perf_counter()
+        self.stopped.clear()
+        self.task = loop.create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="cca-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.lags.append(max(0.0, now - expected))
+            self.beat = now
+
+    # Loop lag right now: the last sample, or the stall in progress if the probe is overdue
+    def lag_ms(self):
+        last = self.lags[-1] if self.lags else 0.0
+        if self.beat is not None:
+            last = max(last, time.perf_counter() - self.beat - self.interval)
+        return max(0.0, last) * 1000
+
+    # Decorator for pjsip callbacks (onCallState, onIncomingCall, ...)
+    def timed(self, name):
+        def wrap(fn):
+            @functools.wraps(fn)
+            def timed_callback(*args, **kwargs):
+                ident = threading.get_ident()
+                started = time.perf_counter()
+                entry = (name, started)
+                # A stack per thread: a timed callback can run inside another
+                with self.lock:
+                    self.in_flight.setdefault(ident, []).append(entry)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    with self.lock:
+                        running = self.in_flight.get(ident)
+                        if running:
+                            running.remove(entry)
+                            if not running:
+                                del self.in_flight[ident]
+                        stats = self.callbacks.get(name)
+                        if stats is None:
+                            stats = self.callbacks[name] = [0, 0.0, 0.0]
+                        stats[0] += 1
+                        stats[1] += elapsed
+                        if elapsed > stats[2]:
+                            stats[2] = elapsed
+            return timed_callback
+        return wrap
+
+    def _watch(self):
+        period = min(self.interval, self.loop_threshold, self.callback_threshold) / 2
+        while not self.stopped.wait(period):
+            now = time.perf_counter()
+            beat = self.beat
+            if beat is not None and now - beat - self.interval > self.loop_threshold:
+                self._capture("event_loop", self.loop_thread, beat, now - beat - self.interval)
+            for ident, name, started in self._running():
+                if now - started > self.callback_threshold:
+                    self._capture(f"pjsip:{name}", ident, started, now - started)
+
+    # (thread id, callback, started) for every timed callback in progress, outermost first
+    def _running(self):
+        with self.lock:
+            return [(ident, name, started) for ident, running in self.in_flight.items() for name, started in running]
+
+    def _capture(self, kind, ident, since, duration):
+        key = (kind, ident, since)
+        if key in self.reported:
+            return
+        if len(self.reported) > 4 * STALL_HISTORY:
+            self.reported.clear()
+        self.reported.add(key)
+        frame = sys._current_frames().get(ident)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        stall = {
+            "kind": kind,
+            "thread": thread_names().get(ident, str(ident)),
+            "stalled_ms": round(duration * 1000, 1),
+            "at": time.time(),
+            "stack": [line.rstrip() for line in stack],
+        }
+        self.stalls.append(stall)
+        log.warning("%s blocked for %.0f ms so far", kind, duration * 1000,
+                    extra={"fields": {"thread": stall["thread"], "stack": stall["stack"]}})
+
+    def stats(self):
+        lags = sorted(self.lags)
+        with self.lock:
+            callbacks = {name: list(values) for name, values in self.callbacks.items()}
+        return {
+            "loop_lag_ms": round(self.lag_ms(), 1),
+            "loop_lag_p99_ms": round(lags[int(len(lags) * 0.99)] * 1000, 1) if lags else 0.0,
+            "loop_lag_max_ms": round(lags[-1] * 1000, 1) if lags else 0.0,
+            "callbacks": {name: {"count": count, "avg_ms": round(total * 1000 / count, 3), "max_ms": round(peak * 1000, 3)}
+                          for name, (count, total, peak) in callbacks.items() if count},
+            "in_flight": [{"callback": name, "running_ms": round((time.perf_counter() - started) * 1000, 1)}
+                          for _, name, started in self._running()],
+            "stalls": len(self.stalls),
+        }
+
+    # Statistical profile of every thread: collapsed stacks ("a;b;c count"),
+    # the input format of flamegraph.pl and speedscope. Blocks; run it off the loop.
+    def profile(self, seconds, interval=0.005):
+        if not self.profile_lock.acquire(blocking=False):
+            raise RuntimeError("a profile is already running")
+        try:
+            own = threading.get_ident()
+            counts = Counter()
+            names = thread_names()
+            deadline = time.perf_counter() + min(seconds, MAX_PROFILE_SECONDS)
+            samples = 0
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(frame_label(frame))
+                        frame = frame.f_back
+                    if ident not in names:
+                        names = thread_names()
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    counts[";".join(reversed(labels))] += 1
+                samples += 1
+                time.sleep(interval)
+            return samples, counts
+        finally:
+            self.profile_lock.release()
+
+
+def collapsed(counts):
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+watchdog = Watchdog()
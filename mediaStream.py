@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pjsua2 as pj
+
+from g711 import ulaw_encode
+
+log = logging.getLogger("cca.media")
+
+# Batching and backpressure knobs, overridable from the environment
+BATCH_MS = int(os.environ.get("CCA_AUDIO_BATCH_MS", "100"))
+MEDIA_CLOCK_RATE = int(os.environ.get("CCA_MEDIA_CLOCK_RATE", "16000"))
+PREVIEW_RATE = int(os.environ.get("CCA_AUDIO_PREVIEW_RATE", "8000"))
+SUBSCRIBER_QUEUE = int(os.environ.get("CCA_AUDIO_QUEUE_BATCHES", "20"))  # ~2 s at 100 ms
+
+# Binary message: header followed by the encoded samples.
+#   version u8, encoding u8, stream u16, seq u32, timestamp_ms u32 (network order)
+# Which call/leg/rate a stream number means is announced in an "audio_start" text event.
+AUDIO_VERSION = 1
+AUDIO_HEADER = struct.Struct("!BBHII")
+ENCODINGS = {"pcm16": 1, "ulaw": 2, "preview": 3}
+
+
+# Box-filter decimation for integer ratios, linear interpolation otherwise
+def downsample(pcm, rate, target):
+    if target >= rate:
+        return pcm
+    if rate % target == 0:
+        factor = rate // target
+        usable = len(pcm) - len(pcm) % factor
+        return pcm[:usable].reshape(-1, factor).mean(axis=1).astype(np.int16)
+    positions = np.arange(0, len(pcm), rate / target)
+    return np.interp(positions, np.arange(len(pcm)), pcm).astype(np.int16)
+
+
+def encode(pcm, rate, encoding):
+    if encoding == "pcm16":
+        return pcm.astype("<i2", copy=False).tobytes()
+    if encoding == "ulaw":
+        return ulaw_encode(pcm)
+    return ulaw_encode(downsample(pcm, rate, PREVIEW_RATE))
+
+
+def encoding_rate(encoding, rate):
+    return min(rate, PREVIEW_RATE) if encoding == "preview" else rate
+
+
+class Subscriber:
+    # One agent socket's audio feed. Media threads append to bounded deques;
+    # the sender task on the loop drains them. A full audio deque drops its
+    # oldest batch, so a slow client loses audio, never call-state events.
+    def __init__(self, websocket, encoding, loop, max_batches=SUBSCRIBER_QUEUE):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.loop = loop
+        self.audio = deque(maxlen=max_batches)
+        self.control = deque()
+        self.wake = asyncio.Event()
+        self.wake_pending = False
+        self.dropped = 0
+        self.sent = 0
+        self.task = None
+
+    def offer(self, message):
+        if len(self.audio) == self.audio.maxlen:
+            self.dropped += 1
+        self.audio.append(message)
+        self._wake()
+
+    def offer_control(self, text):
+        self.control.append(text)
+        self._wake()
+
+    def _wake(self):
+        if not self.wake_pending:
+            self.wake_pending = True
+            try:
+                self.loop.call_soon_threadsafe(self.wake.set)
+            except RuntimeError:
+                pass
+
+    async def run(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            self.wake_pending = False
+            while self.control or self.audio:
+                if self.control:
+                    await self.websocket.send_text(self.control.popleft())
+                else:
+                    await self.websocket.send_bytes(self.audio.popleft())
+                    self.sent += 1
+
+
+class StreamBatcher:
+    # Collects 20 ms frames for one call leg and publishes ~BATCH_MS batches
+    def __init__(self, hub, stream_id, call_id, agent_dnis, leg, rate):
+        self.hub = hub
+        self.stream_id = stream_id
+        self.call_id = call_id
+        self.agent_dnis = agent_dnis
+        self.leg = leg
+        self.rate = rate
+        self.batch_samples = rate * BATCH_MS // 1000
+        self.chunks = []
+        self.buffered = 0
+        self.seq = 0
+        self.samples_sent = 0
+
+    def __call__(self, pcm, rate):
+        if not self.hub.has_listeners(self.agent_dnis):
+            # Nobody is listening: keep the clock moving, skip the work
+            self.samples_sent += len(pcm)
+            return
+        self.chunks.append(pcm)
+        self.buffered += len(pcm)
+        if self.buffered >= self.batch_samples:
+            self.flush()
+
+    def flush(self):
+        if not self.chunks:
+            return
+        batch = np.concatenate(self.chunks) if len(self.chunks) > 1 else self.chunks[0]
+        self.chunks = []
+        self.buffered = 0
+        timestamp_ms = self.samples_sent * 1000 // self.rate
+        self.hub.publish(self, batch, timestamp_ms)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.samples_sent += len(batch)
+
+    def close(self):
+        self.flush()
+        self.hub.close_stream(self)
+
+
+class AudioHub:
+    def __init__(self):
+        # agent_dnis -> tuple of Subscriber; replaced wholesale so media threads
+        # can read it without taking the lock
+        self.subscribers = {}
+        self.by_socket = {}
+        self.streams = {}
+        self.next_stream = 0
+        self.lock = threading.Lock()
+
+    def has_listeners(self, agent_dnis):
+        return bool(self.subscribers.get(agent_dnis))
+
+    def subscribe(self, agent_dnis, websocket, encoding):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown audio encoding {encoding}")
+        loop = asyncio.get_running_loop()
+        subscriber = Subscriber(websocket, encoding, loop)
+        with self.lock:
+            self.subscribers[agent_dnis] = self.subscribers.get(agent_dnis, ()) + (subscriber,)
+            self.by_socket[websocket] = subscriber
+            live = [s for s in self.streams.values() if s.agent_dnis == agent_dnis]
+        for stream in live:
+            subscriber.offer_control(self._start_event(stream, encoding))
+        subscriber.task = loop.create_task(subscriber.run())
+        return subscriber
+
+    def unsubscribe(self, agent_dnis, subscriber):
+        with self.lock:
+            remaining = tuple(s for s in self.subscribers.get(agent_dnis, ()) if s is not subscriber)
+            if remaining:
+                self.subscribers[agent_dnis] = remaining
+            else:
+                self.subscribers.pop(agent_dnis, None)
+            self.by_socket.pop(subscriber.websocket, None)
+        if subscriber.task:
+            subscriber.task.cancel()
+
+    # Sockets with an audio feed get state events through their sender task,
+    # ahead of queued audio, so notify_websockets never waits behind audio
+    def subscriber_for(self, websocket):
+        return self.by_socket.get(websocket)
+
+    def open_stream(self, call_id, agent_dnis, leg, rate=MEDIA_CLOCK_RATE):
+        with self.lock:
+            stream_id = self.next_stream
+            self.next_stream = (self.next_stream + 1) & 0xFFFF
+            stream = StreamBatcher(self, stream_id, call_id, agent_dnis, leg, rate)
+            self.streams[stream_id] = stream
+        for subscriber in self.subscribers.get(agent_dnis, ()):
+            subscriber.offer_control(self._start_event(stream, subscriber.encoding))
+        return stream
+
+    def close_stream(self, stream):
+        with self.lock:
+            self.streams.pop(stream.stream_id, None)
+        event = json.dumps({"event": "audio_end", "data": {"stream": stream.stream_id, "call_id": stream.call_id}})
+        for subscriber in self.subscribers.get(stream.agent_dnis, ()):
+            subscriber.offer_control(event)
+
+    # Runs on the media thread: encode once per encoding in use, then fan out
+    def publish(self, stream, pcm, timestamp_ms):
+        subscribers = self.subscribers.get(stream.agent_dnis, ())
+        encoded = {}
+        for subscriber in subscribers:
+            message = encoded.get(subscriber.encoding)
+            if message is None:
+                header = AUDIO_HEADER.pack(AUDIO_VERSION, ENCODINGS[subscriber.encoding],
+                                           stream.stream_id, stream.seq, timestamp_ms & 0xFFFFFFFF)
+                message = encoded[subscriber.encoding] = header + encode(pcm, stream.rate, subscriber.encoding)
+            subscriber.offer(message)
+
+    @staticmethod
+    def _start_event(stream, encoding):
+        return json.dumps({"event": "audio_start", "data": {
+            "stream": stream.stream_id,
+            "call_id": stream.call_id,
+            "leg": stream.leg,
+            "encoding": encoding,
+            "sample_rate": encoding_rate(encoding, stream.rate),
+        }})
+
+    def stats(self):
+        return {
+            agent: [{"encoding": s.encoding, "sent": s.sent, "dropped": s.dropped, "queued": len(s.audio)}
+                    for s in subs]
+            for agent, subs in self.subscribers.items()
+        }
+
+
+hub = AudioHub()
+
+
+class MediaLoad:
+    # Time the media thread spends in tap sinks, as a share of wall time since
+    # the last sample; near 1.0 the conference bridge can't keep up with RTP
+    def __init__(self):
+        self.busy = 0.0
+        self.mark = (time.perf_counter(), 0.0)
+
+    def sample(self):
+        now = time.perf_counter()
+        then, busy = self.mark
+        self.mark = (now, self.busy)
+        return (self.busy - busy) / (now - then) if now > then else 0.0
+
+
+media_load = MediaLoad()
+
+
+class LegTap(pj.AudioMediaPort):
+    # Conference-bridge port that receives one leg's decoded audio and hands it,
+    # as an int16 array, to every sink (sink(pcm, rate)) on the media thread
+    def __init__(self, call_id, leg, sinks, rate=MEDIA_CLOCK_RATE):
+        pj.AudioMediaPort.__init__(self)
+        self.call_id = call_id
+        self.leg = leg
+        self.sinks = list(sinks)
+        self.rate = rate
+
+    def create(self):
+        fmt = pj.MediaFormatAudio()
+        fmt.type = pj.PJMEDIA_TYPE_AUDIO
+        fmt.clockRate = self.rate
+        fmt.channelCount = 1
+        fmt.bitsPerSample = 16
+        fmt.frameTimeUsec = 20000
+        self.createPort(f"tap-{self.call_id[:8]}-{self.leg}", fmt)
+
+    def onFrameReceived(self, frame):
+        if frame.type != pj.PJMEDIA_FRAME_TYPE_AUDIO or not self.sinks:
+            return
+        started = time.perf_counter()
+        pcm = np.frombuffer(bytes(frame.buf), dtype="<i2")
+        for sink in self.sinks:
+            try:
+                sink(pcm, self.rate)
+            except Exception as e:
+                log.error("Audio sink failed: %s", e, extra={"call_id": self.call_id})
+        media_load.busy += time.perf_counter() - started
+
+    def close(self):
+        for sink in self.sinks:
+            closer = getattr(sink, "close", None)
+            if closer:
+                closer()
+        self.sinks = []
+
+
+# Hang a LegTap off every active audio stream of the call
+def attach_taps(call, call_id, agent_dnis, sink_factories=()):
+    taps = []
+    info = call.getInfo()
+    for leg, media in enumerate(info.media):
+        if media.type != pj.PJMEDIA_TYPE_AUDIO or media.status != pj.PJSUA_CALL_MEDIA_ACTIVE:
+            continue
+        sinks = [hub.open_stream(call_id, agent_dnis, leg)]
+        sinks.extend(factory(call_id, agent_dnis, leg) for factory in sink_factories)
+        tap = LegTap(call_id, leg, [s for s in sinks if s is not None])
+        tap.media_index = media.index
+        tap.create()
+        call.getAudioMedia(media.index).startTransmit(tap)
+        taps.append(tap)
+    return taps
+
+
+def detach_taps(call, taps):
+    for tap in taps:
+        try:
+            call.getAudioMedia(tap.media_index).stopTransmit(tap)
+        except Exception:
+            pass  # media is already gone once the call has disconnected
+        tap.close()
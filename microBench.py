@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime
+
+from sipFixtures import load_invites
+
+# Results land here unless --output says otherwise
+DEFAULT_OUTPUT = "bench_results.json"
+
+BENCHMARKS = {}
+
+
+# Register a benchmark; setup() returns the zero-argument callable to time
+def benchmark(name, is_async=False):
+    def register(setup):
+        BENCHMARKS[name] = (setup, is_async)
+        return setup
+    return register
+
+
+# The FastAPI service lives in 2.py, which can't be imported by plain name
+def load_service():
+    return importlib.import_module("2")
+
+
+# SIPjson.json INVITEs plus the routing headers the SBC adds for each agent,
+# as whole messages the way pjsua2 hands them over in rdata.wholeMsg
+def fixture_messages():
+    whole = []
+    for agent, messages in load_invites().items():
+        for seq, message in enumerate(messages):
+            head, _, body = message.decode().partition("\r\n\r\n")
+            head += f"\r\nX-Sequence-ID: {seq}\r\nX-Agent-DNIS: {agent.rsplit('-', 1)[-1]}"
+            whole.append(f"{head}\r\n\r\n{body}")
+    return whole
+
+
+def make_call_data(service, n, agent_dnis="agent1"):
+    return service.CallData(
+        call_id=f"call-{n}",
+        seq_id=str(n),
+        agent_dnis=agent_dnis,
+        start_time=datetime(2024, 6, 14, 15, 0, 11),
+        audio_ports={"stream_0": 19514, "stream_1": 29110},
+        codec_info={"name": "PCMA", "clock_rate": "8000", "channels": "1"},
+        status="active"
+    )
+
+
+class NullSocket:
+    # Stands in for the UDP socket so only parsing and response building are timed
+    def sendto(self, data, addr):
+        return len(data)
+
+
+class NullWebSocket:
+    # Mimics starlette's WebSocket.send_text without touching the network
+    async def send_text(self, data):
+        data.encode("utf-8")
+
+
+@benchmark("sip.handle_sip_invite")
+def bench_handle_sip_invite():
+    import ccaConnector
+    invite = load_invites()["sample audios-agent1"][0]
+    sock = NullSocket()
+    return lambda: ccaConnector.handle_sip_invite(sock, invite, ("127.0.0.1", 5060))
+
+
+# A retransmitted INVITE: matched by its bytes and answered from the cache
+@benchmark("sip.invite_retransmission")
+def bench_invite_retransmission():
+    import ccaConnector
+    invite = load_invites()["sample audios-agent1"][0]
+    sock = NullSocket()
+    ccaConnector.handle_sip_request(sock, invite, ("127.0.0.1", 5060))
+    return lambda: ccaConnector.handle_sip_request(sock, invite, ("127.0.0.1", 5060))
+
+
+@benchmark("sip.transaction_key")
+def bench_transaction_key():
+    from sipTransactions import transaction_key
+    invite = load_invites()["sample audios-agent1"][0]
+    return lambda: transaction_key(invite)
+
+
+@benchmark("sip.generate_sip_200_ok")
+def bench_generate_sip_200_ok():
+    import ccaConnector
+    return lambda: ccaConnector.generate_sip_200_ok("a84b4c76e66710@pc33.atlanta.com", "33202287 INVITE")
+
+
+@benchmark("sip.extract_call_headers")
+def bench_extract_call_headers():
+    service = load_service()
+    message = fixture_messages()[0]
+    return lambda: service.extract_call_headers(message)
+
+
+@benchmark("model.call_data_create")
+def bench_call_data_create():
+    service = load_service()
+    return lambda: make_call_data(service, 1)
+
+
+@benchmark("model.call_data_dict")
+def bench_call_data_dict():
+    service = load_service()
+    call_data = make_call_data(service, 1)
+    return lambda: call_data.dict()
+
+
+@benchmark("rtp.quality_update")
+def bench_quality_update():
+    from rtpQuality import StreamQuality
+    stats = StreamQuality(8000, "PCMU")
+    state = {"seq": 0}
+
+    def run():
+        seq = state["seq"] = state["seq"] + 1
+        stats.update(seq & 0xFFFF, seq * 160, seq * 0.02)
+    return run
+
+
+def _fanout(sockets):
+    service = load_service()
+    call_data = make_call_data(service, 1)
+    service.active_connections.clear()
+    service.active_connections[call_data.agent_dnis] = {NullWebSocket() for _ in range(sockets)}
+    return lambda: service.notify_websockets(call_data)
+
+
+@benchmark("ws.notify_websockets_1", is_async=True)
+def bench_notify_websockets_1():
+    return _fanout(1)
+
+
+@benchmark("ws.notify_websockets_100", is_async=True)
+def bench_notify_websockets_100():
+    return _fanout(100)
+
+
+def _api(path, calls=100):
+    import httpx
+    service = load_service()
+    service.active_calls.clear()
+    for n in range(calls):
+        call_data = make_call_data(service, n, agent_dnis=f"agent{n % 3 + 1}")
+        service.active_calls[call_data.call_id] = call_data
+    # ASGITransport doesn't run lifespan events, so pjsua2 is never started
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=service.app), base_url="http://bench")
+
+    async def request():
+        response = await client.get(path)
+        response.raise_for_status()
+    return request
+
+
+@benchmark("api.get_calls_100", is_async=True)
+def bench_get_calls():
+    return _api("/calls")
+
+
+@benchmark("api.get_call", is_async=True)
+def bench_get_call():
+    return _api("/calls/call-42")
+
+
+@benchmark("api.get_agent_calls_100", is_async=True)
+def bench_get_agent_calls():
+    return _api("/calls/agent/agent1")
+
+
+# Time fn until one repeat takes at least min_time, then take `repeats` samples
+def measure(fn, is_async, repeats, min_time):
+    loop = asyncio.new_event_loop() if is_async else None
+
+    def run(loops):
+        if is_async:
+            async def body():
+                for _ in range(loops):
+                    await fn()
+            start = time.perf_counter_ns()
+            loop.run_until_complete(body())
+        else:
+            start = time.perf_counter_ns()
+            for _ in range(loops):
+                fn()
+        return time.perf_counter_ns() - start
+
+    try:
+        loops = 1
+        while True:
+            elapsed = run(loops)
+            if elapsed >= min_time * 1e9 or loops >= 1 << 24:
+                break
+            loops *= 10 if elapsed < min_time * 1e8 else 2
+
+        samples = [run(loops) / loops for _ in range(repeats)]
+    finally:
+        if loop:
+            loop.close()
+
+    median = statistics.median(samples)
+    return {
+        "ns_per_op": round(median, 1),
+        "min_ns": round(min(samples), 1),
+        "stdev_ns": round(statistics.stdev(samples), 1) if len(samples) > 1 else 0.0,
+        "ops_per_sec": round(1e9 / median, 1) if median else None,
+        "loops": loops,
+        "repeats": repeats,
+    }
+
+
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        rev = ""
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "git_rev": rev or None,
+    }
+
+
+def run_benchmarks(selected, repeats, min_time):
+    results = {}
+    for name in selected:
+        setup, is_async = BENCHMARKS[name]
+        # The code under test prints on every call; keep that off the terminal
+        with warnings.catch_warnings(), open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            warnings.simplefilter("ignore", DeprecationWarning)
+            try:
+                results[name] = measure(setup(), is_async, repeats, min_time)
+            except ImportError as e:
+                results[name] = {"skipped": str(e)}
+        result = results[name]
+        if "skipped" in result:
+            print(f"{name:32s} skipped ({result['skipped']})")
+        else:
+            print(f"{name:32s} {result['ns_per_op'] / 1000:12.2f} us/op  {result['ops_per_sec']:14.1f} ops/s")
+    return results
+
+
+# Compare against a baseline file; returns the names that got slower than threshold allows
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    print(f"\nComparison against {baseline_path} (threshold {threshold:.0%})")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or "ns_per_op" not in base or "ns_per_op" not in result:
+            continue
+        ratio = result["ns_per_op"] / base["ns_per_op"]
+        if ratio > 1 + threshold:
+            verdict = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            verdict = "improved"
+        else:
+            verdict = "ok"
+        result["baseline_ns_per_op"] = base["ns_per_op"]
+        result["ratio"] = round(ratio, 3)
+        print(f"{name:32s} {ratio:6.2f}x  {verdict}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the SIP and API hot paths")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per repeat")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against this results file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 = 10%%")
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args()
+
+    selected = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print("\n".join(selected))
+        return 0
+
+    results = run_benchmarks(selected, args.repeats, args.min_time)
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
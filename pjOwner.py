@@ -0,0 +1,94 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger("cca.pjsua")
+
+
+class PjsuaOwner:
+    # One thread creates the pjsua2 endpoint and owns it for the life of the
+    # process: libCreate/libInit/transport binds happen there instead of on the
+    # event loop, and later endpoint calls from the loop (close a transport,
+    # hang up, libDestroy) are queued to it with run().
+    def __init__(self, name="pjsua-owner"):
+        self.name = name
+        self.state = "stopped"
+        self.error = None
+        self.started_at = None
+        self.ready_at = None
+        self.ready = threading.Event()
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    # init() builds the endpoint and returns truthy on success; returns at once
+    def start(self, init):
+        if self.thread is not None:
+            return
+        self.state = "starting"
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._main, args=(init,), name=self.name, daemon=True)
+        self.thread.start()
+
+    def _main(self, init):
+        try:
+            if not init():
+                raise RuntimeError("pjsua2 initialisation failed")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            log.error("pjsua2 start failed: %s", e)
+            self.ready.set()
+            return
+        self.ready_at = time.monotonic()
+        self.state = "ready"
+        self.ready.set()
+        log.info("pjsua2 ready in %.0f ms", (self.ready_at - self.started_at) * 1000)
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            fn, args, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    @property
+    def is_ready(self):
+        return self.state == "ready"
+
+    # Run fn(*args) on the owner thread; awaitable from the loop
+    def run(self, fn, *args):
+        future = concurrent.futures.Future()
+        if not self.is_ready:
+            future.set_exception(RuntimeError(f"pjsua2 is {self.state}"))
+        else:
+            self.jobs.put((fn, args, future))
+        return asyncio.wrap_future(future)
+
+    # Run destroy() (libDestroy) on the owner thread, then let the thread exit
+    async def stop(self, destroy=None):
+        if self.thread is None:
+            return
+        await asyncio.to_thread(self.ready.wait)
+        if self.is_ready and destroy is not None:
+            try:
+                await self.run(destroy)
+            except Exception as e:
+                log.error("pjsua2 shutdown failed: %s", e)
+        self.jobs.put(None)
+        self.state = "stopped"
+        await asyncio.to_thread(self.thread.join, 5)
+
+    def stats(self):
+        stats = {"state": self.state}
+        if self.ready_at is not None:
+            stats["start_ms"] = round((self.ready_at - self.started_at) * 1000, 1)
+        if self.error:
+            stats["error"] = self.error
+        return stats
@@ -0,0 +1,354 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pjsua2 as pj
+
+from dtmf import MUTE_HOLD_MS
+from recorder import leg_path
+
+log = logging.getLogger("cca.recorder")
+
+# "taps" runs every leg through the Python LegTap sinks (live audio, VAD,
+# inband DTMF); "pjsua" records each leg with a pjsua2 AudioMediaRecorder on
+# the conference bridge and keeps Python off the per-frame path
+RECORDER_MODE = os.environ.get("CCA_RECORDER_MODE", "taps")
+# Null sound device: the bridge is clocked by a timer, not a sound card
+NULL_AUDIO = os.environ.get("CCA_NULL_AUDIO", "1") == "1"
+# Worker threads for media (ioqueue polling + jitter buffers) and for SIP
+MEDIA_THREADS = int(os.environ.get("CCA_MEDIA_THREADS", "1"))
+SIP_THREADS = int(os.environ.get("CCA_SIP_THREADS", "1"))
+# Codecs offered to the SBC, best first; everything else is disabled
+CODECS = [c.strip() for c in os.environ.get("CCA_CODECS", "PCMA/8000,PCMU/8000").split(",") if c.strip()]
+# Bridge clock in Hz, or "auto" for the highest audio rate among CODECS
+CLOCK_RATE = os.environ.get("CCA_CLOCK_RATE", "auto")
+PTIME_MS = int(os.environ.get("CCA_PTIME_MS", "20"))
+# Recorders this host can run (two per call); set it from --bench calls_per_core x cores x 2
+MAX_RECORDERS = int(os.environ.get("CCA_MAX_RECORDERS", "64"))
+
+# Benchmark legs are played from these recordings
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample audios-agent1")
+
+# Codecs whose audio rate differs from their RTP clock rate
+AUDIO_RATES = {"G722": 16000}
+
+
+def codec_audio_rate(codec):
+    name, _, rate = codec.partition("/")
+    return AUDIO_RATES.get(name.upper(), int(rate.split("/")[0] or 8000))
+
+
+# Matching the bridge to the codec means G.711 legs are never resampled
+def bridge_clock_rate(codecs=CODECS, setting=CLOCK_RATE):
+    if setting != "auto":
+        return int(setting)
+    return max((codec_audio_rate(codec) for codec in codecs), default=8000)
+
+
+def configure_endpoint(ep_cfg, max_calls):
+    rate = bridge_clock_rate()
+    ep_cfg.uaConfig.maxCalls = max_calls
+    ep_cfg.uaConfig.threadCnt = SIP_THREADS
+    med = ep_cfg.medConfig
+    med.threadCnt = MEDIA_THREADS
+    med.clockRate = rate
+    med.sndClockRate = rate
+    med.audioFramePtime = PTIME_MS
+    med.channelCount = 1
+    med.noVad = True
+    med.ecTailLen = 0  # nothing to cancel on a recorder
+    # Per call: one port per stream plus one recorder per leg
+    med.maxMediaPorts = 4 * max_calls + 8
+
+
+# Priority 0 disables a codec; the configured ones keep their order
+def configure_codecs(ep, codecs=CODECS):
+    wanted = [codec.upper() for codec in codecs]
+    for info in ep.codecEnum2():
+        codec_id = info.codecId
+        name = codec_id.upper()
+        rank = next((i for i, prefix in enumerate(wanted) if name.startswith(prefix)), None)
+        ep.codecSetPriority(codec_id, 0 if rank is None else 254 - rank)
+
+
+def configure_audio(ep):
+    if NULL_AUDIO:
+        ep.audDevManager().setNullDev()
+
+
+def settings():
+    return {
+        "recorder_mode": RECORDER_MODE,
+        "null_audio": NULL_AUDIO,
+        "media_threads": MEDIA_THREADS,
+        "sip_threads": SIP_THREADS,
+        "clock_rate": bridge_clock_rate(),
+        "ptime_ms": PTIME_MS,
+        "max_recorders": MAX_RECORDERS,
+        "codecs": CODECS,
+    }
+
+
+# Free a SWIG-wrapped pjsua2 object now rather than whenever its proxy is
+# collected; the delete wrapper disowns the proxy, so nothing is freed twice
+def destroy(obj):
+    delete = getattr(type(obj), "__swig_destroy__", None)
+    if delete is not None:
+        delete(obj)
+
+
+class RecorderLoad:
+    # Admission's media load signal in pjsua mode, where there are no LegTaps
+    # to time: recorders running as a share of MAX_RECORDERS
+    def __init__(self, capacity=MAX_RECORDERS):
+        self.capacity = capacity
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        with self.lock:
+            self.active += count
+
+    def sample(self):
+        return self.active / self.capacity if self.capacity > 0 else 0.0
+
+
+recorder_load = RecorderLoad()
+
+
+class LegRecorder:
+    # One leg recorded by pjmedia straight to WAV. Shaped like a LegTap
+    # (leg, media_index, close) so call bookkeeping treats both alike.
+    def __init__(self, call_id, leg, media_index, path=None):
+        self.call_id = call_id
+        self.leg = leg
+        self.media_index = media_index
+        self.path = path or leg_path(call_id, leg)
+        self.recorder = None
+        self.source = None
+
+    def start(self, media):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        recorder = pj.AudioMediaRecorder()
+        recorder.createRecorder(self.path)
+        media.startTransmit(recorder)
+        self.recorder, self.source = recorder, media
+        recorder_load.add(1)
+
+    def set_muted(self, muted):
+        if self.recorder is not None:
+            # Tx level is what the bridge sends to this port, i.e. what gets written
+            self.recorder.adjustTxLevel(0.0 if muted else 1.0)
+
+    # Disconnect and destroy the recorder; pjmedia writes the final WAV header
+    # on destroy, so the file is complete once this returns
+    def stop(self):
+        recorder, self.recorder = self.recorder, None
+        source, self.source = self.source, None
+        if recorder is None:
+            return
+        recorder_load.add(-1)
+        if source is not None:
+            try:
+                source.stopTransmit(recorder)
+            except Exception:
+                pass  # the stream port is already gone once the call has disconnected
+        destroy(recorder)
+
+    def close(self):
+        self.stop()
+
+
+def attach_recorders(call, call_id):
+    recorders = []
+    info = call.getInfo()
+    for leg, media in enumerate(info.media):
+        if media.type != pj.PJMEDIA_TYPE_AUDIO or media.status != pj.PJSUA_CALL_MEDIA_ACTIVE:
+            continue
+        recorder = LegRecorder(call_id, leg, media.index)
+        recorder.start(call.getAudioMedia(media.index))
+        recorders.append(recorder)
+    return recorders
+
+
+# Must run before the files are handed to VAD/compression
+def detach_recorders(recorders):
+    for recorder in recorders:
+        recorder.stop()
+
+
+class RecorderMute:
+    # MuteController's interface (digit, digit_now) for pjsua recorders: the
+    # level the bridge sends each recorder drops to zero for hold_ms after each digit, so
+    # the file keeps its timing with silence where the key presses were.
+    # There is no delay line here, so audio before the digit event stays.
+    def __init__(self, recorders, hold_ms=MUTE_HOLD_MS, on_change=None, register=None):
+        self.recorders = recorders
+        self.hold_ms = hold_ms
+        self.on_change = on_change
+        self.register = register
+        self.started = time.monotonic()
+        self.timer = None
+        self.muted = False
+        self.lock = threading.Lock()
+
+    def now_ms(self):
+        return int((time.monotonic() - self.started) * 1000)
+
+    def digit(self, at_ms=None):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.hold_ms / 1000, self._unmute)
+            self.timer.daemon = True
+            self.timer.start()
+            if self.muted:
+                return
+            self.muted = True
+        self._apply(True)
+        if self.on_change:
+            self.on_change("recording_paused", self.now_ms())
+
+    def digit_now(self):
+        self.digit()
+
+    def _unmute(self):
+        with self.lock:
+            if not self.muted:
+                return
+            self.muted = False
+            self.timer = None
+        if self.register:
+            self.register()
+        self._apply(False)
+        if self.on_change:
+            self.on_change("recording_resumed", self.now_ms())
+
+    def _apply(self, muted):
+        for recorder in self.recorders:
+            recorder.set_muted(muted)
+
+    def cancel(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+
+# Benchmark cases as (endpoint config, sink): the stock EpConfig or
+# configure_endpoint's, and Python LegTap WAV sinks or pjsua recorders;
+# "stock/taps" is the current default, "tuned/recorder" is CCA_RECORDER_MODE=pjsua
+BENCH_CASES = [(config, sink) for config in ("stock", "tuned") for sink in ("taps", "recorder")]
+
+
+# One benchmark process: `calls` simulated calls, each two looped players
+# (the legs) feeding one sink per leg, for `seconds`; reports process CPU
+def bench_worker(config, sink_kind, calls, seconds, source, scratch):
+    from mediaStream import LegTap
+    from recorder import WavSink
+
+    ep = pj.Endpoint()
+    ep.libCreate()
+    ep_cfg = pj.EpConfig()
+    if config == "tuned":
+        configure_endpoint(ep_cfg, calls)
+    else:
+        ep_cfg.uaConfig.maxCalls = calls
+        ep_cfg.medConfig.maxMediaPorts = 4 * calls + 8
+    ep.libInit(ep_cfg)
+    ep.libStart()
+    # No sound card on a recorder host; every case needs the null device to run at all
+    ep.audDevManager().setNullDev()
+
+    ports = []
+    for call in range(calls):
+        for leg in range(2):
+            player = pj.AudioMediaPlayer()
+            player.createPlayer(source, 0)
+            if sink_kind == "recorder":
+                sink = LegRecorder(f"bench-{call}", leg, 0, os.path.join(scratch, f"{config}-{call}-{leg}.wav"))
+                sink.start(player)
+            else:
+                sink = LegTap(f"bench-{call}", leg, [WavSink(f"bench-{call}", leg)])
+                sink.create()
+                player.startTransmit(sink)
+            ports.append((player, sink))
+
+    time.sleep(1.0)  # settle
+    wall, cpu = time.monotonic(), time.process_time()
+    time.sleep(seconds)
+    wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    for player, sink in ports:
+        sink.close()
+    ports.clear()
+    ep.libDestroy()
+    return {"config": config, "sink": sink_kind, "calls": calls, "cpu_percent": round(100 * cpu / wall, 1),
+            "calls_per_core": round(calls * wall / cpu, 1) if cpu else None}
+
+
+# Runs every BENCH_CASES pair in its own process, so the endpoint config and
+# the sink type can be credited separately
+def run_benchmark(calls=50, seconds=20, source=None):
+    import numpy as np
+
+    from vad import read_wav, write_wav_atomic
+
+    if source is None:
+        source = sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.wav")))[0]
+    report = {"settings": settings()}
+    with tempfile.TemporaryDirectory() as scratch:
+        # Legs arrive as 8 kHz G.711, so play them at 8 kHz
+        pcm, rate = read_wav(source)
+        if rate != 8000:
+            pcm = pcm[:len(pcm) - len(pcm) % (rate // 8000)].reshape(-1, rate // 8000).mean(axis=1).astype(np.int16)
+        leg_source = os.path.join(scratch, "leg.wav")
+        write_wav_atomic(leg_source, pcm, 8000)
+        for config, sink in BENCH_CASES:
+            env = dict(os.environ, CCA_RECORDINGS_DIR=os.path.join(scratch, f"{config}-{sink}"))
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--bench-worker", config, sink,
+                                     "--calls", str(calls), "--seconds", str(seconds), "--source", leg_source,
+                                     "--scratch", scratch], env=env, capture_output=True, text=True, check=True)
+            report[f"{config}/{sink}"] = json.loads(result.stdout.strip().splitlines()[-1])
+
+    def gain(better, baseline):
+        a, b = report[better]["calls_per_core"], report[baseline]["calls_per_core"]
+        return round(a / b, 2) if a and b else None
+
+    report["gain"] = {
+        "config_with_taps": gain("tuned/taps", "stock/taps"),
+        "config_with_recorder": gain("tuned/recorder", "stock/recorder"),
+        "recorder_on_stock": gain("stock/recorder", "stock/taps"),
+        "recorder_on_tuned": gain("tuned/recorder", "tuned/taps"),
+        "overall": gain("tuned/recorder", "stock/taps"),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless pjsua2 recording: settings and density benchmark")
+    parser.add_argument("--bench", action="store_true", help="recorded calls per core, stock vs tuned config, taps vs recorder")
+    parser.add_argument("--bench-worker", nargs=2, metavar=("CONFIG", "SINK"), help=argparse.SUPPRESS)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--source", help="WAV played into every leg")
+    parser.add_argument("--scratch", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bench_worker:
+        config, sink = args.bench_worker
+        print(json.dumps(bench_worker(config, sink, args.calls, args.seconds, args.source, args.scratch)))
+    elif args.bench:
+        print(json.dumps(run_benchmark(args.calls, args.seconds, args.source), indent=2))
+    else:
+        print(json.dumps(settings(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import logging
+import os
+import wave
+
+from chunkStore import default_store, wav_header
+
+log = logging.getLogger("cca.recorder")
+
+RECORDINGS_DIR = os.environ.get("CCA_RECORDINGS_DIR", "recordings")
+
+# "files" writes recordings/<call_id>/legN.wav, "chunks" streams into the
+# content-addressed chunk store
+RECORDING_STORE = os.environ.get("CCA_RECORDING_STORE", "files")
+
+
+def call_dir(call_id):
+    return os.path.join(RECORDINGS_DIR, call_id.replace("/", "_"))
+
+
+def leg_path(call_id, leg):
+    return os.path.join(call_dir(call_id), f"leg{leg}.wav")
+
+
+# Where a leg's recording ends up, as reported on the call record
+def recording_location(call_id, leg):
+    if RECORDING_STORE == "chunks":
+        return f"chunks://{call_id}/leg{leg}"
+    return leg_path(call_id, leg)
+
+
+class WavSink:
+    # LegTap sink that stores one leg as 16-bit mono WAV. The file is opened on
+    # the first frame so it gets the conference bridge's actual clock rate.
+    def __init__(self, call_id, leg):
+        self.call_id = call_id
+        self.leg = leg
+        self.path = leg_path(call_id, leg)
+        self.writer = None
+        self.samples = 0
+
+    def __call__(self, pcm, rate):
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.writer = wave.open(self.path, "wb")
+            self.writer.setnchannels(1)
+            self.writer.setsampwidth(2)
+            self.writer.setframerate(rate)
+        # writeframesraw skips the per-call header rewrite; close() fixes it up
+        self.writer.writeframesraw(pcm.astype("<i2", copy=False).tobytes())
+        self.samples += len(pcm)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            log.debug("Recorded %d samples to %s", self.samples, self.path, extra={"call_id": self.call_id})
+
+
+class StoreSink:
+    # LegTap sink that hashes and chunks the PCM as it arrives; only the WAV
+    # header, which needs the final length, is written when the leg closes
+    def __init__(self, call_id, leg, store=None):
+        self.call_id = call_id
+        self.leg = leg
+        self.store = store or default_store()
+        self.writer = None
+        self.rate = None
+
+    def __call__(self, pcm, rate):
+        if self.writer is None:
+            self.rate = rate
+            self.writer = self.store.writer(self.call_id, f"leg{self.leg}")
+        self.writer.write(pcm.astype("<i2", copy=False).tobytes())
+
+    def close(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.finish(wav_header(self.rate, writer.payload_size))
+            log.debug("Stored %d bytes in %d chunks (%d new)", writer.payload_size, len(writer.chunks),
+                      writer.new_chunks, extra={"call_id": self.call_id})
+
+
+def wav_sink(call_id, agent_dnis, leg):
+    if RECORDING_STORE == "chunks":
+        return StoreSink(call_id, leg)
+    return WavSink(call_id, leg)
@@ -0,0 +1,304 @@
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from g711 import PT_PCMU, alaw_decode, ulaw_decode
+from recorder import call_dir
+
+log = logging.getLogger("cca.rtp")
+
+# Container (.rtpc), append-only while the call is live:
+#   file header   magic "CCAR", version u8, pad x3
+#   packet record stream u8, pt u8, seq u16, rtp_ts u32, arrival_ms u32, length u16, payload
+#   trailer       JSON index (streams + seek points), then u64 index offset and magic "CCAX"
+# A container without a trailer (recorder crashed) is still readable by a
+# sequential scan; the trailer only saves that scan.
+MAGIC = b"CCAR"
+TRAILER_MAGIC = b"CCAX"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sB3x")
+RECORD = struct.Struct("<BBHIIH")
+TRAILER = struct.Struct("<Q4s")
+SEEK_EVERY = 250  # packets between seek points, ~5 s at 20 ms ptime
+
+# Static payload types (RFC 3551) as (encoding, RTP clock rate)
+STATIC_PAYLOADS = {0: ("PCMU", 8000), 8: ("PCMA", 8000), 9: ("G722", 8000), 10: ("L16", 44100), 11: ("L16", 44100),
+                   18: ("G729", 8000)}
+
+# Decoded at fetch time; other codecs stay archived until a decoder is added here
+DECODERS_BY_NAME = {"PCMU": ulaw_decode, "PCMA": alaw_decode}
+
+DECODED_SUFFIX = ".wav"
+
+# A timestamp step that disagrees with the arrival gap by more than this is a
+# discontinuity (SSRC restart, source switch, corrupt or hostile stream)
+MAX_TS_DRIFT_MS = 1000
+# Longest stream decode() will produce; later audio is dropped
+MAX_DECODE_SECONDS = int(os.environ.get("CCA_RTP_MAX_DECODE_SECONDS", str(6 * 3600)))
+
+
+# a=rtpmap lines from an SDP body: {pt: (encoding, clock_rate)}
+def parse_rtpmap(sdp):
+    payloads = {}
+    for line in sdp.splitlines():
+        if line.startswith("a=rtpmap:"):
+            try:
+                pt, desc = line[9:].split(" ", 1)
+                parts = desc.strip().split("/")
+                payloads[int(pt)] = (parts[0].upper(), int(parts[1]))
+            except (ValueError, IndexError):
+                continue
+    return payloads
+
+
+def payload_info(pt, rtpmap):
+    return rtpmap.get(pt) or STATIC_PAYLOADS.get(pt) or (f"PT{pt}", 8000)
+
+
+class RtpArchiveWriter:
+    # One container per call; each SSRC becomes a stream. append() is all the
+    # real-time path does: no decoding, no resampling.
+    def __init__(self, path, rtpmap=None):
+        self.path = path
+        self.rtpmap = rtpmap or {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "wb", buffering=64 * 1024)
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self.offset = FILE_HEADER.size
+        self.started = time.monotonic()
+        self.streams = {}
+        self.stream_info = []
+        self.lock = threading.Lock()
+
+    # data is a whole RTP packet; returns False if it isn't usable RTP
+    def append(self, data):
+        if len(data) < 12 or data[0] >> 6 != 2:
+            return False
+        offset = 12 + 4 * (data[0] & 0x0F)
+        if data[0] & 0x10:
+            offset += 4 + 4 * int.from_bytes(data[offset + 2:offset + 4], "big")
+        end = len(data) - (data[-1] if data[0] & 0x20 else 0)
+        if offset >= end:
+            return False
+        pt = data[1] & 0x7F
+        seq, ts = struct.unpack_from("!HI", data, 2)
+        ssrc = data[8:12]
+        arrival = int((time.monotonic() - self.started) * 1000)
+
+        with self.lock:
+            stream = self.streams.get(ssrc)
+            if stream is None:
+                stream = self.streams[ssrc] = len(self.stream_info)
+                encoding, rate = payload_info(pt, self.rtpmap)
+                self.stream_info.append({"ssrc": ssrc.hex(), "pt": pt, "encoding": encoding, "clock_rate": rate,
+                                         "first_ts": ts, "packets": 0, "seek": []})
+            info = self.stream_info[stream]
+            if info["packets"] % SEEK_EVERY == 0:
+                info["seek"].append([self.offset, info["packets"], ts])
+            info["packets"] += 1
+            record = RECORD.pack(stream, pt, seq, ts, arrival, end - offset)
+            self.file.write(record)
+            self.file.write(data[offset:end])
+            self.offset += len(record) + end - offset
+        return True
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            index = json.dumps({"streams": self.stream_info}).encode()
+            self.file.write(index)
+            self.file.write(TRAILER.pack(self.offset, TRAILER_MAGIC))
+            self.file.close()
+            self.file = None
+
+
+class RtpArchive:
+    # Read side. Packets are only read and decoded when a stream is fetched.
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not an RTP archive")
+            size = f.seek(0, os.SEEK_END)
+            self.data_end = size
+            self.streams = None
+            if size >= FILE_HEADER.size + TRAILER.size:
+                f.seek(size - TRAILER.size)
+                index_offset, trailer_magic = TRAILER.unpack(f.read(TRAILER.size))
+                if trailer_magic == TRAILER_MAGIC:
+                    f.seek(index_offset)
+                    self.streams = json.loads(f.read(size - TRAILER.size - index_offset))["streams"]
+                    self.data_end = index_offset
+        if self.streams is None:
+            self.streams = self._rebuild_index()
+
+    def _rebuild_index(self):
+        streams = {}
+        for stream, pt, _, ts, _, _ in self.packets():
+            info = streams.setdefault(stream, {"pt": pt, "first_ts": ts, "packets": 0})
+            info["packets"] += 1
+        result = []
+        for stream in sorted(streams):
+            encoding, rate = payload_info(streams[stream]["pt"], {})
+            result.append(dict(streams[stream], encoding=encoding, clock_rate=rate))
+        return result
+
+    # Yields (stream, pt, seq, rtp_ts, arrival_ms, payload)
+    def packets(self, stream=None):
+        with open(self.path, "rb") as f:
+            f.seek(FILE_HEADER.size)
+            position = FILE_HEADER.size
+            reader = f.read
+            while position + RECORD.size <= self.data_end:
+                head = reader(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                index, pt, seq, ts, arrival, length = RECORD.unpack(head)
+                payload = reader(length)
+                position += RECORD.size + length
+                if len(payload) < length:
+                    return  # torn final record
+                if stream is None or index == stream:
+                    yield index, pt, seq, ts, arrival, payload
+
+    # Decode one stream to int16 PCM, placing each payload by its RTP timestamp
+    # (gaps become silence, reordered and duplicate packets land where they belong).
+    # Across a discontinuity the timestamps are re-based on arrival time, and the
+    # output is capped at MAX_DECODE_SECONDS, so one bad timestamp can't size the buffer.
+    def decode(self, stream, max_seconds=MAX_DECODE_SECONDS):
+        info = self.streams[stream]
+        rate = info["clock_rate"]
+        decoder = DECODERS_BY_NAME.get(info["encoding"])
+        if decoder is None:
+            raise UnsupportedCodec(f"no decoder for {info['encoding']} (stream {stream})")
+        payloads, stamps, arrivals = [], [], []
+        for _, pt, _, ts, arrival, payload in self.packets(stream):
+            if pt == info["pt"]:  # skip telephone-event and comfort noise sharing the SSRC
+                payloads.append(payload)
+                stamps.append(ts)
+                arrivals.append(arrival)
+        if not payloads:
+            return np.zeros(0, dtype=np.int16), rate
+
+        lengths = np.fromiter((len(p) for p in payloads), dtype=np.int64, count=len(payloads))
+        # Step between consecutive packets (in arrival order), 32-bit wraparound aware
+        steps = (np.diff(np.array(stamps, dtype=np.int64)) + (1 << 31)) % (1 << 32) - (1 << 31)
+        elapsed = np.diff(np.array(arrivals, dtype=np.int64)) * rate // 1000
+        broken = np.abs(steps - elapsed) > MAX_TS_DRIFT_MS * rate // 1000
+        # Carry on where the previous packet ended, or later if it arrived later
+        steps[broken] = np.maximum(elapsed[broken], lengths[:-1][broken])
+        relative = np.concatenate(([0], np.cumsum(steps)))
+        relative -= relative.min()
+        samples = decoder(b"".join(payloads))
+        positions = np.repeat(relative, lengths) + (np.arange(len(samples)) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+        limit = max_seconds * rate
+        keep = positions < limit
+        if not keep.all():
+            log.warning("Stream %d of %s decodes past %d s; truncated", stream, self.path, max_seconds)
+            positions, samples = positions[keep], samples[keep]
+        pcm = np.zeros(int(positions.max()) + 1 if len(positions) else 0, dtype=np.int16)
+        pcm[positions] = samples
+        return pcm, rate
+
+
+class UnsupportedCodec(Exception):
+    pass
+
+
+def archive_path(call_id):
+    return os.path.join(call_dir(call_id), "rtp.rtpc")
+
+
+def decoded_path(path, stream):
+    return f"{path}.{stream}{DECODED_SUFFIX}"
+
+
+# Fetch-time decode with an on-disk cache next to the container; the cache
+# is reused until the container is rewritten
+def decoded_wav(path, stream):
+    target = decoded_path(path, stream)
+    try:
+        if os.path.getmtime(target) >= os.path.getmtime(path):
+            return target
+    except FileNotFoundError:
+        pass
+    from vad import write_wav_atomic
+
+    pcm, rate = RtpArchive(path).decode(stream)
+    write_wav_atomic(target, pcm, rate)
+    return target
+
+
+# Per-call CPU through ccaConnector.ingest_rtp (quality and DTMF tracking
+# included) with CCA_RTP_MODE=decode (the current mode) vs raw
+def run_benchmark(calls=20, seconds=60):
+    import tempfile
+
+    import ccaConnector
+    from sharedAudio import rings
+
+    payload = bytes(range(256)) * 2
+    # Built up front so only the ingest work is timed
+    packets = [struct.pack("!BBHI", 0x80, PT_PCMU, n & 0xFFFF, n * 160) + ssrc + payload[:160]
+               for n in range(seconds * 50) for ssrc in (b"\x95\x02\x32\x37", b"\x95\x02\x32\x38")]
+    report = {}
+    rtp_mode = ccaConnector.RTP_MODE
+    with tempfile.TemporaryDirectory() as scratch:
+        try:
+            for mode in ("decode", "raw"):
+                ccaConnector.RTP_MODE = mode
+                cpu = time.process_time()
+                for call in range(calls):
+                    call_id = f"bench-{mode}-{call}"
+                    source = ("192.0.2.1", 20000 + 2 * call)
+                    ccaConnector.route_media(call_id, [source])
+                    if mode == "raw":
+                        # Archive into the scratch directory rather than the recordings tree
+                        ccaConnector.call_archives[call_id] = RtpArchiveWriter(os.path.join(scratch, f"{call_id}.rtpc"))
+                    for packet in packets:
+                        ccaConnector.ingest_rtp(packet, source)
+                    ccaConnector.release_call(call_id)
+                cpu = time.process_time() - cpu
+                report[mode] = {"cpu_ms_per_call_minute": round(cpu * 1000 / calls * 60 / seconds, 2)}
+        finally:
+            ccaConnector.RTP_MODE = rtp_mode
+
+        started = time.process_time()
+        decoded_wav(os.path.join(scratch, "bench-raw-0.rtpc"), 0)
+        report["raw"]["decode_on_fetch_ms_per_leg_minute"] = round((time.process_time() - started) * 1000 * 60 / seconds, 2)
+        rings.release_all()
+    report["savings"] = f"{1 - report['raw']['cpu_ms_per_call_minute'] / report['decode']['cpu_ms_per_call_minute']:.0%}"
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and decode raw RTP call archives")
+    parser.add_argument("archive", nargs="?")
+    parser.add_argument("--stream", type=int, help="decode this stream to WAV (cached next to the archive)")
+    parser.add_argument("--bench", action="store_true", help="compare live decode vs raw capture CPU per call")
+    parser.add_argument("--calls", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(run_benchmark(args.calls), indent=2))
+        return
+    if not args.archive:
+        parser.error("an archive path is required")
+    archive = RtpArchive(args.archive)
+    if args.stream is None:
+        for number, info in enumerate(archive.streams):
+            print(f"stream {number}: {info['encoding']}/{info['clock_rate']} pt={info['pt']} packets={info['packets']}")
+    else:
+        print(decoded_wav(args.archive, args.stream))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+
+# How often call quality is sampled and pushed to agent sockets
+QUALITY_INTERVAL = float(os.environ.get("CCA_QUALITY_INTERVAL", "5"))
+
+RTP_SEQ_MOD = 1 << 16
+MAX_DROPOUT = 3000
+MAX_MISORDER = 100
+MIN_SEQUENTIAL = 2
+DUP_WINDOW = 64
+
+# E-model (ITU-T G.107/G.113) equipment impairment and packet-loss robustness per codec
+CODEC_IMPAIRMENT = {
+    "PCMU": (0.0, 25.1), "PCMA": (0.0, 25.1), "G722": (0.0, 25.1),
+    "G729": (11.0, 19.0), "OPUS": (0.0, 20.0), "ILBC": (10.0, 32.0),
+}
+DEFAULT_IMPAIRMENT = (0.0, 25.1)
+
+
+# Mouth-to-ear MOS estimate from loss, jitter and (if known) round-trip time
+def estimate_mos(loss_pct, jitter_ms, rtt_ms=None, codec=None):
+    ie, bpl = CODEC_IMPAIRMENT.get((codec or "").upper().split("/")[0], DEFAULT_IMPAIRMENT)
+    # One-way delay: half the RTT, or a typical 20 ms path, plus a jitter buffer of 2x jitter
+    delay = (rtt_ms / 2 if rtt_ms else 20.0) + 2 * jitter_ms + 10.0
+    idd = 0.024 * delay + (0.11 * (delay - 177.3) if delay > 177.3 else 0.0)
+    ie_eff = ie + (95 - ie) * loss_pct / (loss_pct + bpl)
+    r = max(0.0, min(100.0, 93.2 - idd - ie_eff))
+    return round(1 + 0.035 * r + 7e-6 * r * (r - 60) * (100 - r), 2)
+
+
+class StreamQuality:
+    # RFC 3550 receiver statistics for one SSRC (A.1 sequence validation,
+    # A.3 expected/lost, A.8 interarrival jitter), plus duplicate and reorder
+    # counts from a 64-packet bitmap. update() is O(1) and allocation-free.
+    __slots__ = ("clock_rate", "codec", "max_seq", "cycles", "base_seq", "bad_seq", "probation", "received",
+                 "duplicates", "reordered", "transit", "jitter", "window", "valid")
+
+    def __init__(self, clock_rate=8000, codec=None):
+        self.clock_rate = clock_rate
+        self.codec = codec
+        self.max_seq = self.cycles = self.base_seq = 0
+        self.bad_seq = RTP_SEQ_MOD + 1
+        self.probation = MIN_SEQUENTIAL
+        self.received = self.duplicates = self.reordered = 0
+        self.transit = None
+        self.jitter = 0.0
+        self.window = 0  # bit i set = max_seq - i seen
+        self.valid = False
+
+    def _init_seq(self, seq):
+        self.base_seq = seq
+        self.max_seq = seq
+        self.bad_seq = RTP_SEQ_MOD + 1
+        self.cycles = 0
+        self.received = 0
+        self.window = 1
+
+    # arrival is in seconds on any monotonic clock
+    def update(self, seq, timestamp, arrival):
+        if not self.valid:
+            # Source is on probation until MIN_SEQUENTIAL packets arrive in order
+            if self.probation < MIN_SEQUENTIAL and seq == (self.max_seq + 1) % RTP_SEQ_MOD:
+                self.probation -= 1
+                self.max_seq = seq
+                if self.probation == 0:
+                    self._init_seq(seq)
+                    self.received = 1
+                    self.valid = True
+            else:
+                self.probation = MIN_SEQUENTIAL - 1
+                self.max_seq = seq
+            self._jitter(timestamp, arrival)
+            return
+
+        delta = (seq - self.max_seq) % RTP_SEQ_MOD
+        if delta == 0:
+            self.duplicates += 1
+            return
+        if delta < MAX_DROPOUT:
+            if seq < self.max_seq:
+                self.cycles += RTP_SEQ_MOD
+            self.window = ((self.window << delta) | 1) & ((1 << DUP_WINDOW) - 1)
+            self.max_seq = seq
+        elif delta <= RTP_SEQ_MOD - MAX_MISORDER:
+            # Large jump: resync only if the next packet confirms it
+            if seq == self.bad_seq:
+                self._init_seq(seq)
+            else:
+                self.bad_seq = (seq + 1) % RTP_SEQ_MOD
+                return
+        else:
+            behind = RTP_SEQ_MOD - delta
+            if behind < DUP_WINDOW:
+                bit = 1 << behind
+                if self.window & bit:
+                    self.duplicates += 1
+                    return
+                self.window |= bit
+            self.reordered += 1
+        self.received += 1
+        self._jitter(timestamp, arrival)
+
+    def _jitter(self, timestamp, arrival):
+        transit = arrival * self.clock_rate - timestamp
+        if self.transit is not None:
+            d = abs(transit - self.transit)
+            if d < self.clock_rate * 10:  # ignore timestamp jumps (new talk spurt base, resync)
+                self.jitter += (d - self.jitter) / 16.0
+        self.transit = transit
+
+    def snapshot(self):
+        extended_max = self.cycles + self.max_seq
+        expected = extended_max - self.base_seq + 1 if self.valid else 0
+        lost = max(0, expected - self.received)
+        loss_pct = 100.0 * lost / expected if expected else 0.0
+        jitter_ms = 1000.0 * self.jitter / self.clock_rate
+        return quality_record(self.received, lost, loss_pct, jitter_ms, self.reordered, self.duplicates,
+                              codec=self.codec)
+
+
+def quality_record(received, lost, loss_pct, jitter_ms, reordered, duplicates, rtt_ms=None, codec=None):
+    record = {
+        "packets": received,
+        "lost": lost,
+        "loss_pct": round(loss_pct, 2),
+        "jitter_ms": round(jitter_ms, 2),
+        "reordered": reordered,
+        "duplicates": duplicates,
+        "mos": estimate_mos(loss_pct, jitter_ms, rtt_ms, codec),
+    }
+    if rtt_ms is not None:
+        record["rtt_ms"] = round(rtt_ms, 2)
+    return record
+
+
+# The same record from pjmedia's own RTCP receiver statistics (pj.StreamStat),
+# which pjmedia already maintains per packet on the media thread
+def from_stream_stat(stat, codec=None):
+    rx = stat.rtcp.rxStat
+    expected = rx.pkt + rx.loss
+    loss_pct = 100.0 * rx.loss / expected if expected else 0.0
+    jitter_ms = rx.jitterUsec.last / 1000.0 if rx.jitterUsec.n else 0.0
+    rtt = stat.rtcp.rttUsec
+    rtt_ms = rtt.last / 1000.0 if rtt.n else None
+    return quality_record(rx.pkt, rx.loss, loss_pct, jitter_ms, rx.reorder, rx.dup, rtt_ms, codec)
@@ -0,0 +1,270 @@
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+log = logging.getLogger("cca.shm")
+
+RING_SECONDS = float(os.environ.get("CCA_RING_SECONDS", "30"))
+MAX_LEGS = 8
+
+# Segment layout: HEADER_WORDS little-endian uint64 words, then int16 samples.
+#   0 magic   1 sample_rate   2 capacity (samples)   3 write_pos (samples ever written)
+#   4 state   5 created (ns since epoch)
+# write_pos only moves forward and is stored after the samples it covers,
+# so a reader that sees it can trust everything before it.
+HEADER_WORDS = 8
+HEADER_BYTES = HEADER_WORDS * 8
+MAGIC = 0x3152414143  # "CCAR1"
+MAGIC_WORD, RATE_WORD, CAPACITY_WORD, WRITE_WORD, STATE_WORD, CREATED_WORD = range(6)
+STATE_LIVE = 1
+STATE_ENDED = 2
+
+
+class RingOverrun(Exception):
+    pass
+
+
+# Shared-memory names are global per host and short on macOS; hash the call_id
+def ring_name(call_id, leg):
+    digest = hashlib.blake2b(call_id.encode(), digest_size=8).hexdigest()
+    return f"cca_{digest}_{leg}"
+
+
+class AudioRingWriter:
+    # Single producer ring for one call leg, written on the recorder's media path
+    def __init__(self, call_id, leg, sample_rate, seconds=RING_SECONDS):
+        self.call_id = call_id
+        self.leg = leg
+        self.name = ring_name(call_id, leg)
+        capacity = int(sample_rate * seconds)
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=HEADER_BYTES + capacity * 2)
+        self.meta = np.ndarray((HEADER_WORDS,), dtype="<u8", buffer=self.shm.buf)
+        self.data = np.ndarray((capacity,), dtype="<i2", buffer=self.shm.buf, offset=HEADER_BYTES)
+        self.capacity = capacity
+        self.write_pos = 0
+        self.meta[:] = 0
+        self.meta[RATE_WORD] = sample_rate
+        self.meta[CAPACITY_WORD] = capacity
+        self.meta[CREATED_WORD] = time.time_ns()
+        self.meta[STATE_WORD] = STATE_LIVE
+        self.meta[MAGIC_WORD] = MAGIC
+
+    def write(self, pcm):
+        count = len(pcm)
+        if count > self.capacity:
+            pcm = pcm[-self.capacity:]
+            self.write_pos += count - self.capacity
+            count = self.capacity
+        start = self.write_pos % self.capacity
+        first = min(count, self.capacity - start)
+        self.data[start:start + first] = pcm[:first]
+        if first < count:
+            self.data[:count - first] = pcm[first:]
+        self.write_pos += count
+        self.meta[WRITE_WORD] = self.write_pos
+
+    # The tap is gone; readers drain what's left and see ended=True
+    def close(self):
+        if self.shm is not None:
+            self.meta[STATE_WORD] = STATE_ENDED
+
+    def unlink(self):
+        if self.shm is None:
+            return
+        self.meta[STATE_WORD] = STATE_ENDED
+        del self.meta, self.data
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = None
+
+
+class AudioRingReader:
+    # Independent cursor over a ring owned by another process. read() hands out
+    # NumPy views straight into shared memory: nothing is copied, so check
+    # still_valid() after processing if the data must not have been overwritten.
+    def __init__(self, call_id, leg, start="live"):
+        self.call_id = call_id
+        self.leg = leg
+        self.shm = _attach(ring_name(call_id, leg))
+        self.meta = np.ndarray((HEADER_WORDS,), dtype="<u8", buffer=self.shm.buf)
+        if int(self.meta[MAGIC_WORD]) != MAGIC:
+            self.shm.close()
+            raise ValueError(f"{self.shm.name} is not an audio ring")
+        self.capacity = int(self.meta[CAPACITY_WORD])
+        self.sample_rate = int(self.meta[RATE_WORD])
+        self.data = np.ndarray((self.capacity,), dtype="<i2", buffer=self.shm.buf, offset=HEADER_BYTES)
+        head = int(self.meta[WRITE_WORD])
+        # "live" starts at the write head, "oldest" at the oldest sample still held
+        self.cursor = head if start == "live" else max(0, head - self.capacity)
+        self.overruns = 0
+        self.lost_samples = 0
+        self.last_read = (self.cursor, self.cursor)
+
+    @property
+    def ended(self):
+        return int(self.meta[STATE_WORD]) == STATE_ENDED
+
+    def available(self):
+        return int(self.meta[WRITE_WORD]) - self.cursor
+
+    # Returns a list of zero, one or two views (two when the region wraps)
+    def read(self, max_samples=None, strict=False):
+        head = int(self.meta[WRITE_WORD])
+        pending = head - self.cursor
+        if pending > self.capacity:
+            lost = pending - self.capacity
+            self.overruns += 1
+            self.lost_samples += lost
+            if strict:
+                raise RingOverrun(f"reader fell {lost} samples behind on {self.shm.name}")
+            self.cursor = head - self.capacity
+            pending = self.capacity
+        if max_samples is not None:
+            pending = min(pending, max_samples)
+        if pending <= 0:
+            return []
+
+        start = self.cursor % self.capacity
+        first = min(pending, self.capacity - start)
+        views = [self.data[start:start + first]]
+        if first < pending:
+            views.append(self.data[:pending - first])
+        self.last_read = (self.cursor, self.cursor + pending)
+        self.cursor += pending
+        return views
+
+    # True if the writer hasn't lapped the region returned by the last read()
+    def still_valid(self):
+        return int(self.meta[WRITE_WORD]) - self.last_read[0] <= self.capacity
+
+    def close(self):
+        if self.shm is not None:
+            del self.meta, self.data
+            self.shm.close()
+            self.shm = None
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before 3.13 attaching registers the segment with this process's
+        # resource tracker, which would unlink it when the reader exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+# Attach to every leg the recorder has published for a call
+def attach_call(call_id, start="live"):
+    readers = []
+    for leg in range(MAX_LEGS):
+        try:
+            readers.append(AudioRingReader(call_id, leg, start))
+        except FileNotFoundError:
+            break
+    return readers
+
+
+class RingRegistry:
+    # Writer-side bookkeeping: which rings this process owns, per call
+    def __init__(self):
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def writer(self, call_id, leg, sample_rate):
+        with self.lock:
+            legs = self.rings.setdefault(call_id, {})
+            ring = legs.get(leg)
+            if ring is None:
+                try:
+                    ring = legs[leg] = AudioRingWriter(call_id, leg, sample_rate)
+                except FileExistsError:
+                    # Left behind by a crashed recorder; take it over
+                    stale = shared_memory.SharedMemory(name=ring_name(call_id, leg))
+                    stale.close()
+                    stale.unlink()
+                    ring = legs[leg] = AudioRingWriter(call_id, leg, sample_rate)
+            return ring
+
+    # Sink factory for mediaStream.attach_taps
+    def sink(self, call_id, agent_dnis, leg):
+        return RingSink(self, call_id, leg)
+
+    def release(self, call_id):
+        with self.lock:
+            legs = self.rings.pop(call_id, {})
+        for ring in legs.values():
+            ring.unlink()
+        if legs:
+            log.debug("Released %d audio rings", len(legs), extra={"call_id": call_id})
+
+    def release_all(self):
+        for call_id in list(self.rings):
+            self.release(call_id)
+
+
+class RingSink:
+    # LegTap sink; the ring is created on the first frame, at the bridge's rate
+    def __init__(self, registry, call_id, leg):
+        self.registry = registry
+        self.call_id = call_id
+        self.leg = leg
+        self.ring = None
+
+    def __call__(self, pcm, rate):
+        if self.ring is None:
+            self.ring = self.registry.writer(self.call_id, self.leg, rate)
+        self.ring.write(pcm)
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+
+
+rings = RingRegistry()
+
+
+# Small consumer for poking at a live call: prints per-leg levels once a second
+def main():
+    parser = argparse.ArgumentParser(description="Tail a call's shared-memory audio rings")
+    parser.add_argument("call_id")
+    parser.add_argument("--from-start", action="store_true", help="start at the oldest buffered audio")
+    args = parser.parse_args()
+
+    readers = attach_call(args.call_id, "oldest" if args.from_start else "live")
+    if not readers:
+        print(f"No audio rings for call {args.call_id}")
+        return
+    try:
+        while readers:
+            time.sleep(1.0)
+            line = []
+            for reader in list(readers):
+                views = reader.read()
+                samples = sum(len(v) for v in views)
+                energy = sum(float(np.dot(v.astype(np.float64), v)) for v in views)
+                rms = (energy / samples) ** 0.5 if samples else 0.0
+                line.append(f"leg{reader.leg}: {samples} samples rms={rms:.0f} overruns={reader.overruns}")
+                if reader.ended and not reader.available():
+                    reader.close()
+                    readers.remove(reader)
+            print("  ".join(line))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import json
+import os
+
+# SIPREC INVITEs captured from the SBC, one list per agent folder
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SIPjson.json")
+
+
+# Rewrite Content-Length so the header matches the body that is actually there
+def fix_content_length(message):
+    head, sep, body = message.partition("\r\n\r\n")
+    if not sep:
+        return message
+    lines = head.split("\r\n")
+    for i, line in enumerate(lines):
+        if line.lower().startswith("content-length:"):
+            lines[i] = f"Content-Length: {len(body.encode())}"
+    return "\r\n".join(lines) + sep + body
+
+
+# Load the INVITEs from SIPjson.json as wire-ready bytes keyed by agent folder
+def load_invites(path=FIXTURE_PATH, ip="127.0.0.1", port=5059, fix_length=True):
+    with open(path) as f:
+        raw = json.load(f)
+
+    invites = {}
+    for agent, messages in raw.items():
+        invites[agent] = []
+        for message in messages:
+            # The JSON stores the CRLFs escaped, and the request URI is templated
+            message = message.replace("\\r\\n", "\r\n")
+            message = message.replace("{ip}", ip).replace("{port}", str(port))
+            if fix_length:
+                message = fix_content_length(message)
+            invites[agent].append(message.encode())
+    return invites
+
+
+# Flatten load_invites() into a single list, agent order preserved
+def all_invites(path=FIXTURE_PATH, ip="127.0.0.1", port=5059, fix_length=True):
+    invites = load_invites(path, ip, port, fix_length)
+    return [message for messages in invites.values() for message in messages]
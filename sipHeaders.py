@@ -0,0 +1,104 @@
+import json
+import os
+import re
+
+# INVITE header -> CallData field. CCA_SIP_HEADER_FIELDS adds to or overrides
+# this, as JSON ({"X-Queue": "queue"}) or "X-Queue=queue,X-Skill=skill".
+# Fields CallData doesn't declare end up in CallData.sip_headers.
+DEFAULT_HEADER_FIELDS = {
+    "X-Sequence-ID": "seq_id",
+    "X-Agent-DNIS": "agent_dnis",
+    "X-Acme-Call-ID": "acme_call_id",
+}
+
+# Defaults for fields the rest of the service expects to be present
+FIELD_DEFAULTS = {"seq_id": "unknown", "agent_dnis": "unknown"}
+
+# Fields CallData declares; everything else extracted goes into sip_headers
+CALL_DATA_FIELDS = ("seq_id", "agent_dnis", "acme_call_id")
+
+# CallData fields with an O(1) lookup index
+INDEXED_FIELDS = ("ucid", "acme_call_id")
+
+# <apkt:ucid> (or any prefix) in the rs-metadata+xml body part
+UCID_PATTERN = re.compile(rb"<(?:[\w.-]+:)?ucid>\s*([^<\s]+)\s*</", re.IGNORECASE)
+
+
+def load_header_fields(value=None):
+    fields = dict(DEFAULT_HEADER_FIELDS)
+    value = os.environ.get("CCA_SIP_HEADER_FIELDS", "") if value is None else value
+    if value.strip().startswith("{"):
+        fields.update(json.loads(value))
+    else:
+        for item in filter(None, (part.strip() for part in value.split(","))):
+            header, _, field = item.partition("=")
+            fields[header.strip()] = field.strip() or header.strip().lower().replace("-", "_")
+    return fields
+
+
+class HeaderTable:
+    # Precompiled lowercase-name lookup: one pass over the header lines, one
+    # dict probe per line, and the pass stops once every field has been seen
+    def __init__(self, fields):
+        self.fields = {name.lower(): field for name, field in fields.items()}
+        self.wanted = len(set(self.fields.values()))
+
+    def extract(self, headers):
+        found = {}
+        fields = self.fields
+        for header in headers:
+            name, sep, value = header.partition(":")
+            field = fields.get(name.strip().lower()) if sep else None
+            if field is not None and field not in found:
+                found[field] = value.strip()
+                if len(found) == self.wanted:
+                    break
+        for field, default in FIELD_DEFAULTS.items():
+            found.setdefault(field, default)
+        return found
+
+
+    # Fields and UCID from a whole SIP message (pjsua2's rdata.wholeMsg): the
+    # header block is walked once, and only the body after it is searched for the UCID
+    def extract_message(self, message):
+        if isinstance(message, bytes):
+            message = message.decode(errors="replace")
+        head, _, body = message.partition("\r\n\r\n")
+        found = self.extract(head.split("\r\n")[1:])
+        return found, extract_ucid(body)
+
+
+header_table = HeaderTable(load_header_fields())
+
+
+def extract_ucid(body):
+    if not body:
+        return None
+    if isinstance(body, str):
+        body = body.encode(errors="replace")
+    match = UCID_PATTERN.search(body)
+    return match.group(1).decode(errors="replace") if match else None
+
+
+class CallIndex:
+    # Secondary keys -> call ids. A UCID can map to several recordings (the
+    # SBC forks a new SIPREC session per transfer leg), so every key holds a set.
+    def __init__(self, fields=INDEXED_FIELDS):
+        self.indexes = {field: {} for field in fields}
+
+    def add(self, call_id, values):
+        for field, index in self.indexes.items():
+            value = values.get(field)
+            if value:
+                index.setdefault(value, set()).add(call_id)
+
+    def remove(self, call_id, values):
+        for field, index in self.indexes.items():
+            ids = index.get(values.get(field))
+            if ids is not None:
+                ids.discard(call_id)
+                if not ids:
+                    del index[values.get(field)]
+
+    def lookup(self, field, value):
+        return self.indexes[field].get(value, set())
@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from sipTransactions import transaction_key
+
+log = logging.getLogger("cca.sip")
+
+# Largest SIP message accepted on a stream; anything bigger drops the connection
+MAX_MESSAGE = int(os.environ.get("CCA_SIP_MAX_MESSAGE", str(256 * 1024)))
+# Persistent connections are closed after this long without a message (0 = never)
+IDLE_TIMEOUT = float(os.environ.get("CCA_SIP_TCP_IDLE", "900"))
+READ_SIZE = 64 * 1024
+
+# Full and compact (RFC 3261 7.3.3) names of Content-Length
+_CONTENT_LENGTH = (b"content-length", b"l")
+
+
+class FramingError(Exception):
+    pass
+
+
+class SipFramer:
+    # Splits a byte stream into SIP messages by Content-Length (RFC 3261 18.3).
+    # Data is appended to one bytearray that is consumed from a read offset and
+    # compacted only once the consumed prefix is large, so pipelined messages
+    # and partial reads cost no per-message buffer copies beyond the message itself.
+    def __init__(self, max_message=MAX_MESSAGE):
+        self.buffer = bytearray()
+        self.start = 0
+        self.scanned = 0  # where the search for the end of the headers resumes
+        self.max_message = max_message
+
+    def feed(self, data):
+        if self.start and self.start >= len(self.buffer) // 2:
+            del self.buffer[:self.start]
+            self.scanned -= self.start
+            self.start = 0
+        self.buffer += data
+
+    # Complete messages buffered so far; keepalive CRLFs come back as b"\r\n\r\n"
+    def messages(self):
+        buffer = self.buffer
+        while self.start < len(buffer):
+            # RFC 5626 keepalive ping between messages
+            if buffer.startswith(b"\r\n", self.start):
+                if buffer.startswith(b"\r\n\r\n", self.start):
+                    self.start += 4
+                    self.scanned = self.start
+                    yield b"\r\n\r\n"
+                    continue
+                if len(buffer) - self.start < 4:
+                    return
+                self.start += 2
+                continue
+            end = buffer.find(b"\r\n\r\n", max(self.start, self.scanned - 3))
+            if end < 0:
+                self.scanned = len(buffer)
+                if len(buffer) - self.start > self.max_message:
+                    raise FramingError("header block too large")
+                return
+            body_start = end + 4
+            length = content_length(buffer, self.start, end)
+            if body_start + length - self.start > self.max_message:
+                raise FramingError(f"message of {body_start + length - self.start} bytes")
+            if len(buffer) < body_start + length:
+                self.scanned = end  # headers are complete; wait for the body only
+                return
+            message = bytes(buffer[self.start:body_start + length])
+            self.start = self.scanned = body_start + length
+            yield message
+
+    def pending(self):
+        return len(self.buffer) - self.start
+
+
+def content_length(buffer, start, end):
+    position = buffer.find(b"\r\n", start, end)
+    while 0 <= position < end:
+        line_end = buffer.find(b"\r\n", position + 2, end)
+        if line_end < 0:
+            line_end = end
+        name, _, value = bytes(buffer[position + 2:line_end]).partition(b":")
+        if name.strip().lower() in _CONTENT_LENGTH:
+            try:
+                length = int(value.strip())
+            except ValueError:
+                length = -1
+            if length < 0:
+                raise FramingError(f"bad Content-Length {value.strip()!r}")
+            return length
+        position = line_end if line_end < end else -1
+    raise FramingError("no Content-Length on a stream transport")
+
+
+class StreamTransport:
+    # Gives the stream the sendto() shape the datagram handlers already use
+    def __init__(self, writer):
+        self.writer = writer
+
+    def sendto(self, data, addr=None):
+        self.writer.write(data)
+        return len(data)
+
+
+class SipTcpServer:
+    # Persistent SIP connections; every framed request is passed to
+    # handle(transport, message, addr), the same handler the UDP loop uses
+    def __init__(self, handle):
+        self.handle = handle
+        self.connections = set()
+        self.messages = 0
+        self.server = None
+
+    async def start(self, ip, port):
+        self.server = await asyncio.start_server(self.serve, ip, port, reuse_address=True)
+        log.info("TCP server started at %s:%s", ip, port)
+        return self.server
+
+    async def serve(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        transport = StreamTransport(writer)
+        framer = SipFramer()
+        self.connections.add(writer)
+        try:
+            while True:
+                if IDLE_TIMEOUT:
+                    data = await asyncio.wait_for(reader.read(READ_SIZE), IDLE_TIMEOUT)
+                else:
+                    data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                framer.feed(data)
+                for message in framer.messages():
+                    if message == b"\r\n\r\n":
+                        writer.write(b"\r\n")  # keepalive pong
+                        continue
+                    self.messages += 1
+                    self.handle(transport, message, addr)
+                # One drain per read, however many pipelined messages it held
+                await writer.drain()
+        except FramingError as e:
+            log.warning("Closing SIP connection from %s: %s", addr, e)
+        except asyncio.TimeoutError:
+            log.info("Closing idle SIP connection from %s", addr)
+        except ConnectionError:
+            pass
+        except Exception:
+            # A message the handler chokes on costs its own connection only
+            log.exception("Closing SIP connection from %s after a handler error", addr)
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.connections):
+            writer.close()
+
+
+def serve_forever(ip, port, handle):
+    async def run():
+        server = SipTcpServer(handle)
+        await server.start(ip, port)
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+    asyncio.run(run())
+
+
+# A fixture INVITE made unique per message so every one is a new transaction
+def _bench_messages(count, tag):
+    from sipFixtures import all_invites
+    invites = all_invites()
+    return [invites[n % len(invites)]
+            .replace(b"branch=z9hG4bK", f"branch=z9hG4bK{tag}x{n}x".encode(), 1)
+            .replace(b"Call-ID: ", f"Call-ID: {tag}x{n}x".encode(), 1)
+            for n in range(count)]
+
+
+# A complete 200 OK whose Call-ID is one the client sent
+def _answers(reply, call_ids):
+    if not reply.startswith(b"SIP/2.0 200 "):
+        return False
+    return transaction_key(reply)[1] in call_ids
+
+
+# Messages/sec through the real INVITE handler for several connection counts,
+# each connection pipelining its messages; plus framing alone over random splits
+def run_benchmark(connections=(1, 10, 100), messages=2000):
+    import ccaConnector
+
+    report = {}
+
+    async def bench(count):
+        server = SipTcpServer(ccaConnector.handle_sip_request)
+        await server.start("127.0.0.1", 0)
+        port = server.server.sockets[0].getsockname()[1]
+        per_connection = max(1, messages // count)
+
+        async def client(number):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            requests = _bench_messages(per_connection, f"c{count}n{number}")
+            expected = {transaction_key(request)[1] for request in requests}
+            writer.write(b"".join(requests))
+            # Replies are framed like the server frames requests, so a bad
+            # Content-Length shows up here as a FramingError or a missing reply
+            framer = SipFramer()
+            valid = 0
+            try:
+                while valid < per_connection:
+                    data = await reader.read(READ_SIZE)
+                    if not data:
+                        break
+                    framer.feed(data)
+                    valid += sum(1 for reply in framer.messages() if _answers(reply, expected))
+            finally:
+                writer.close()
+            return valid
+
+        started = time.perf_counter()
+        answered = sum(await asyncio.gather(*(client(n) for n in range(count))))
+        if answered < per_connection * count:
+            raise RuntimeError(f"{answered} valid 200 OKs for {per_connection * count} INVITEs")
+        elapsed = time.perf_counter() - started
+        while server.connections:
+            await asyncio.sleep(0.01)  # let the handlers see the clients hang up
+        await server.close()
+        return {"messages": answered, "msgs_per_sec": round(answered / elapsed),
+                "ms_per_message": round(elapsed * 1000 / answered, 3)}
+
+    for count in connections:
+        report[f"connections_{count}"] = asyncio.run(bench(count))
+        ccaConnector.call_rtpmaps.clear()
+
+    stream = b"".join(_bench_messages(messages, "framing"))
+    rng = random.Random(0)
+    pieces, position = [], 0
+    while position < len(stream):
+        size = rng.randint(1, 3000)
+        pieces.append(stream[position:position + size])
+        position += size
+    framer = SipFramer()
+    started = time.perf_counter()
+    framed = 0
+    for piece in pieces:
+        framer.feed(piece)
+        framed += sum(1 for _ in framer.messages())
+    elapsed = time.perf_counter() - started
+    report["framing_random_splits"] = {"messages": framed, "reads": len(pieces),
+                                       "msgs_per_sec": round(framed / elapsed)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SIP over TCP framing and throughput")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+    if not args.bench:
+        parser.error("nothing to do; pass --bench")
+    print(json.dumps(run_benchmark(args.connections, args.messages), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import heapq
+import logging
+import os
+import time
+
+log = logging.getLogger("cca.sip")
+
+# RFC 3261 timers (seconds); T1 is the RTT estimate, 64*T1 the transaction lifetime over UDP
+T1 = float(os.environ.get("CCA_SIP_T1", "0.5"))
+T4 = 5.0
+
+SIP_METHODS = (b"INVITE", b"ACK", b"BYE", b"CANCEL", b"OPTIONS", b"REGISTER", b"PRACK", b"UPDATE", b"INFO",
+               b"SUBSCRIBE", b"NOTIFY", b"REFER", b"MESSAGE")
+
+# Full and compact (RFC 3261 7.3.3) names of the headers a key needs
+_VIA = (b"via", b"v")
+_CALL_ID = (b"call-id", b"i")
+_CSEQ = (b"cseq",)
+
+
+def is_sip(data):
+    return data.startswith(SIP_METHODS) or data.startswith(b"SIP/2.0")
+
+
+# (branch, call_id, cseq_number, method) from the header block only; the body is never touched
+def transaction_key(data):
+    end = data.find(b"\r\n\r\n")
+    head = data[:end] if end >= 0 else data
+    lines = head.split(b"\r\n")
+    method = lines[0].split(b" ", 1)[0]
+    branch = call_id = cseq = None
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if branch is None and name in _VIA:
+            # Only the top Via identifies our transaction
+            for param in value.split(b",", 1)[0].split(b";")[1:]:
+                key, _, val = param.partition(b"=")
+                if key.strip().lower() == b"branch":
+                    branch = val.strip()
+                    break
+            else:
+                branch = b""
+        elif call_id is None and name in _CALL_ID:
+            call_id = value.strip()
+        elif cseq is None and name in _CSEQ:
+            cseq = value.split()[0] if value.split() else b""
+        if branch is not None and call_id is not None and cseq is not None:
+            break
+    return branch or b"", call_id or b"", cseq or b"", method
+
+
+class ServerTransaction:
+    __slots__ = ("key", "method", "addr", "request", "response", "status", "state", "expires", "retransmits")
+
+    def __init__(self, key, method, addr, request):
+        self.key = key
+        self.method = method
+        self.addr = addr
+        self.request = request
+        self.response = None
+        self.status = None
+        self.state = "trying"
+        self.expires = None
+        self.retransmits = 0
+
+
+class TransactionTable:
+    # UDP server transactions. A retransmitted request is recognised first by
+    # its exact bytes (SBC retransmissions are byte-identical), then by
+    # branch + Call-ID + CSeq, and answered by replaying the encoded response.
+    # Entries expire on a heap: Timer H (INVITE waiting for ACK, 64*T1),
+    # Timer I (after ACK, T4), Timer J (non-INVITE, 64*T1), plus the RFC 6026
+    # accepted state for INVITE 2xx (Timer L, 64*T1) so 2xx retransmits and
+    # their ACKs are absorbed too. A state change that moves the deadline
+    # pushes a new heap entry and leaves the old one to be skipped when it
+    # comes due, so the heap holds at most one entry per state a live
+    # transaction has been in (trying, completed/accepted, confirmed).
+    def __init__(self, t1=T1, clock=time.monotonic):
+        self.t1 = t1
+        self.clock = clock
+        self.by_key = {}
+        self.by_bytes = {}
+        self.by_dialog = {}  # (call_id, cseq) -> accepted INVITE, for ACKs to 2xx (new branch)
+        self.timers = []
+        self.created = 0
+        self.absorbed = 0
+        self.acks_absorbed = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.by_key)
+
+    # The transaction a request retransmits, or None for a new request
+    def lookup(self, data):
+        tx = self.by_bytes.get(data)
+        if tx is None:
+            branch, call_id, cseq, method = transaction_key(data)
+            tx = self.by_key.get((branch, call_id, cseq, method))
+            if tx is None:
+                return None
+        tx.retransmits += 1
+        self.absorbed += 1
+        return tx
+
+    def create(self, data, addr):
+        branch, call_id, cseq, method = transaction_key(data)
+        key = (branch, call_id, cseq, method)
+        tx = self.by_key[key] = ServerTransaction(key, method, addr, data)
+        self.by_bytes[data] = tx
+        self.created += 1
+        # Until a final response is cached, a stuck handler can't pin the entry forever
+        self._arm(tx, 64 * self.t1)
+        return tx
+
+    # Cache the encoded final response and start the matching timer
+    def respond(self, tx, response, status=200):
+        tx.response = response
+        tx.status = status
+        if tx.method == b"INVITE":
+            if 200 <= status < 300:
+                tx.state = "accepted"
+                self.by_dialog[(tx.key[1], tx.key[2])] = tx
+            else:
+                tx.state = "completed"
+        else:
+            tx.state = "completed"
+        self._arm(tx, 64 * self.t1)
+
+    # ACKs never get a response. Returns True if it belonged to one of our INVITEs.
+    def absorb_ack(self, data):
+        branch, call_id, cseq, _ = transaction_key(data)
+        tx = self.by_key.get((branch, call_id, cseq, b"INVITE")) or self.by_dialog.get((call_id, cseq))
+        if tx is None:
+            return False
+        self.acks_absorbed += 1
+        if tx.state == "completed":
+            tx.state = "confirmed"
+            self._arm(tx, T4)
+        return True
+
+    def _arm(self, tx, delay):
+        expires = self.clock() + delay
+        if expires == tx.expires:
+            return  # answered in the same tick it was created; the entry already there is this timer
+        tx.expires = expires
+        heapq.heappush(self.timers, (expires, id(tx), tx))
+
+    # Drop every transaction whose timer has fired; cheap when nothing is due
+    def expire(self, now=None):
+        now = self.clock() if now is None else now
+        count = 0
+        timers = self.timers
+        while timers and timers[0][0] <= now:
+            expires, _, tx = heapq.heappop(timers)
+            if tx.expires != expires:
+                continue  # re-armed since; a newer heap entry owns it
+            tx.state = "terminated"
+            if self.by_key.get(tx.key) is tx:
+                del self.by_key[tx.key]
+            if self.by_bytes.get(tx.request) is tx:
+                del self.by_bytes[tx.request]
+            if self.by_dialog.get((tx.key[1], tx.key[2])) is tx:
+                del self.by_dialog[(tx.key[1], tx.key[2])]
+            count += 1
+        self.expired += count
+        return count
+
+    def stats(self):
+        return {
+            "active": len(self.by_key),
+            "created": self.created,
+            "retransmissions_absorbed": self.absorbed,
+            "acks_absorbed": self.acks_absorbed,
+            "expired": self.expired,
+        }
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SERVICE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "2.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def probe(url):
+    try:
+        with urllib.request.urlopen(url, timeout=0.5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except (OSError, ValueError):
+        return None, None
+
+
+# Cold start of the service: process spawn -> /health/live answers -> /health/ready is 200
+def cold_start(timeout=60.0, poll=0.005):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, CCA_HTTP_PORT=str(port), CCA_STATE_FILE=os.path.join(scratch, "state.json"),
+                   CCA_DRAIN_TIMEOUT="0", CCA_REUSE_PORT="0")
+        base = f"http://127.0.0.1:{port}"
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, SERVICE], env=env, cwd=scratch,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        live = ready = None
+        pjsua = {}
+        try:
+            while time.perf_counter() - started < timeout and process.poll() is None:
+                if live is None and probe(f"{base}/health/live")[0] == 200:
+                    live = time.perf_counter() - started
+                if live is not None:
+                    status, body = probe(f"{base}/health/ready")
+                    if status == 200:
+                        ready = time.perf_counter() - started
+                        pjsua = body.get("pjsua", {})
+                        break
+                time.sleep(poll)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return {"live_ms": live and live * 1000, "ready_ms": ready and ready * 1000,
+            "pjsua_start_ms": pjsua.get("start_ms")}
+
+
+# Import cost of a module in a fresh interpreter, and whether it pulled in pjsua2
+def import_cost(module):
+    code = (f"import sys, time; t = time.perf_counter(); import {module}; "
+            "print(time.perf_counter() - t, 'pjsua2' in sys.modules)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(SERVICE), check=True)
+    seconds, loaded = result.stdout.split()
+    return {"import_ms": round(float(seconds) * 1000, 1), "pjsua2_loaded": loaded == "True"}
+
+
+def summarise(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+def run_benchmark(runs=5):
+    samples = [cold_start() for _ in range(runs)]
+    report = {key: summarise([sample[key] for sample in samples]) for key in ("live_ms", "ready_ms", "pjsua_start_ms")}
+    report["runs"] = runs
+    report["ccaConnector"] = import_cost("ccaConnector")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start-to-ready timing for the SIPREC service")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
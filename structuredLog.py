@@ -0,0 +1,190 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+# Defaults, overridable from the environment
+LOG_LEVEL = os.environ.get("CCA_LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("CCA_LOG_FORMAT", "json")  # "json" or "text"
+LOG_QUEUE_SIZE = int(os.environ.get("CCA_LOG_QUEUE_SIZE", "10000"))
+PACKET_LOG_RATE = float(os.environ.get("CCA_PACKET_LOG_RATE", "50"))  # records/sec per message
+PACKET_LOG_SAMPLE = int(os.environ.get("CCA_PACKET_LOG_SAMPLE", "1"))  # keep 1 in N
+
+# Per-call fields every record may carry
+CONTEXT_FIELDS = ("call_id", "agent_dnis", "seq_id")
+
+# Loggers used across the service; "cca.packet" is the per-datagram firehose
+ROOT_LOGGER = "cca"
+PACKET_LOGGER = "cca.packet"
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Enqueue without ever blocking the caller; count what we had to drop
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Freeze the message now (args may be mutated later) but leave
+        # exception and JSON formatting to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.msg,
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        context = [f"{f}={getattr(record, f)}" for f in CONTEXT_FIELDS if getattr(record, f, None) is not None]
+        fields = getattr(record, "fields", None)
+        if fields:
+            context.extend(f"{k}={v}" for k, v in fields.items())
+        return f"{line} [{' '.join(context)}]" if context else line
+
+
+class RateLimitFilter(logging.Filter):
+    # Token bucket per message template, plus optional 1-in-N sampling.
+    # The next record let through reports how many were suppressed.
+    def __init__(self, rate=PACKET_LOG_RATE, burst=None, sample=PACKET_LOG_SAMPLE):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.sample = max(1, sample)
+        self.buckets = {}
+
+    def filter(self, record):
+        key = record.msg
+        bucket = self.buckets.get(key)
+        now = time.monotonic()
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now, 0, 0]  # tokens, last, seen, suppressed
+        bucket[2] += 1
+
+        if self.sample > 1 and bucket[2] % self.sample:
+            bucket[3] += 1
+            return False
+        if self.rate > 0:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[3] += 1
+                return False
+            bucket[0] -= 1.0
+
+        if bucket[3]:
+            record.fields = dict(getattr(record, "fields", None) or {}, suppressed=bucket[3])
+            bucket[3] = 0
+        return True
+
+
+class CallLogAdapter(logging.LoggerAdapter):
+    # Carries call_id/agent_dnis/seq_id on every record; bind() adds fields later
+    def bind(self, **context):
+        self.extra.update({k: v for k, v in context.items() if v is not None})
+        return self
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = dict(self.extra, **kwargs.get("extra", {}))
+        return msg, kwargs
+
+
+def call_logger(name="cca.call", **context):
+    return CallLogAdapter(logging.getLogger(name), {k: v for k, v in context.items() if v is not None})
+
+
+# Route the "cca" loggers through a bounded queue to a background writer thread
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None, queue_size=LOG_QUEUE_SIZE):
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        writer = logging.StreamHandler(stream or sys.stdout)
+        writer.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        _handler = DroppingQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=False)
+        _listener.start()
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.addHandler(_handler)
+        root.setLevel(level)
+        root.propagate = False
+        logging.getLogger(PACKET_LOGGER).addFilter(RateLimitFilter())
+
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def shutdown_logging():
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+        _listener = None
+        _handler = None
+
+
+def set_level(level, name=ROOT_LOGGER):
+    logging.getLogger(name).setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def get_levels():
+    names = [ROOT_LOGGER] + sorted(n for n in logging.root.manager.loggerDict if n.startswith(ROOT_LOGGER + "."))
+    levels = {n: logging.getLevelName(logging.getLogger(n).getEffectiveLevel()) for n in names}
+    return {"levels": levels, "dropped": _handler.dropped if _handler else 0}
+
+
+# SIGUSR1 flips the service between its configured level and DEBUG
+def install_debug_toggle(sig=getattr(signal, "SIGUSR1", None)):
+    if sig is None:
+        return
+    configured = logging.getLogger(ROOT_LOGGER).level or logging.INFO
+
+    def toggle(signum, frame):
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(configured if root.level == logging.DEBUG else logging.DEBUG)
+
+    signal.signal(sig, toggle)
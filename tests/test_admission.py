@@ -0,0 +1,69 @@
+import threading
+
+from admission import AdmissionController, CallCounter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def controller(calls=0, depth=0, **kwargs):
+    return AdmissionController(lambda: calls, lambda: depth, clock=Clock(), **kwargs)
+
+
+def test_admits_under_the_limits():
+    admission = controller(calls=3, max_calls=4)
+    assert admission.check("10.0.0.1").admitted
+    assert admission.stats()["admitted"] == 1
+
+
+def test_capacity_and_bridge_backlog_reject_with_retry_after():
+    decision = controller(calls=4, max_calls=4).check("10.0.0.1")
+    assert (decision.admitted, decision.status, decision.reason) == (False, 503, "capacity")
+    assert decision.retry_after > 0
+    assert controller(depth=10, max_bridge_depth=10).check("10.0.0.1").reason == "bridge_backlog"
+
+
+def test_draining_comes_first():
+    admission = controller(calls=100, max_calls=1)
+    admission.draining = True
+    assert admission.check("10.0.0.1").reason == "draining"
+
+
+def test_rate_limit_is_off_by_default():
+    admission = controller(rate=0)
+    assert all(admission.check("10.0.0.1").admitted for _ in range(1000))
+    assert admission.stats()["rate_limit"] is None
+
+
+def test_rate_limit_per_source_refills():
+    admission = controller(rate=10, burst=5)
+    assert [admission.check("10.0.0.1").admitted for _ in range(6)] == [True] * 5 + [False]
+    assert admission.check("10.0.0.2").admitted  # other sources have their own bucket
+    admission.clock.now += 0.1
+    assert admission.check("10.0.0.1").admitted
+
+
+def test_call_counter_tracks_admits_and_releases_across_threads():
+    counter = CallCounter()
+
+    def churn():
+        for _ in range(10000):
+            counter.admit()
+            counter.release()
+        counter.admit()
+
+    threads = [threading.Thread(target=churn) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter() == 4
+    admission = AdmissionController(counter, lambda: 0, max_calls=4)
+    assert admission.check("10.0.0.1").reason == "capacity"
+    counter.release()
+    assert admission.check("10.0.0.1").admitted
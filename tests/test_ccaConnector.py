@@ -0,0 +1,86 @@
+import struct
+
+import pytest
+
+import ccaConnector
+from sipFixtures import all_invites
+from sipTransactions import TransactionTable
+
+
+class Sink:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr=None):
+        self.sent.append(data)
+
+
+def invite(call, port):
+    return (all_invites()[0]
+            .replace(b"Call-ID: ", f"Call-ID: {call}-".encode(), 1)
+            .replace(b"branch=z9hG4bK", f"branch=z9hG4bK{call}".encode(), 1)
+            .replace(b"m=audio 19514 ", f"m=audio {port} ".encode(), 1))
+
+
+def bye(request):
+    head = request.split(b"\r\n\r\n", 1)[0].split(b"\r\n")
+    lines = [b"BYE sip:rec@example.com SIP/2.0"]
+    for line in head[1:]:
+        name = line.split(b":", 1)[0].strip().lower()
+        if name in (b"via", b"v"):
+            lines.append(line.replace(b"branch=z9hG4bK", b"branch=z9hG4bKbye", 1))
+        elif name in (b"from", b"f", b"to", b"t", b"call-id", b"i"):
+            lines.append(line)
+    lines += [b"CSeq: 2 BYE", b"Content-Length: 0"]
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def rtp(seq, ssrc=0x95023238):
+    return struct.pack("!BBHII", 0x80, 0, seq, seq * 160, ssrc) + b"\xff" * 160
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    monkeypatch.setattr(ccaConnector, "RTP_MODE", "decode")
+    monkeypatch.setattr(ccaConnector, "transactions", TransactionTable())
+    yield ccaConnector
+    for released_id in list(ccaConnector.call_routes):
+        ccaConnector.release_call(released_id)
+
+
+def call_id_of(request):
+    return ccaConnector.transaction_key(request)[1].decode()
+
+
+def test_rtp_follows_the_sdp_port_of_its_own_call(connector):
+    sink, sbc = Sink(), ("198.51.100.7", 5060)
+    first, second = invite("a", 40000), invite("b", 40002)
+    connector.handle_sip_request(sink, first, sbc)
+    connector.handle_sip_request(sink, second, sbc)
+
+    for seq in range(4):
+        connector.ingest_rtp(rtp(seq), ("198.51.100.7", 40000))
+    for seq in range(2):
+        connector.ingest_rtp(rtp(seq), ("198.51.100.7", 40002))
+    connector.ingest_rtp(rtp(0), ("203.0.113.9", 9999))  # nobody's media
+
+    # The first packet of each stream is its probation packet
+    quality = {call: sum(s.received for s in streams.values())
+               for call, streams in connector.call_quality.items()}
+    assert quality == {call_id_of(first): 3, call_id_of(second): 1}
+
+
+def test_bye_releases_its_own_call_only(connector):
+    sink, sbc = Sink(), ("198.51.100.7", 5060)
+    first, second = invite("a", 40000), invite("b", 40002)
+    connector.handle_sip_request(sink, first, sbc)
+    connector.handle_sip_request(sink, second, sbc)
+    connector.ingest_rtp(rtp(0), ("198.51.100.7", 40000))
+    connector.ingest_rtp(rtp(0), ("198.51.100.7", 40002))
+
+    connector.handle_sip_request(sink, bye(first), sbc)
+    assert sink.sent[-1].startswith(b"SIP/2.0 200 ")
+    assert call_id_of(first) not in connector.call_quality
+    assert ("198.51.100.7", 40000) not in connector.media_routes
+    assert call_id_of(second) in connector.call_quality
+    assert connector.media_routes[("198.51.100.7", 40002)] == call_id_of(second)
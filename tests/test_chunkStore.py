@@ -0,0 +1,65 @@
+import os
+import wave
+
+import numpy as np
+
+from chunkStore import ChunkStore, wav_header
+
+
+def pcm(seconds=1.0, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-8000, 8000, int(8000 * seconds), dtype=np.int16).tobytes()
+
+
+def store_leg(store, call_id, payload, leg="0", ucid=None, piece=1000):
+    writer = store.writer(call_id, leg, ucid=ucid)
+    for offset in range(0, len(payload), piece):
+        writer.write(payload[offset:offset + piece])
+    return writer.finish(wav_header(8000, len(payload)))
+
+
+def test_leg_round_trips_through_wave(tmp_path):
+    store = ChunkStore(str(tmp_path), chunk_size=4096)
+    payload = pcm()
+    entry = store_leg(store, "call-1", payload)
+    assert entry["size"] == 44 + len(payload)
+    assert len(entry["chunks"]) == -(-len(payload) // 4096)
+
+    with wave.open(store.open("call-1"), "rb") as w:
+        assert (w.getframerate(), w.getnchannels()) == (8000, 1)
+        assert w.readframes(w.getnframes()) == payload
+
+    reader = store.open("call-1")
+    reader.seek(44 + 5000)
+    assert reader.read(300) == payload[5000:5300]
+    reader.seek(-10, os.SEEK_END)
+    assert reader.read() == payload[-10:]
+
+
+def test_identical_audio_is_stored_once(tmp_path):
+    store = ChunkStore(str(tmp_path), chunk_size=4096)
+    payload = pcm(seed=1)
+    first = store_leg(store, "call-1", payload)
+    writer = store.writer("call-2", "0", prefix=b"RIFF-other-header")
+    writer.write(payload)
+    second = writer.finish()
+    assert writer.new_chunks == 0
+    assert second["chunks"] == first["chunks"]
+    stats = store.stats()
+    assert stats["logical_bytes"] == first["size"] + second["size"]
+    assert stats["stored_bytes"] == len(payload)
+    assert stats["dedup_ratio"] > 1.9
+
+
+def test_ucid_links_every_call_and_leg(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    store_leg(store, "call-1", pcm(0.1), leg="0", ucid="U1")
+    store_leg(store, "call-1", pcm(0.1, seed=2), leg="1")
+    store_leg(store, "call-2", pcm(0.1), ucid="U1")
+    store.link_ucid("U1", "call-1")  # linking twice is a no-op
+    assert store.calls_for_ucid("U1") == ["call-1", "call-2"]
+    manifest = store.manifest("call-1")
+    assert manifest["ucid"] == "U1"
+    assert sorted(manifest["legs"]) == ["0", "1"]
+    assert store.calls_for_ucid("U2") == []
+    assert store.manifest("call-3") is None
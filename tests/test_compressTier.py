@@ -0,0 +1,89 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from chunkStore import wav_header
+from compressTier import (CompressionTier, Incompressible, available_codecs, compress_file, pack_samples,
+                          read_recording, unpack_samples)
+
+
+def speech(samples=20000, channels=1, seed=0):
+    rng = np.random.default_rng(seed)
+    walk = np.cumsum(rng.integers(-300, 300, samples * channels)).clip(-32768, 32767)
+    return walk.astype("<i2").tobytes()
+
+
+def chunk(chunk_id, body):
+    return struct.pack("<4sI", chunk_id, len(body)) + body + b"\0" * (len(body) & 1)
+
+
+def wav(payload, rate=8000, channels=1, bits=16, extra=b"", trailer=b""):
+    block_align = channels * bits // 8
+    fmt = struct.pack("<HHIIHH", 1, channels, rate, rate * block_align, block_align, bits)
+    body = b"WAVE" + chunk(b"fmt ", fmt) + extra + chunk(b"data", payload) + trailer
+    return struct.pack("<4sI", b"RIFF", len(body)) + body
+
+
+def stored(tmp_path, data, codec):
+    path = tmp_path / "leg0.wav"
+    path.write_bytes(data)
+    return compress_file(str(path), codec)
+
+
+def test_delta_planes_round_trip():
+    pcm = np.frombuffer(speech(), dtype="<i2")
+    assert np.array_equal(unpack_samples(pack_samples(pcm)), pcm)
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+@pytest.mark.parametrize("channels", [1, 2])
+def test_recording_round_trips_byte_for_byte(tmp_path, codec, channels):
+    data = wav_header(8000, 40000 * channels, channels) + speech(20000, channels)
+    target, result = stored(tmp_path, data, codec)
+    assert not os.path.exists(tmp_path / "leg0.wav")
+    assert read_recording(target) == data
+    assert result["output_bytes"] < result["input_bytes"]
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+def test_extra_header_chunks_survive(tmp_path, codec):
+    data = wav(speech(), extra=chunk(b"LIST", b"INFOISFT\x05\0\0\0cca\0\0"))
+    target, result = stored(tmp_path, data, codec)
+    # FLAC can't carry the LIST chunk, so it falls back to the framed container
+    assert result["codec"] != "flac"
+    assert read_recording(target) == data
+
+
+def test_compressing_again_after_a_crash_finds_the_target(tmp_path):
+    data = wav(speech())
+    target, _ = stored(tmp_path, data, "deflate")
+    assert compress_file(str(tmp_path / "leg0.wav"), "deflate") == (target, None)
+
+
+@pytest.mark.parametrize("data", [
+    wav(bytes(range(256)) * 10, bits=8),
+    wav(speech(1001), channels=2),
+    wav(speech(), trailer=chunk(b"cue ", b"\0" * 12)),
+], ids=["8-bit", "partial frame", "trailing chunk"])
+def test_layouts_that_would_not_round_trip_are_incompressible(tmp_path, data):
+    with pytest.raises(Incompressible):
+        stored(tmp_path, data, "deflate")
+    assert (tmp_path / "leg0.wav").read_bytes() == data
+
+
+def test_tier_leaves_incompressible_recordings_in_place(tmp_path):
+    tier = CompressionTier("deflate", workers=1, journal_dir=str(tmp_path / "jobs"))
+    tier.start()
+    good, bad = tmp_path / "good.wav", tmp_path / "bad.wav"
+    good.write_bytes(wav(speech()))
+    bad.write_bytes(wav(bytes(100), bits=8))
+    done = []
+    futures = [tier.submit(str(good), "call-1", 0, lambda *args: done.append(args)), tier.submit(str(bad))]
+    assert [future.result() for future in futures] == [str(tmp_path / "good.ccaf"), None]
+    tier.shutdown(wait=True)
+    assert done == [("call-1", 0, str(tmp_path / "good.ccaf"))]
+    assert bad.exists()
+    assert os.listdir(tmp_path / "jobs") == []
+    assert (tier.stats()["completed"], tier.stats()["skipped"], tier.stats()["failed"]) == (1, 1, 0)
@@ -0,0 +1,79 @@
+import struct
+
+import numpy as np
+import pytest
+
+from dtmf import KEYPAD, BatchedDtmfDetector, GoertzelBank, MuteController, TelephoneEventTracker, tone
+
+
+def event(digit, end=False, duration=160):
+    return struct.pack("!BBH", "0123456789*#ABCD".index(digit), 0x80 * end | 10, duration)
+
+
+def test_telephone_event_reported_once_per_timestamp():
+    tracker = TelephoneEventTracker()
+    packets = [(event("5", duration=d), 8000) for d in (160, 320, 480)]
+    packets += [(event("5", end=True, duration=640), 8000)] * 3  # end retransmitted
+    packets += [(event("#"), 9600), (event("#", end=True), 9600), (b"\x05", 11200)]
+    assert [tracker.update(payload, ts) for payload, ts in packets] == [
+        "5", None, None, None, None, None, "#", None, None]
+
+
+@pytest.mark.parametrize("rate", [8000, 16000])
+def test_goertzel_bank_finds_every_key(rate):
+    bank = GoertzelBank(rate)
+    digits = [key for row in KEYPAD for key in row]
+    blocks = np.stack([tone(digit, 100, rate)[:bank.block] for digit in digits])
+    assert bank.detect(blocks) == digits
+
+
+def test_goertzel_bank_rejects_noise_silence_and_speechlike_audio():
+    bank = GoertzelBank(8000)
+    rng = np.random.default_rng(3)
+    t = np.arange(bank.block) / 8000
+    single = (np.sin(2 * np.pi * 770 * t) * 10000).astype(np.int16)  # a row tone without a column
+    quiet = tone("5", 100)[:bank.block] // 200
+    noisy = tone("5", 100)[:bank.block] + rng.normal(0, 6000, bank.block).astype(np.int16)
+    blocks = np.stack([np.zeros(bank.block, np.int16), rng.normal(0, 3000, bank.block).astype(np.int16),
+                       single, quiet, noisy])
+    assert bank.detect(blocks) == [""] * 5
+
+
+def test_batched_detector_reports_each_press_once_with_its_offset():
+    detector = BatchedDtmfDetector(batch_ms=0)
+    found = {"a": [], "b": []}
+    gap = np.zeros(800, np.int16)
+    audio = {"a": np.concatenate([gap, tone("1", 200), gap, tone("1", 200), gap]),
+             "b": np.concatenate([gap, gap, tone("9", 120), gap])}
+    streams = {key: detector.open_stream(key, 8000, lambda digit, at, key=key: found[key].append((digit, at)))
+               for key in audio}
+    for start in range(0, 4000, 160):
+        for key, pcm in audio.items():
+            if start < len(pcm):
+                streams[key].append(pcm[start:start + 160])
+        detector.process()
+    assert [digit for digit, _ in found["a"]] == ["1", "1"]
+    assert [digit for digit, _ in found["b"]] == ["9"]
+    # Reported within a block of where the tone starts
+    assert 100 - 26 <= found["a"][0][1] <= 100 + 26
+    assert 200 - 26 <= found["b"][0][1] <= 200 + 26
+    detector.close_stream("a")
+    assert list(detector.streams) == ["b"]
+
+
+def test_mute_intervals_merge_and_resume_once_all_sinks_pass():
+    changes = []
+    mute = MuteController(hold_ms=1000, lookback_ms=200, on_change=lambda kind, at: changes.append((kind, at)))
+    first, second = object(), object()
+    mute.add_sink(first)
+    mute.add_sink(second)
+    mute.digit(1000)
+    mute.digit(1500)  # extends the open interval
+    assert changes == [("recording_paused", 800)]
+    assert mute.muted_span(700, 900) and not mute.muted_span(0, 800)
+    mute.released(first, 3000)
+    assert len(changes) == 1
+    mute.released(second, 2600)
+    assert changes[-1] == ("recording_resumed", 2500)
+    mute.digit(5000)
+    assert changes[-1] == ("recording_paused", 4800)
@@ -0,0 +1,27 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from g711 import alaw_decode, ulaw_decode, ulaw_encode
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    audioop = pytest.importorskip("audioop")  # the reference coder; removed in Python 3.13
+
+EVERY_SAMPLE = np.arange(-32768, 32768, dtype=np.int16)
+EVERY_CODE = bytes(range(256))
+
+
+def test_ulaw_encode_matches_reference():
+    assert ulaw_encode(EVERY_SAMPLE) == audioop.lin2ulaw(EVERY_SAMPLE.tobytes(), 2)
+
+
+def test_ulaw_decode_matches_reference():
+    expected = np.frombuffer(audioop.ulaw2lin(EVERY_CODE, 2), dtype="<i2")
+    assert np.array_equal(ulaw_decode(EVERY_CODE), expected)
+
+
+def test_alaw_decode_matches_reference():
+    expected = np.frombuffer(audioop.alaw2lin(EVERY_CODE, 2), dtype="<i2")
+    assert np.array_equal(alaw_decode(EVERY_CODE), expected)
@@ -0,0 +1,83 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from g711 import PT_PCMU, ulaw_decode
+from rtpArchive import TRAILER, RtpArchive, RtpArchiveWriter, UnsupportedCodec
+
+SSRC = 0x95023237
+
+
+def rtp(seq, ts, fill, pt=PT_PCMU, ssrc=SSRC, samples=160):
+    return struct.pack("!BBHII", 0x80, pt, seq & 0xFFFF, ts & 0xFFFFFFFF, ssrc) + bytes([fill]) * samples
+
+
+def archive(tmp_path, packets, close=True):
+    path = str(tmp_path / "rtp.rtpc")
+    writer = RtpArchiveWriter(path)
+    for packet in packets:
+        assert writer.append(packet)
+    if close:
+        writer.close()
+    else:
+        writer.file.flush()
+    return path
+
+
+def expected(fills, samples=160):
+    return np.concatenate([ulaw_decode(bytes([fill]) * samples) for fill in fills])
+
+
+def test_reordered_and_duplicate_packets_land_in_timestamp_order(tmp_path):
+    order = [0, 1, 3, 2, 4, 4, 5]
+    path = archive(tmp_path, [rtp(n, 1000 + n * 160, 0x10 + n) for n in order])
+    pcm, rate = RtpArchive(path).decode(0)
+    assert rate == 8000
+    assert np.array_equal(pcm, expected([0x10 + n for n in range(6)]))
+
+
+def test_timestamp_wraparound_is_continuous(tmp_path):
+    start = (1 << 32) - 2 * 160
+    path = archive(tmp_path, [rtp(65534 + n, start + n * 160, 0x20 + n) for n in range(4)])
+    pcm, _ = RtpArchive(path).decode(0)
+    assert np.array_equal(pcm, expected([0x20, 0x21, 0x22, 0x23]))
+
+
+def test_gap_becomes_silence(tmp_path):
+    path = archive(tmp_path, [rtp(0, 0, 0x30), rtp(2, 320, 0x32)])
+    pcm, _ = RtpArchive(path).decode(0)
+    assert len(pcm) == 480
+    assert not pcm[160:320].any()
+
+
+def test_missing_trailer_is_rebuilt_by_scanning(tmp_path):
+    packets = [rtp(n, n * 160, 0x40 + n) for n in range(5)] + [rtp(0, 0, 0x50, ssrc=SSRC + 1)]
+    path = archive(tmp_path, packets, close=False)
+    with open(path, "ab") as f:
+        f.write(b"\0" * 7)  # torn final record
+    reader = RtpArchive(path)
+    assert [(s["packets"], s["encoding"]) for s in reader.streams] == [(5, "PCMU"), (1, "PCMU")]
+    assert np.array_equal(reader.decode(0)[0], expected([0x40 + n for n in range(5)]))
+
+    closed = RtpArchive(archive(tmp_path, packets))
+    assert closed.data_end < os.path.getsize(closed.path) - TRAILER.size
+    assert [s["packets"] for s in closed.streams] == [5, 1]
+
+
+def test_timestamp_jump_is_rebased_and_decode_is_bounded(tmp_path):
+    # 12 hours ahead on the RTP clock, arriving right after the previous packet
+    path = archive(tmp_path, [rtp(0, 0, 0x60), rtp(1, 160, 0x61), rtp(2, 160 + 8000 * 43200, 0x62)])
+    pcm, _ = RtpArchive(path).decode(0)
+    assert len(pcm) == 480
+    assert len(RtpArchive(path).decode(0, max_seconds=0.03)[0]) == 240
+
+
+def test_other_payload_types_are_skipped_or_refused(tmp_path):
+    path = archive(tmp_path, [rtp(0, 0, 0x70), rtp(1, 0, 0x01, pt=101, samples=4), rtp(2, 160, 0x71),
+                              rtp(0, 0, 0x00, pt=18, ssrc=SSRC + 1, samples=20)])
+    reader = RtpArchive(path)
+    assert np.array_equal(reader.decode(0)[0], expected([0x70, 0x71]))
+    with pytest.raises(UnsupportedCodec):
+        reader.decode(1)
@@ -0,0 +1,56 @@
+import pytest
+
+from rtpQuality import StreamQuality, estimate_mos
+
+
+def feed(seqs, start=1000, jitter=None, rate=8000):
+    stats = StreamQuality(rate, "PCMU")
+    for n, seq in enumerate(seqs):
+        ts = ((seq - start) % 65536) * 160
+        arrival = (seq - start) % 65536 * 0.02 + (jitter(n) if jitter else 0.0)
+        stats.update(seq % 65536, ts, arrival)
+    return stats
+
+
+def test_clean_stream():
+    report = feed(range(1000, 1100)).snapshot()
+    # The first packet is the probation packet and isn't counted
+    assert (report["packets"], report["lost"], report["loss_pct"]) == (99, 0, 0.0)
+    assert (report["duplicates"], report["reordered"], report["jitter_ms"]) == (0, 0, 0.0)
+
+
+def test_loss_is_expected_minus_received():
+    seqs = [s for s in range(1000, 1100) if s % 10 != 5]
+    report = feed(seqs).snapshot()
+    assert report["lost"] == 10
+    assert report["loss_pct"] == pytest.approx(100 * 10 / 99, abs=0.01)
+
+
+def test_duplicates_are_not_counted_as_received():
+    seqs = list(range(1000, 1050))
+    seqs[20:20] = [1019, 1019]  # twice again, right after the original
+    seqs.append(1030)  # late duplicate, inside the window
+    report = feed(seqs).snapshot()
+    assert (report["packets"], report["duplicates"], report["lost"]) == (49, 3, 0)
+
+
+def test_reordered_packets_fill_their_gap():
+    seqs = list(range(1000, 1050))
+    seqs[10], seqs[11] = seqs[11], seqs[10]
+    seqs[30], seqs[33] = seqs[33], seqs[30]  # 1031, 1032 and 1030 all arrive after 1033
+    report = feed(seqs).snapshot()
+    assert (report["reordered"], report["lost"], report["duplicates"]) == (4, 0, 0)
+
+
+def test_sequence_wraparound_is_not_loss():
+    report = feed(range(65500, 65600), start=65500).snapshot()
+    assert (report["packets"], report["lost"]) == (99, 0)
+
+
+def test_jitter_and_mos():
+    steady = feed(range(1000, 1200)).snapshot()
+    jittery = feed(range(1000, 1200), jitter=lambda n: 0.015 * (n % 2)).snapshot()
+    assert jittery["jitter_ms"] > 5
+    assert jittery["mos"] < steady["mos"]
+    assert estimate_mos(5.0, 0.0) < estimate_mos(0.0, 0.0) <= 4.5
+    assert estimate_mos(1.0, 0.0, codec="G729") < estimate_mos(1.0, 0.0, codec="PCMU")
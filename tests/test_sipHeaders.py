@@ -0,0 +1,65 @@
+from sipFixtures import all_invites
+from sipHeaders import CallIndex, HeaderTable, extract_ucid, load_header_fields
+
+# rdata.wholeMsg as pjsua2 hands it to onIncomingCall: request line, headers, blank line, multipart body
+WHOLE_MSG = (
+    "INVITE sip:rec@10.0.0.2:5060 SIP/2.0\r\n"
+    "Via: SIP/2.0/UDP 10.0.0.1:5060;branch=z9hG4bK776asdhds\r\n"
+    "Call-ID: a84b4c76e66710@sbc\r\n"
+    "x-agent-dnis:  4021\r\n"
+    "X-Sequence-ID: 17\r\n"
+    "X-Queue: billing\r\n"
+    "Content-Type: multipart/mixed;boundary=b1\r\n"
+    "\r\n"
+    "--b1\r\n"
+    "Content-Type: application/sdp\r\n"
+    "\r\n"
+    "v=0\r\n"
+    "--b1\r\n"
+    "Content-Type: application/rs-metadata+xml\r\n"
+    "\r\n"
+    "X-Acme-Call-ID: not-a-header\r\n"
+    "<recording><extensiondata><apkt:ucid> 00FA080018803B69 </apkt:ucid></extensiondata></recording>\r\n"
+    "--b1--\r\n"
+)
+
+
+def test_whole_message_gives_headers_and_ucid():
+    table = HeaderTable(load_header_fields("X-Queue=queue"))
+    found, ucid = table.extract_message(WHOLE_MSG)
+    # Header names match case-insensitively; the body is never read as headers
+    assert found == {"agent_dnis": "4021", "seq_id": "17", "queue": "billing"}
+    assert ucid == "00FA080018803B69"
+
+
+def test_bytes_message_and_missing_fields_get_defaults():
+    table = HeaderTable(load_header_fields(""))
+    found, ucid = table.extract_message(b"OPTIONS sip:rec SIP/2.0\r\nCall-ID: x\r\n\r\n")
+    assert found == {"seq_id": "unknown", "agent_dnis": "unknown"}
+    assert ucid is None
+
+
+def test_fixture_invites_carry_a_ucid():
+    table = HeaderTable(load_header_fields(""))
+    for invite in all_invites():
+        _, ucid = table.extract_message(invite)
+        assert ucid and ucid == extract_ucid(invite.split(b"\r\n\r\n", 1)[1])
+
+
+def test_header_fields_from_json_or_pairs():
+    assert load_header_fields('{"X-Skill": "skill"}')["X-Skill"] == "skill"
+    fields = load_header_fields("X-Queue=queue, X-Site")
+    assert fields["X-Queue"] == "queue"
+    assert fields["X-Site"] == "x_site"
+    assert fields["X-Agent-DNIS"] == "agent_dnis"
+
+
+def test_call_index_holds_every_recording_of_a_ucid():
+    index = CallIndex()
+    index.add("call-1", {"ucid": "U1", "acme_call_id": "A1"})
+    index.add("call-2", {"ucid": "U1", "acme_call_id": None})
+    assert index.lookup("ucid", "U1") == {"call-1", "call-2"}
+    index.remove("call-1", {"ucid": "U1", "acme_call_id": "A1"})
+    assert index.lookup("ucid", "U1") == {"call-2"}
+    assert index.lookup("acme_call_id", "A1") == set()
+    assert index.indexes["acme_call_id"] == {}
@@ -0,0 +1,100 @@
+import asyncio
+import random
+
+import pytest
+
+import ccaConnector
+from sipFixtures import all_invites
+from sipTcp import FramingError, SipFramer, SipTcpServer
+
+
+def frame(*pieces):
+    framer = SipFramer()
+    messages = []
+    for piece in pieces:
+        framer.feed(piece)
+        messages.extend(framer.messages())
+    return messages, framer
+
+
+def test_random_splits_frame_every_message():
+    invites = all_invites()
+    stream = b"".join(invites)
+    rng = random.Random(7)
+    pieces, position = [], 0
+    while position < len(stream):
+        size = rng.randint(1, 700)
+        pieces.append(stream[position:position + size])
+        position += size
+    messages, framer = frame(*pieces)
+    assert messages == invites
+    assert framer.pending() == 0
+
+
+def test_back_to_back_200_ok_frames_cleanly():
+    reply = ccaConnector.generate_sip_200_ok("call-1", "1").encode()
+    messages, _ = frame(reply + reply)
+    assert messages == [reply, reply]
+
+
+def test_generated_response_echoes_request_headers():
+    request = (b"OPTIONS sip:rec@example.com SIP/2.0\r\nv: SIP/2.0/TCP sbc;branch=z9hG4bKa\r\n"
+               b"f: <sip:sbc>;tag=1\r\nt: <sip:rec>\r\ni: opt-1\r\nCSeq: 5 OPTIONS\r\nl: 0\r\n\r\n")
+    reply = ccaConnector.generate_sip_response(request, 200, "OK")
+    messages, _ = frame(reply)
+    assert messages == [reply]
+    assert b"\r\nCall-ID: opt-1\r\n" in reply
+    assert b"\r\nCSeq: 5 OPTIONS\r\n" in reply
+    assert b";tag=" in reply.split(b"\r\nTo: ", 1)[1].split(b"\r\n", 1)[0]
+
+
+def test_keepalive_between_messages():
+    invite = all_invites()[0]
+    messages, _ = frame(b"\r\n\r\n" + invite + b"\r\n\r\n")
+    assert messages == [b"\r\n\r\n", invite, b"\r\n\r\n"]
+
+
+def test_missing_content_length_is_a_framing_error():
+    with pytest.raises(FramingError):
+        frame(b"OPTIONS sip:x SIP/2.0\r\nCall-ID: a\r\n\r\n")
+
+
+def test_oversized_message_is_a_framing_error():
+    framer = SipFramer(max_message=1024)
+    framer.feed(b"INVITE sip:x SIP/2.0\r\nContent-Length: 4096\r\n\r\n")
+    with pytest.raises(FramingError):
+        list(framer.messages())
+
+
+@pytest.mark.parametrize("value", [b"-1", b"-4096", b"12abc", b""])
+def test_negative_or_garbage_content_length_is_a_framing_error(value):
+    with pytest.raises(FramingError):
+        frame(b"OPTIONS sip:x SIP/2.0\r\nContent-Length: " + value + b"\r\n\r\n")
+
+
+def test_handler_error_closes_only_its_connection():
+    ping = b"OPTIONS sip:x SIP/2.0\r\nCall-ID: ok\r\nContent-Length: 0\r\n\r\n"
+    bad = ping.replace(b"Call-ID: ok", b"Call-ID: bad")
+
+    def handle(transport, message, addr):
+        if b"Call-ID: bad" in message:
+            raise ValueError("unparseable")
+        transport.sendto(b"pong")
+
+    async def run():
+        server = SipTcpServer(handle)
+        await server.start("127.0.0.1", 0)
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            good_reader, good_writer = await asyncio.open_connection("127.0.0.1", port)
+            bad_reader, bad_writer = await asyncio.open_connection("127.0.0.1", port)
+            bad_writer.write(bad)
+            assert await asyncio.wait_for(bad_reader.read(), 5) == b""
+            good_writer.write(ping)
+            assert await asyncio.wait_for(good_reader.readexactly(4), 5) == b"pong"
+            good_writer.close()
+            bad_writer.close()
+        finally:
+            await server.close()
+
+    asyncio.run(run())
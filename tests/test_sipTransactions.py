@@ -0,0 +1,89 @@
+from sipFixtures import all_invites
+from sipTransactions import T1, T4, TransactionTable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def ack_for(invite):
+    return invite.replace(b"INVITE ", b"ACK ", 1).replace(b" INVITE\r\n", b" ACK\r\n", 1)
+
+
+def test_retransmitted_invite_replays_cached_response():
+    table = TransactionTable(clock=Clock())
+    invite = all_invites()[0]
+    assert table.lookup(invite) is None
+    tx = table.create(invite, ("10.0.0.1", 5060))
+    table.respond(tx, b"SIP/2.0 200 OK\r\n\r\n")
+    again = table.lookup(invite)
+    assert again is tx
+    assert again.response == b"SIP/2.0 200 OK\r\n\r\n"
+    assert table.stats()["retransmissions_absorbed"] == 1
+
+
+def test_ack_is_absorbed_and_error_response_confirmed():
+    clock = Clock()
+    table = TransactionTable(clock=clock)
+    invite = all_invites()[0]
+    tx = table.create(invite, ("10.0.0.1", 5060))
+    table.respond(tx, b"SIP/2.0 503 Service Unavailable\r\n\r\n", 503)
+    assert table.absorb_ack(ack_for(invite))
+    assert tx.state == "confirmed"
+    # Timer I runs from the ACK
+    clock.now = T4 + 0.01
+    assert table.expire() == 1
+    assert table.lookup(invite) is None
+
+
+def test_unknown_ack_is_not_absorbed():
+    table = TransactionTable(clock=Clock())
+    assert not table.absorb_ack(ack_for(all_invites()[0]))
+
+
+def test_accepted_invite_expires_after_timer_l():
+    clock = Clock()
+    table = TransactionTable(clock=clock)
+    invite = all_invites()[0]
+    table.respond(table.create(invite, ("10.0.0.1", 5060)), b"SIP/2.0 200 OK\r\n\r\n")
+    clock.now = 64 * T1 - 0.01
+    assert table.expire() == 0
+    clock.now = 64 * T1 + 0.01
+    assert table.expire() == 1
+    assert len(table) == 0
+
+
+def test_same_tick_response_keeps_one_timer_and_expires_once():
+    clock = Clock()
+    table = TransactionTable(clock=clock)
+    invites = all_invites()[:3]
+    for invite in invites:
+        table.respond(table.create(invite, ("10.0.0.1", 5060)), b"SIP/2.0 200 OK\r\n\r\n")
+    assert len(table.timers) == len(invites)
+    clock.now = 64 * T1 + 0.01
+    assert table.expire() == len(invites)
+    assert table.stats()["expired"] == len(invites)
+    assert table.timers == []
+
+
+def test_rearmed_transaction_expires_once_on_its_latest_timer():
+    clock = Clock()
+    table = TransactionTable(clock=clock)
+    invite = all_invites()[0]
+    tx = table.create(invite, ("10.0.0.1", 5060))
+    clock.now = 1.0
+    table.respond(tx, b"SIP/2.0 486 Busy Here\r\n\r\n", 486)
+    assert len(table.timers) == 2
+    # The trying entry comes due first and is skipped as stale
+    clock.now = 64 * T1 + 0.5
+    assert table.expire() == 0
+    assert table.lookup(invite) is tx
+    clock.now = 1.0 + 64 * T1 + 0.01
+    assert table.expire() == 1
+    assert table.expire() == 0
+    assert table.stats()["expired"] == 1
+    assert len(table) == 0 and table.timers == []
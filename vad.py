@@ -0,0 +1,249 @@
+import argparse
+import bisect
+import json
+import os
+import wave
+
+import numpy as np
+
+# Detector tuning, overridable from the environment
+FRAME_MS = int(os.environ.get("CCA_VAD_FRAME_MS", "20"))
+HANGOVER_MS = int(os.environ.get("CCA_VAD_HANGOVER_MS", "300"))
+MIN_SPEECH_MS = int(os.environ.get("CCA_VAD_MIN_SPEECH_MS", "120"))
+MARGIN_DB = float(os.environ.get("CCA_VAD_MARGIN_DB", "9"))
+ABSOLUTE_FLOOR_DB = float(os.environ.get("CCA_VAD_FLOOR_DB", "-55"))
+MAX_SILENCE_MS = int(os.environ.get("CCA_VAD_MAX_SILENCE_MS", "600"))
+COMPACT_RECORDINGS = os.environ.get("CCA_VAD_COMPACT", "0") == "1"
+NOISE_RISE_MS = 5000.0
+
+# Unvoiced consonants are quiet but cross zero a lot; count them as speech
+# when they are at least halfway above the noise floor
+FRICATIVE_ZCR = (0.25, 0.65)
+
+
+# Per-frame energy (dBFS) and zero-crossing rate over a whole chunk at once
+def frame_features(pcm, frame_len):
+    count = len(pcm) // frame_len
+    if not count:
+        return np.empty(0), np.empty(0)
+    frames = pcm[:count * frame_len].reshape(count, frame_len).astype(np.float32)
+    energy = np.einsum("ij,ij->i", frames, frames) / frame_len
+    energy_db = 10.0 * np.log10(energy / (32768.0 * 32768.0) + 1e-12)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_len - 1)
+    return energy_db, zcr
+
+
+class StreamingVad:
+    # Energy/ZCR detector that can be fed chunk by chunk (LegTap sink) or a
+    # whole file at once. Closed segments are [start_ms, end_ms] lists.
+    def __init__(self, sample_rate=None, on_segment=None):
+        self.sample_rate = None
+        self.on_segment = on_segment
+        self.segments = []
+        self.noise_floor = None
+        self.frames_seen = 0
+        self.speech_frames = 0
+        self.in_speech = False
+        self.segment_start = 0
+        self.last_speech = 0
+        self.remainder = np.empty(0, dtype=np.int16)
+        if sample_rate:
+            self._configure(sample_rate)
+
+    def _configure(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.frame_len = sample_rate * FRAME_MS // 1000
+        self.hangover = HANGOVER_MS // FRAME_MS
+        self.min_speech = max(1, MIN_SPEECH_MS // FRAME_MS)
+
+    # LegTap sink signature
+    def __call__(self, pcm, rate):
+        self.push(pcm, rate)
+
+    def push(self, pcm, rate=None):
+        if self.sample_rate is None:
+            self._configure(rate)
+        if len(self.remainder):
+            pcm = np.concatenate((self.remainder, pcm))
+        energy_db, zcr = frame_features(pcm, self.frame_len)
+        self.remainder = pcm[len(energy_db) * self.frame_len:]
+        if len(energy_db):
+            self._decide(energy_db, zcr)
+
+    def _decide(self, energy_db, zcr):
+        # Track the noise floor: fall at once, rise with a NOISE_RISE_MS time constant
+        quiet = float(np.percentile(energy_db, 10))
+        if self.noise_floor is None or quiet < self.noise_floor:
+            self.noise_floor = quiet
+        else:
+            self.noise_floor += (1.0 - np.exp(-len(energy_db) * FRAME_MS / NOISE_RISE_MS)) * (quiet - self.noise_floor)
+        floor = max(self.noise_floor, ABSOLUTE_FLOOR_DB)
+
+        above = energy_db - floor
+        speech = (above > MARGIN_DB) | ((above > MARGIN_DB / 2) & (zcr > FRICATIVE_ZCR[0]) & (zcr < FRICATIVE_ZCR[1]))
+        speech &= energy_db > ABSOLUTE_FLOOR_DB
+        self.speech_frames += int(np.count_nonzero(speech))
+
+        # Only the run boundaries are walked in Python; there are few per chunk
+        base = self.frames_seen
+        edges = np.diff(np.concatenate(([0], speech.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1) + base
+        ends = np.flatnonzero(edges == -1) + base
+        self.frames_seen += len(speech)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if self.in_speech and start - self.last_speech <= self.hangover:
+                self.last_speech = end
+                continue
+            if self.in_speech:
+                self._close()
+            self.in_speech = True
+            self.segment_start = start
+            self.last_speech = end
+
+        if self.in_speech and self.frames_seen - self.last_speech > self.hangover:
+            self._close()
+
+    def _close(self):
+        self.in_speech = False
+        end = min(self.last_speech + self.hangover, self.frames_seen)
+        if self.last_speech - self.segment_start < self.min_speech:
+            return
+        segment = [self.segment_start * FRAME_MS, end * FRAME_MS]
+        self.segments.append(segment)
+        if self.on_segment:
+            self.on_segment(segment)
+
+    def finish(self):
+        if self.in_speech:
+            self._close()
+        return self.segments
+
+    def close(self):
+        self.finish()
+
+    @property
+    def speech_ratio(self):
+        return self.speech_frames / self.frames_seen if self.frames_seen else 0.0
+
+
+def detect_speech(pcm, sample_rate):
+    detector = StreamingVad(sample_rate)
+    detector.push(pcm)
+    return detector.finish(), detector.speech_ratio
+
+
+# Shorten silences longer than max_silence_ms to max_silence_ms (half kept at
+# each edge). Returns the compacted audio and a timestamp map of
+# [compacted_ms, original_ms] anchors, one per kept span.
+def compact_silence(pcm, sample_rate, segments, max_silence_ms=MAX_SILENCE_MS):
+    per_ms = sample_rate / 1000.0
+    keep_edge = int(max_silence_ms * per_ms / 2)
+    total = len(pcm)
+
+    spans = []
+    cursor = 0
+    for start_ms, end_ms in segments + [[total / per_ms, total / per_ms]]:
+        start, end = int(start_ms * per_ms), min(int(end_ms * per_ms), total)
+        gap = start - cursor
+        if gap > 2 * keep_edge:
+            spans.append((cursor, cursor + keep_edge))
+            cursor = start - keep_edge
+        spans.append((cursor, end))
+        cursor = end
+
+    merged = []
+    for start, end in spans:
+        if end <= start:
+            continue
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    timestamp_map = []
+    out = 0
+    for start, end in merged:
+        timestamp_map.append([round(out / per_ms), round(start / per_ms)])
+        out += end - start
+    compacted = np.concatenate([pcm[s:e] for s, e in merged]) if merged else pcm[:0]
+    return compacted, timestamp_map
+
+
+# Translate a position in the compacted file back to the original timeline
+def original_time(compacted_ms, timestamp_map):
+    if not timestamp_map:
+        return compacted_ms
+    index = bisect.bisect_right([anchor[0] for anchor in timestamp_map], compacted_ms) - 1
+    out_ms, in_ms = timestamp_map[max(index, 0)]
+    return in_ms + (compacted_ms - out_ms)
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM is supported")
+        rate, channels = w.getframerate(), w.getnchannels()
+        pcm = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+    if channels > 1:
+        pcm = pcm.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return pcm, rate
+
+
+def write_wav_atomic(path, pcm, sample_rate):
+    tmp = f"{path}.tmp"
+    with wave.open(tmp, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm.astype("<i2", copy=False).tobytes())
+    os.replace(tmp, path)
+
+
+def sidecar_path(path):
+    return f"{path}.vad.json"
+
+
+# Analyse a stored recording; optionally compact it in place. Segments from
+# the live detector can be passed in to skip re-analysis.
+def process_file(path, compact=False, segments=None, max_silence_ms=MAX_SILENCE_MS):
+    pcm, rate = read_wav(path)
+    if segments is None:
+        segments, ratio = detect_speech(pcm, rate)
+    else:
+        speech_ms = sum(end - start for start, end in segments)
+        ratio = speech_ms / (len(pcm) * 1000.0 / rate) if len(pcm) else 0.0
+
+    meta = {
+        "duration_ms": round(len(pcm) * 1000 / rate),
+        "speech_ratio": round(ratio, 4),
+        "segments": segments,
+    }
+    if compact:
+        compacted, timestamp_map = compact_silence(pcm, rate, segments, max_silence_ms)
+        write_wav_atomic(path, compacted, rate)
+        meta["compacted_ms"] = round(len(compacted) * 1000 / rate)
+        meta["timestamp_map"] = timestamp_map
+
+    with open(sidecar_path(path), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mark speech in recordings and optionally compact silences")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--compact", action="store_true", help="rewrite the file with long silences shortened")
+    parser.add_argument("--max-silence-ms", type=int, default=MAX_SILENCE_MS)
+    args = parser.parse_args()
+
+    for path in args.files:
+        meta = process_file(path, args.compact, max_silence_ms=args.max_silence_ms)
+        summary = f"{path}: {meta['duration_ms'] / 1000:.1f}s, speech {meta['speech_ratio']:.0%}, {len(meta['segments'])} segments"
+        if args.compact:
+            summary += f", compacted to {meta['compacted_ms'] / 1000:.1f}s"
+        print(summary)
+
+
+if __name__ == "__main__":
+    main()